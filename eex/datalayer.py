@@ -2,7 +2,9 @@
 Contains the DataLayer class (name in progress) which takes and reads various pieces of data
 """
 
+import collections
 import copy
+import functools
 import json
 import os
 
@@ -16,10 +18,28 @@ from . import units
 from . import utility
 from . import testing
 from . import nb_converter
+from . import nb_store
 
 APC_DICT = metadata.atom_property_to_column
 
 
+def _mutation(func):
+    """
+    Marks a DataLayer method that modifies the energy expression, any cached evaluations are dropped.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self._revision += 1
+            if self._evaluate_cache is not None:
+                self._evaluate_cache.clear()
+
+    return wrapper
+
+
 class DataLayer(object):
     def __init__(self, name, store_location=None, save_data=False, backend="Memory"):
         """
@@ -49,6 +69,10 @@ class DataLayer(object):
 
         # Setup empty term holder
         self._terms = {order: {} for order in [2, 3, 4]}
+
+        # Term parameter lookup, {(term_name, key): [(position, uid), ...]} buckets and the lowest free uid
+        self._term_index = {order: {} for order in [2, 3, 4]}
+        self._term_free_uid = {order: 0 for order in [2, 3, 4]}
         self._term_count = {order: {"total": 0} for order in [2, 3, 4]}
 
         # Setup atom holders
@@ -62,7 +86,7 @@ class DataLayer(object):
         self._atom_counts = {k: 0 for k in list(metadata.atom_metadata)}
 
         # Set up empty nonbond holders
-        self._nb_parameters = {}
+        self._nb_parameters = nb_store.NBParameterStore()
         self._nb_scaling_factors = {}
         self._nb_metadata = {}
 
@@ -70,6 +94,12 @@ class DataLayer(object):
         self._box_size = {}
         self._box_center = {}
         self._mixing_rule = ''
+        self._electrostatics = {}
+
+        # Opt-in memoization of evaluate, see set_evaluate_cache
+        self._revision = 0
+        self._evaluate_cache = None
+        self._evaluate_cache_size = 0
 
 ### Generic helper close/save/list/etc functions
 
@@ -107,6 +137,7 @@ class DataLayer(object):
         """
         return [x.replace("other_", "") for x in self.store.list_tables() if x.startswith("other_")]
 
+    @_mutation
     def set_mixing_rule(self, mixing_rule):
         """
         Store a mixing rule in the datalayer.
@@ -136,6 +167,7 @@ class DataLayer(object):
         ret = copy.deepcopy(self._mixing_rule)
         return ret
 
+    @_mutation
     def set_box_center(self, box_center, utype=None):
         """
         Sets the center of the box.
@@ -189,6 +221,7 @@ class DataLayer(object):
         else:
             return ret
 
+    @_mutation
     def set_nb_scaling_factors(self, nb_scaling_factors):
         """
         Sets the exclusion information for the datalayer
@@ -235,6 +268,7 @@ class DataLayer(object):
 
         return ret
 
+    @_mutation
     def set_nb_pair_interaction(self):
         """
         Set a special interaction between two particles
@@ -242,6 +276,7 @@ class DataLayer(object):
         """
         return False
 
+    @_mutation
     def set_pair_scalings(self, scaling_df):
         """
         Set scaling factor for nonbond interaction between two atoms using multi-level indexing.
@@ -321,6 +356,7 @@ class DataLayer(object):
 
         return ret
 
+    @_mutation
     def build_scaling_list(self):
         """
         Build pair scalings based on parameters set in set_nb_scaling_factors.
@@ -342,6 +378,7 @@ class DataLayer(object):
 
         return True
 
+    @_mutation
     def set_box_size(self, lattice_const, utype=None):
         """
         Sets the box lattice constants for the datalayer
@@ -408,12 +445,208 @@ class DataLayer(object):
         else:
             return ret
 
-    def evaluate(self, utype=None):
+    @_mutation
+    def set_electrostatics(self, method, cutoff, parameters=None, utype=None):
+        """
+        Sets the electrostatics method used when evaluating nonbonded terms.
+
+        Parameters
+        ----------
+        method : {"cut", "ewald", "pme", "pppm", "wolf", "dsf"}
+            The electrostatics method, described in `metadata.additional_metadata._electrostatics`.
+        cutoff : float
+            The real space cutoff
+        parameters : dict, optional
+            The parameters of the method (eg {"g_ewald": 0.3, "order": 5}). Missing Ewald parameters are derived from
+            the cutoff and accuracy during evaluation.
+        utype : dict, optional
+            The units of the cutoff and parameters, keyed by name.
+        """
+
+        electrostatics_md = metadata.additional_metadata._electrostatics
+        if method not in energy_eval.nb_eval._electrostatics_methods:
+            raise KeyError("DataLayer:set_electrostatics: Electrostatics method '%s' not understood." % method)
+
+        method_md = electrostatics_md[method]
+
+        if parameters is None:
+            parameters = {}
+
+        valid_parameters = set(method_md["parameters"]) | set(method_md["units"])
+        if not set(parameters) <= valid_parameters:
+            invalid = sorted(set(parameters) - valid_parameters)
+            raise KeyError("DataLayer:set_electrostatics: Parameters %s not valid for method '%s'." % (invalid, method))
+
+        parameters = copy.deepcopy(parameters)
+        if utype is not None:
+            if not isinstance(utype, dict):
+                raise TypeError("DataLayer:set_electrostatics: Unit type '%s' not understood" % str(type(utype)))
+
+            # Convert to internal units, counts and dimensionless values are left alone
+            contexts = {"cutoff": electrostatics_md["cutoff"]}
+            contexts.update(method_md["units"])
+            if "cutoff" in utype:
+                cutoff *= units.conversion_factor(utype["cutoff"], units.convert_contexts(contexts["cutoff"]))
+            for k in parameters:
+                if (k in utype) and ("[" in contexts.get(k, "")):
+                    parameters[k] *= units.conversion_factor(utype[k], units.convert_contexts(contexts[k]))
+
+        self._electrostatics = {"method": method, "cutoff": cutoff, "parameters": parameters}
+
+    def get_electrostatics(self):
+        """
+        Retrieves the electrostatics method, cutoff, and parameters from the datalayer.
+        """
+
+        return copy.deepcopy(self._electrostatics)
+
+    def evaluate(self, utype=None, nonbonded=False, forces=False, decompose=False, nprocs=1):
         """
         Evaluate the current state of the energy expression.
+
+        Parameters
+        ----------
+        utype : str, optional
+            The energy units of the output, defaults to the internal energy units.
+        nonbonded : bool, optional
+            If True, includes the pairwise "vdw" and "coul" energies. Without electrostatics settings the system is
+            treated as isolated, otherwise pairs within the cutoff are evaluated and Ewald methods add "coul_long",
+            see `set_electrostatics`. With the HDF5 backend the term tables are streamed from disk in chunks, see
+            `energy_eval.evaluate_energy_streaming`.
+        forces : bool, optional
+            If True, also returns the (N, 3) analytic forces of the bonded terms in the order of `get_atoms("xyz")`,
+            in units of the output energy per internal length unit.
+        decompose : bool, optional
+            If True, also returns the bonded energy per term uid, per atom, per molecule, and per residue.
+        nprocs : int, optional
+            If larger than one, the energy is evaluated by a pool of worker processes, see
+            `energy_eval.evaluate_energy_parallel`. Not available with `forces` or `decompose`.
+
+        Returns
+        -------
+        energy : dict
+            The energy of each component and the total energy
+        forces : np.ndarray
+            The (N, 3) forces, only returned if `forces` is True
+        decomposition : dict
+            The "uid", "atom", "molecule", and "residue" energies, only returned if `decompose` is True
+        """
+
+        if nprocs > 1 and (forces or decompose):
+            raise ValueError("DataLayer:evaluate: Forces and decompositions are not available with nprocs > 1.")
+
+        if self._evaluate_cache is None:
+            return self._evaluate(utype, nonbonded, forces, decompose, nprocs)
+
+        # Every add_* and set_* call bumps the revision, which therefore identifies the energy expression
+        key = (self._revision, str(utype), nonbonded, forces, decompose, nprocs > 1)
+        if key in self._evaluate_cache:
+            ret = self._evaluate_cache.pop(key)
+            self._evaluate_cache[key] = ret
+            return copy.deepcopy(ret)
+
+        ret = self._evaluate(utype, nonbonded, forces, decompose, nprocs)
+
+        self._evaluate_cache[key] = copy.deepcopy(ret)
+        while len(self._evaluate_cache) > self._evaluate_cache_size:
+            self._evaluate_cache.popitem(last=False)
+
+        return ret
+
+    def _evaluate(self, utype, nonbonded, forces, decompose, nprocs):
+        if nprocs > 1:
+            return energy_eval.evaluate_energy_parallel(self, utype=utype, nonbonded=nonbonded, nprocs=nprocs)
+
+        # Disk backed terms are streamed rather than read whole
+        if isinstance(self.store, filelayer.HDFStore) and not (forces or decompose):
+            return energy_eval.evaluate_energy_streaming(self, utype=utype, nonbonded=nonbonded)
+
+        return energy_eval.evaluate_energy_expression(
+            self, utype=utype, nonbonded=nonbonded, forces=forces, decompose=decompose)
+
+    def set_evaluate_cache(self, maxsize=8):
+        """
+        Enables memoization of `evaluate`.
+
+        Results are keyed on the arguments of `evaluate`. Every add_* and set_* call drops the cached results, so
+        tables edited directly through the store are not detected.
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            The number of results kept, the least recently used are dropped first. If zero, caching is disabled.
+        """
+
+        maxsize = int(maxsize)
+        if maxsize < 0:
+            raise ValueError("DataLayer:set_evaluate_cache: maxsize must be non-negative, found %d." % maxsize)
+
+        self._evaluate_cache_size = maxsize
+        self._evaluate_cache = collections.OrderedDict() if maxsize else None
+
+    def evaluate_frames(self, frames, utype=None, nonbonded=False):
+        """
+        Evaluate the energy expression for many sets of coordinates without changing the stored coordinates.
+
+        Parameters
+        ----------
+        frames : {np.ndarray, iterable}
+            A (nframes, N, 3) coordinate stack or an iterable of (N, 3) frames in the atom order of
+            `get_atoms("xyz")` and in the internal length units.
+        utype : str, optional
+            The energy units of the output, defaults to the internal energy units.
+        nonbonded : bool, optional
+            If True, includes the pairwise "vdw" and "coul" energies, see `evaluate`.
+
+        Returns
+        -------
+        energy : dict of np.ndarray
+            The (nframes, ) energy of each component and the total energy
+        """
+
+        return energy_eval.evaluate_energy_frames(self, frames, utype=utype, nonbonded=nonbonded)
+
+    def evaluate_parameter_sweep(self, candidates, utype=None):
+        """
+        Evaluate the bonded energy expression for many candidate term parameter sets at the stored coordinates.
+
+        Parameters
+        ----------
+        candidates : dict
+            A {(order, uid): values} dictionary of (ncandidates, nparameters) arrays or of dictionaries of
+            (ncandidates, ) arrays keyed by parameter name, in the internal units, see
+            `energy_eval.evaluate_parameter_sweep`.
+        utype : str, optional
+            The energy units of the output, defaults to the internal energy units.
+
+        Returns
+        -------
+        energy : dict of np.ndarray
+            The (ncandidates, ) energy of each bonded component and the total energy
+        """
+
+        return energy_eval.evaluate_parameter_sweep(self, candidates, utype=utype)
+
+    def evaluate_parameter_jacobian(self, utype=None, nonbonded=False):
+        """
+        Evaluate the analytic derivatives of the energy with respect to every stored parameter.
+
+        Parameters
+        ----------
+        utype : str, optional
+            The energy units of the output, defaults to the internal energy units. Parameters are always in the
+            internal units.
+        nonbonded : bool, optional
+            If True, includes the derivatives with respect to the van der Waals pair parameters.
+
+        Returns
+        -------
+        jacobian : dict of pd.DataFrame
+            The "terms" (order, uid) x parameter matrix and the "nonbonded" (atom_type1, atom_type2) x parameter
+            matrix, see `energy_eval.evaluate_parameter_jacobian`.
         """
 
-        return energy_eval.evaluate_energy_expression(self, utype=utype)
+        return energy_eval.evaluate_parameter_jacobian(self, utype=utype, nonbonded=nonbonded)
 
 ### Atom functions
 
@@ -430,6 +663,9 @@ class DataLayer(object):
     def _find_unqiue_atom_values(self, df, property_name):
         """
         Hashes the input parameters to build in internal index of unique values.
+
+        Rows are factorized in a single pass, floats are first rounded to the `tol` of the property, so only the
+        distinct values are hashed and looked up. New values receive the lowest free uids in sorted value order.
         """
 
         field_data = metadata.atom_metadata[property_name]
@@ -437,35 +673,49 @@ class DataLayer(object):
 
         cols = field_data["required_columns"]
 
-        if field_data["dtype"] == float:
-            df = df[cols].round(field_data["tol"])
-
-        ret_df = pd.DataFrame(index=df.index)
-        ret_df[property_name] = 0
-
-        # For each unique value
-        for gb_idx, udf in df.groupby(cols):
-
-            if isinstance(gb_idx, tuple):
-                gb_dict = {k: v for k, v in zip(cols, gb_idx)}
-            else:
-                gb_dict = {cols[0]: gb_idx}
-
+        # Factorize every column in sorted order, missing values have a code of -1
+        codes = []
+        uniques = []
+        for col in cols:
+            values = df[col]
+            if field_data["dtype"] == float:
+                values = np.round(values.values.astype(np.float64), field_data["tol"]) + 0.0
+            col_codes, col_uniques = pd.factorize(values, sort=True)
+            codes.append(col_codes)
+            uniques.append(col_uniques)
+
+        ret = np.zeros(df.shape[0], dtype=int)
+        valid = np.all(np.column_stack(codes) >= 0, axis=1)
+        if not np.any(valid):
+            return pd.DataFrame({property_name: ret}, index=df.index)
+
+        # Distinct value tuples in lexicographic order
+        shape = tuple(x.shape[0] for x in uniques)
+        flat = np.ravel_multi_index(tuple(x[valid] for x in codes), shape)
+        flat_unique, inverse = np.unique(flat, return_inverse=True)
+        unique_codes = np.unravel_index(flat_unique, shape)
+
+        used = set(param_dict["inv_uvals"])
+        new_key = 0
+        uids = np.zeros(flat_unique.shape[0], dtype=int)
+        for num in range(flat_unique.shape[0]):
+            gb_dict = {col: uniques[x][unique_codes[x][num]] for x, col in enumerate(cols)}
             gb_hash = utility.hash(gb_dict)
 
             # Update dictionary if necessary
             if gb_hash not in param_dict["uvals"]:
 
-                # Bidirectional dictionary
-                new_key = utility.find_lowest_hole(list(param_dict["inv_uvals"]))
+                # Bidirectional dictionary, the lowest unused key
+                while new_key in used:
+                    new_key += 1
+                used.add(new_key)
                 param_dict["uvals"][gb_hash] = new_key
                 param_dict["inv_uvals"][new_key] = gb_dict
 
-            # Grab the unique and set
-            uidx = param_dict["uvals"][gb_hash]
-            ret_df.loc[udf.index, property_name] = uidx
+            uids[num] = param_dict["uvals"][gb_hash]
 
-        return ret_df
+        ret[valid] = uids[inverse]
+        return pd.DataFrame({property_name: ret}, index=df.index)
 
     def _build_atom_values(self, df, property_name):
         """
@@ -475,11 +725,13 @@ class DataLayer(object):
         param_dict = self._atom_metadata[property_name]
 
         cols = field_data["required_columns"]
-        ret_df = pd.DataFrame(index=df.index, columns=cols, dtype=field_data["dtype"])
-        for gb_idx, udf in df.groupby(cols):
-            gb_dict = param_dict["inv_uvals"][gb_idx]
-            for col in cols:
-                ret_df.loc[udf.index, col] = gb_dict[col]
+
+        # Each distinct uid is looked up once and taken onto its rows
+        uids, inverse = np.unique(df[property_name].values, return_inverse=True)
+        ret_df = pd.DataFrame(index=df.index)
+        for col in cols:
+            table = np.array([param_dict["inv_uvals"][uid][col] for uid in uids], dtype=field_data["dtype"])
+            ret_df[col] = table[inverse]
 
         return ret_df
 
@@ -521,9 +773,9 @@ class DataLayer(object):
 
         return self.store.add_table(table_name, tmp_df)
 
-    def _get_atom_table(self, table_name, property_name, by_value, utype):
+    def _get_atom_table(self, table_name, property_name, by_value, utype, rows=None):
 
-        tmp = self.store.read_table(table_name)
+        tmp = self.store.read_table(table_name, rows=rows)
 
         # Expand the data from unique
         if by_value and not (metadata.atom_metadata[property_name]["unique"]):
@@ -538,6 +790,7 @@ class DataLayer(object):
 
         return tmp
 
+    @_mutation
     def add_atom_parameter(self, property_name, value, uid=None, utype=None, allow_duplicates=False):
         """
         Adds atom parameters to the Datalayer object
@@ -576,7 +829,6 @@ class DataLayer(object):
         """
 
         property_name = self._check_atoms_dict(property_name)
-        param_dict = self._atom_metadata[property_name]
         field_data = metadata.atom_metadata[property_name]
 
         # Parse value
@@ -597,6 +849,69 @@ class DataLayer(object):
         value = metadata.validate_term_dict(property_name, tmp, value, utype=utype)
         value = {k: v for k, v in zip(field_data["required_columns"], value)}
 
+        return self._add_atom_parameter(property_name, value, uid, allow_duplicates)
+
+    @_mutation
+    def add_atom_parameters(self, property_name, df, uid_col=None, utype=None, allow_duplicates=False):
+        """
+        Adds a table of atom parameters to the Datalayer object
+
+        The table is validated and converted to the internal units in a single pass, one conversion factor per column.
+        Identical rows are registered once, every row is otherwise treated as a call to `add_atom_parameter` in table
+        order.
+
+        Parameters
+        ----------
+        property_name : str
+            The name of the atom property to be added
+        df : pd.DataFrame
+            A table with a column for each required column of the atom property
+        uid_col : str, optional
+            The column holding the uid to assign to each row, otherwise uids are assigned as in `add_atom_parameter`.
+        utype : {str, dict}, optional
+            Custom units for the property columns, otherwise uses the default units of the atom property.
+        allow_duplicates : bool, optional
+            If True, a value may be added under a uid even if it is already known under another uid.
+
+        Returns
+        -------
+        uids : np.ndarray
+            The uid of every row of the table
+
+        Examples
+        --------
+
+        df = pd.DataFrame({"uid": [1, 2], "charge": [-0.8, 0.4]})
+        assert [1, 2] == dl.add_atom_parameters("charge", df, uid_col="uid").tolist()
+        """
+
+        property_name = self._check_atoms_dict(property_name)
+        field_data = metadata.atom_metadata[property_name]
+
+        if (utype is not None) and not isinstance(utype, dict):
+            utype = {field_data["required_columns"][0]: utype}
+
+        tmp = {"parameters": field_data["required_columns"], "utype": field_data["utype"]}
+        params = metadata.validate_term_table(property_name, tmp, df, utype=utype)
+        uids = self._parse_uid_column(df, uid_col, "add_atom_parameters")
+
+        rows, inverse = self._unique_parameter_rows(params, uids)
+        ret = []
+        for row in rows:
+            value = {k: v for k, v in zip(field_data["required_columns"], params[row].tolist())}
+            uid = None if uids is None else int(uids[row])
+            ret.append(self._add_atom_parameter(property_name, value, uid, allow_duplicates))
+
+        return np.array(ret, dtype=int)[inverse]
+
+    def _add_atom_parameter(self, property_name, value, uid, allow_duplicates):
+        """
+        Adds a validated atom parameter in the internal units, see `add_atom_parameter`.
+        """
+
+        param_dict = self._atom_metadata[property_name]
+        field_data = metadata.atom_metadata[property_name]
+
         # Round the floats
         if field_data["dtype"] == float:
             value = {k: round(v, field_data["tol"]) for k, v in value.items()}
@@ -717,6 +1032,7 @@ class DataLayer(object):
         else:
             raise KeyError("DataLayer:list_atom_uids: '%s' is not stored as unique values." % property_name)
 
+    @_mutation
     def add_atoms(self, atom_df, by_value=False, utype=None):
         """
         Adds atom information to the DataLayer object.
@@ -782,7 +1098,7 @@ class DataLayer(object):
 
         return True
 
-    def get_atoms(self, properties, by_value=False, utype=None):
+    def get_atoms(self, properties, by_value=False, utype=None, rows=None):
         """
         Obtains atom information to the DataLayer object.
 
@@ -792,6 +1108,8 @@ class DataLayer(object):
             The properties to obtain for the atom data.
         by_value : bool
             If true returns the property by value, otherwise returns by index.
+        rows : array_like, optional
+            If given, only reads these integer row positions of each property table, see `get_atom_index`.
 
         Returns
         -------
@@ -828,11 +1146,58 @@ class DataLayer(object):
             uval = None
             if prop in utype:
                 uval = utype[prop]
-            tmp = self._get_atom_table(prop, prop, by_value, uval)
+            tmp = self._get_atom_table(prop, prop, by_value, uval, rows=rows)
             df_data.append(tmp)
 
         return pd.concat(df_data, axis=1)
 
+    def get_atom_index(self, property_name):
+        """
+        Obtains the atom_index of a property table in its stored row order without reading the property values.
+
+        Parameters
+        ----------
+        property_name : str
+            The name of the atom property
+
+        Returns
+        -------
+        return : pd.Index
+            The atom_index of every row of the property table
+        """
+
+        property_name = property_name.lower()
+        if property_name not in metadata.atom_property_to_column:
+            raise KeyError("DataLayer:get_atom_index: Property name '%s' not recognized." % property_name)
+
+        return self.store.read_index(property_name)
+
+    def get_whole_xyz(self):
+        """
+        Obtains the xyz table with every molecule unwrapped across the periodic boundaries.
+
+        Molecules are found from the bond graph, see `energy_eval.geometry.make_whole`. The stored coordinates are not
+        modified.
+
+        Returns
+        -------
+        return : pd.DataFrame
+            The unwrapped coordinates in the order and internal units of `get_atoms("xyz")`
+        """
+
+        xyz = self.get_atoms("xyz")
+        box, _ = energy_eval.neighbor_list.box_from_datalayer(self)
+        if box is None:
+            return xyz
+
+        bonds = self.get_bonds()
+        positions = np.column_stack([xyz.index.get_indexer(bonds[x]) for x in ["atom1", "atom2"]])
+        if np.any(positions < 0):
+            raise KeyError("DataLayer:get_whole_xyz: Bonded atom indices are not in the xyz table.")
+
+        whole = energy_eval.geometry.make_whole(xyz[["X", "Y", "Z"]].values, positions, box)
+        return pd.DataFrame(whole, index=xyz.index, columns=["X", "Y", "Z"])
+
     def list_valid_atom_properties(self):
         """
         Returns all possible atom properties which can be stored in the datalayer
@@ -841,6 +1206,7 @@ class DataLayer(object):
 
 ### Term functions
 
+    @_mutation
     def add_term_parameter(self, order, term_name, term_parameters, uid=None, utype=None):
         """
         Adds parameters for a given fuctional form.
@@ -885,12 +1251,115 @@ class DataLayer(object):
         # Validate and converate data as needed
         params = metadata.validate_term_dict(term_name, term_md, term_parameters, utype=utype)
 
+        return self._add_term_parameter(order, term_name, params, uid)
+
+    @_mutation
+    def add_term_parameters(self, order, term_name, df, uid_col=None, utype=None):
+        """
+        Adds a table of parameters for a given functional form.
+
+        The table is validated and converted to the internal units in a single pass, one conversion factor per column.
+        Identical rows are registered once, every row is otherwise treated as a call to `add_term_parameter` in table
+        order.
+
+        Parameters
+        ----------
+        order : int
+            The order of the functional form (2, 3, 4, ...)
+        term_name : str
+            The name of the functional form you are adding.
+        df : pd.DataFrame
+            A table with a column for each parameter of the functional form.
+        uid_col : str, optional
+            The column holding the uid to assign to each row, otherwise uids are assigned as in `add_term_parameter`.
+        utype : {list, tuple, dict}, optional
+            Custom units for the parameter columns, otherwise uses the default units in the registered functional form.
+
+        Returns
+        -------
+        uids : np.ndarray
+            The uid of every row of the table
+
+        Examples
+        --------
+
+        df = pd.DataFrame({"K": [300.0, 350.0, 300.0], "R0": [1.5, 1.4, 1.5]})
+        assert [0, 1, 0] == dl.add_term_parameters(2, "harmonic", df).tolist()
+        """
+
+        order = metadata.sanitize_term_order_name(order)
+
+        # Make sure we know what this is
+        try:
+            term_md = metadata.get_term_metadata(order, "forms", term_name)
+        except KeyError:
+            raise KeyError("DataLayer:add_term_parameters: Did not understand term order: %d, name: %s'." %
+                           (order, term_name))
+
+        params = metadata.validate_term_table(term_name, term_md, df, utype=utype)
+        uids = self._parse_uid_column(df, uid_col, "add_term_parameters")
+
+        rows, inverse = self._unique_parameter_rows(params, uids)
+        ret = []
+        for row in rows:
+            uid = None if uids is None else int(uids[row])
+            ret.append(self._add_term_parameter(order, term_name, params[row].tolist(), uid))
+
+        return np.array(ret, dtype=int)[inverse]
+
+    @staticmethod
+    def _parse_uid_column(df, uid_col, func_name):
+        """
+        Obtains an integer uid column of a parameter table, None if no column is given.
+        """
+
+        if uid_col is None:
+            return None
+
+        if uid_col not in df.columns:
+            raise KeyError("DataLayer:%s: Did not find the uid column '%s'." % (func_name, uid_col))
+
+        uids = df[uid_col].values
+        if not np.issubdtype(uids.dtype, np.integer):
+            if not (np.issubdtype(uids.dtype, np.floating) and np.all(uids == np.rint(uids))):
+                raise TypeError("DataLayer:%s: uid column must be of integer type, found type '%s'." % (func_name,
+                                                                                                        uids.dtype))
+        return uids.astype(int)
+
+    @staticmethod
+    def _unique_parameter_rows(params, uids):
+        """
+        Finds the distinct (uid, parameters) rows of a parameter table.
+
+        Registering a row twice returns the same uid, so each distinct row only needs to be registered once. Rows that
+        are not finite never match and are always registered.
+
+        Returns
+        -------
+        rows : np.ndarray
+            The first row of every distinct row in table order
+        inverse : np.ndarray
+            The position of every table row into `rows`
+        """
+
+        table = params if uids is None else np.column_stack((uids, params))
+        if (table.shape[0] == 0) or not np.all(np.isfinite(params)):
+            return np.arange(table.shape[0]), np.arange(table.shape[0])
+
+        _, first, inverse = np.unique(table, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0])
+
+        return first[order], rank[inverse]
+
+    def _add_term_parameter(self, order, term_name, params, uid):
+        """
+        Adds validated parameters in the internal units, see `add_term_parameter`.
+        """
+
         # First we check if we already have it
-        found_key = None
-        for k, v in self._terms[order].items():
-            if (v[0] == term_name) and np.allclose(v[1:], params):
-                found_key = k
-                break
+        found_key = self._find_term_parameter(order, term_name, params)
 
         # Figure out what actually to do
         if uid is None:
@@ -898,14 +1367,9 @@ class DataLayer(object):
             if found_key is not None:
                 return found_key
 
-            # We have a new parameter! Find the lowest number that we can add it at.
-            if not len(self._terms[order]):
-                new_key = 0
-            else:
-                new_key = utility.find_lowest_hole(self._terms[order])
-
-            params.insert(0, term_name)
-            self._terms[order][new_key] = params
+            # We have a new parameter! Add it at the lowest free uid.
+            new_key = self._term_free_uid[order]
+            self._store_term_parameter(order, new_key, term_name, params)
 
             return new_key
 
@@ -926,11 +1390,54 @@ class DataLayer(object):
                     return uid
 
             else:
-                params.insert(0, term_name)
-                self._terms[order][uid] = params
+                self._store_term_parameter(order, uid, term_name, params)
 
                 return uid
 
+    def _find_term_parameter(self, order, term_name, params):
+        """
+        Finds the first stored uid whose parameters are np.allclose to params.
+
+        Only the parameters sharing a bucket of `utility.allclose_keys` are compared, parameters that are not finite
+        fall back to comparing every stored uid.
+        """
+
+        keys = utility.allclose_keys(params)
+        if keys is None:
+            for k, v in self._terms[order].items():
+                if (v[0] == term_name) and np.allclose(v[1:], params):
+                    return k
+            return None
+
+        # The earliest stored match, as a scan in insertion order would find
+        found = None
+        for key in keys:
+            for position, uid in self._term_index[order].get((term_name, key), []):
+                if (found is not None) and (position > found[0]):
+                    continue
+                if np.allclose(self._terms[order][uid][1:], params):
+                    found = (position, uid)
+
+        if found is None:
+            return None
+        return found[1]
+
+    def _store_term_parameter(self, order, uid, term_name, params):
+        """
+        Stores the parameters of a new uid and updates the lookup buckets and the lowest free uid.
+        """
+
+        keys = utility.allclose_keys(params)
+        if keys is not None:
+            bucket = self._term_index[order].setdefault((term_name, keys[0]), [])
+            bucket.append((len(self._terms[order]), uid))
+
+        self._terms[order][uid] = [term_name] + list(params)
+
+        # uids are never removed, so the lowest free uid only moves up
+        while self._term_free_uid[order] in self._terms[order]:
+            self._term_free_uid[order] += 1
+
     def get_term_parameter(self, order, uid=None, utype=None):
 
         order = metadata.sanitize_term_order_name(order)
@@ -1021,6 +1528,7 @@ class DataLayer(object):
 
         return self._term_count[order][uid]
 
+    @_mutation
     def add_terms(self, order, df):
         """
         Adds terms using a index notation.
@@ -1068,17 +1576,37 @@ class DataLayer(object):
         # Finally store the dataframe
         return self.store.add_table("term" + str(order), df)
 
-    def get_terms(self, order):
+    def get_terms(self, order, chunksize=None):
+        """
+        Obtains the terms of a given order.
+
+        Parameters
+        ----------
+        order : {str, int}
+            The order (number of atoms) involved in the expression i.e. 2, "two"
+        chunksize : int, optional
+            If given, returns an iterator over DataFrames of at most chunksize terms so that large tables of the HDF5
+            backend are never held in memory at once.
+
+        Returns
+        -------
+        return : {pd.DataFrame, iterator}
+            The term table, or an iterator over consecutive pieces of it if chunksize is given.
+        """
+
         order = metadata.sanitize_term_order_name(order)
         if order not in list(self._terms):
             raise KeyError("DataLayer:add_terms: Did not understand order key '%s'." % str(order))
 
         try:
-            return self.store.read_table("term" + str(order))
+            return self.store.read_table("term" + str(order), chunksize=chunksize)
         except KeyError:
+            if chunksize is not None:
+                return iter([])
             cols = metadata.get_term_metadata(order, "index_columns") + ["term_index"]
             return pd.DataFrame(columns=cols)
 
+    @_mutation
     def add_bonds(self, bonds):
         """
         Adds bond using a index notation.
@@ -1101,6 +1629,7 @@ class DataLayer(object):
 
         return self.get_terms("bonds")
 
+    @_mutation
     def add_angles(self, angles):
         """
         Adds angles using a index notation.
@@ -1123,6 +1652,7 @@ class DataLayer(object):
 
         return self.get_terms("angles")
 
+    @_mutation
     def add_dihedrals(self, dihedrals):
         """
         Adds dihedrals using a index notation.
@@ -1190,6 +1720,7 @@ class DataLayer(object):
 
 ### Other quantities
 
+    @_mutation
     def add_other(self, key, df):
         """
         Adds arbitrary data to the DataLayer object. This data is effectively private and will not be used by any part
@@ -1230,18 +1761,14 @@ class DataLayer(object):
 
 ### Non-bonded parameter
 
+    @_mutation
     def add_nb_parameter(self, atom_type, nb_name, nb_parameters, nb_model=None, atom_type2=None, utype=None):
         """
-        Stores nb parameters in data layer as dictionary
+        Stores nb parameters in data layer
 
-        Stored dictionary has form:
-            { (atom_type1, atom_type2):
-                    'form' : nb_name
-                    'parameters' :{
-                            parameter_name1: nb_parameter,
-                            parameter_name2: nb_parameter,
-                            },
-            }
+        Parameters are converted to the default model of the form (eg 'AB' for 'LJ') and to the internal units before
+        they are stored in the dense atom type arrays of the form, see `get_nb_parameter_table`. Storing an
+        interaction replaces any parameters previously stored for it, also for a different form.
 
         Parameters
         ----------
@@ -1266,37 +1793,34 @@ class DataLayer(object):
         """
 
         param_dict = {}
-        param_dict['form'] = nb_name
-
-        # Validate atom_type exists
 
         # Get functional form and ensure nb_parameters fit - maybe need to write function in validator.py
         try:
             form_md = metadata.get_nb_metadata(nb_name, model=nb_model)
         except KeyError:
-            raise KeyError("DataLayer:add_parameters: Did not understand nonbond form: %d, name: %s'." % (nb_name,
-                                                                                                          nb_form))
+            raise KeyError("DataLayer:add_parameters: Did not understand nonbond form: %s, model: %s'." % (nb_name,
+                                                                                                           nb_model))
         parameters = form_md['parameters']
 
         # Validate input parameters against form
         if isinstance(nb_parameters, (list, tuple)):
             if len(parameters) == len(nb_parameters):
-                param_dict['parameters'] = {k: v for k, v in zip(parameters, nb_parameters)}
+                param_dict = {k: v for k, v in zip(parameters, nb_parameters)}
             else:
                 raise ValueError("Input number of parameters (%s) and number of form parameters (%s) do not match." %
                                  (len(nb_parameters), len(parameters)))
         elif isinstance(nb_parameters, (dict)):
             if set(nb_parameters.keys()) != set(parameters):
-                raise ValueError("Incorrect parameters entered for nonbond form %s %s" % (nb_name, nb_form))
+                raise ValueError("Incorrect parameters entered for nonbond form %s %s" % (nb_name, nb_model))
             else:
-                param_dict['parameters'] = nb_parameters
+                param_dict = dict(nb_parameters)
 
         # Validate correct number of units are passed for parameters
         if utype is not None:
             if isinstance(utype, (list, tuple)):
                 if len(utype) != len(form_md["utype"]):
                     raise ValueError("Validate term dict: Number of units passed is %d, expected %d" %
-                                     (len(utype), len(form["utype"])))
+                                     (len(utype), len(form_md["utype"])))
                 form_units = list(utype)
             elif isinstance(utype, dict):
                 form_units = []
@@ -1311,23 +1835,55 @@ class DataLayer(object):
             # Convert to internal units
             for x, key in enumerate(form_md["parameters"]):
                 cf = units.conversion_factor(form_units[x], form_md["utype"][key])
-                param_dict['parameters'][key] *= cf
+                param_dict[key] *= cf
 
+        model_default = metadata.get_nb_metadata(nb_name, "default")
         if (nb_name == "LJ"):
-            model_default = metadata.get_nb_metadata(nb_name, "default")
-            param_dict['parameters'] = nb_converter.convert_LJ_coeffs(param_dict['parameters'], nb_model,
-                                                                      model_default)
+            param_dict = nb_converter.convert_LJ_coeffs(param_dict, nb_model, model_default)
 
-        # Store it! --
-        param_dict_key = (atom_type, atom_type2)
+        # Store it in the order of the default model parameters
+        param_dict = {k: param_dict[k] for k in metadata.get_nb_metadata(nb_name, "parameters", model=model_default)}
+        if atom_type2 is None:
+            self._nb_parameters.set_parameters(nb_name, param_dict, [atom_type])
+        else:
+            self._nb_parameters.set_parameters(nb_name, param_dict, [atom_type], [atom_type2])
 
-        # Sort if atom_type2 is not None. atom_type1 is always less than atom_type2
-        if atom_type2 != None:
-            param_dict_key = tuple(sorted(param_dict_key))
+        return True
 
+    def _convert_nb_parameters(self, nb_name, param_dict, nb_model=None, utype=None):
+        """
+        Converts stored nb parameters, scalars or arrays, from the default model and internal units of a form to the
+        requested model and units.
+        """
 
-        self._nb_parameters[param_dict_key] = param_dict
-        return True
+        # Get and validate datalayer units for nb form parameters (form is from metadata)
+        form_md = metadata.get_nb_metadata(nb_name, model=nb_model)
+
+        # Find models
+        default_form = metadata.get_nb_metadata(nb_name, "default")
+        if nb_model is None:
+            nb_model = default_form
+
+        ### Need to convert to specified nb_name (form) if needed (ex - AB to epsilon/sigma)
+        if nb_name == "LJ":
+            param_dict = nb_converter.convert_LJ_coeffs(param_dict, default_form, nb_model)
+
+        # Convert units if specified - otherwise return what is stored in datalayer
+        if utype is not None:
+            form_units = {}
+            for key in form_md["parameters"]:
+                try:
+                    form_units[key] = utype[key]
+                except KeyError:
+                    raise KeyError("Validate term dict: Did not find expected key '%s' from term (utype)'." % (key))
+
+            # Convert from what is in DL (form["utype"][key] to user specified units (form_units[key])
+            param_dict = {
+                key: value * units.conversion_factor(form_md["utype"][key], form_units[key])
+                for key, value in param_dict.items()
+            }
+
+        return param_dict
 
     def get_nb_parameter(self, atom_type, nb_model=None, atom_type2=None, utype=None):
         """
@@ -1358,52 +1914,58 @@ class DataLayer(object):
             }
         """
 
-        # Build key
-        # Don't need if statement here, just use (atom_type, None)
-        param_dict_key = (atom_type, atom_type2)
+        # Get information from data layer - raises if the interaction is not set for the atom types
+        nb_name, param_dict = self._nb_parameters.get_parameters(atom_type, atom_type2)
 
-        # Get information from data layer - check that interaction is set for atom types
-        if param_dict_key in self._nb_parameters.keys():
-            # Use deep copy here
-            nb_parameters = copy.deepcopy(self._nb_parameters[param_dict_key])
-        else:
-            raise KeyError("Nonbond interaction for atom types (%s, %s) not found" % param_dict_key)
+        param_dict = self._convert_nb_parameters(nb_name, param_dict, nb_model=nb_model, utype=utype)
+        return {k: float(v) for k, v in param_dict.items()}
 
-        # Get nb_name - this is stored when parameter is input (ex "LJ")
-        nb_name = nb_parameters['form']
+    def get_nb_parameter_table(self, nb_name, nb_model=None, utype=None, itype="pair"):
+        """
+        Returns the nb parameters of a form as dense atom type arrays.
 
-        # Grab data we want from data layer
-        param_dict = nb_parameters["parameters"]
+        Conversions between models and units are applied to whole arrays, so the cost is independent of the number of
+        stored interactions.
 
-        # Get and validate datalayer units for nb form parameters (form is from metadata)
-        form_md = metadata.get_nb_metadata(nb_name, model=nb_model)
+        Parameters
+        ------------------
+        nb_name: str
+            Name of nonbond potential (ex "LJ" or "Buckingham")
+        nb_model: str (optional)
+            Output form of potential (ex "epsilon/sigma" for nb_name "LJ"). If not specified, default for datalayer will
+            be returned
+        utype: dict (optional)
+            Units for output. Must be compatible with nb_name and form. If not specified, default for datalayer will be
+            returned
+        itype: {"pair", "single"} (optional)
+            Returns the (ntypes, ntypes) arrays of the I J pair interactions or the (ntypes, ) arrays of the
+            (atom_type1, None) interactions.
 
-        # Find models
-        default_form = metadata.get_nb_metadata(nb_parameters["form"], "default")
-        if nb_model is None:
-            nb_model = default_form
+        Returns
+        ------------------
+        types: np.ndarray
+            The sorted atom types of the rows and columns of the arrays
+        parameters: dict of np.ndarray
+            A {nb_parameter_name: array} dictionary, entries which are not set are zero
+        mask: np.ndarray
+            A boolean array of the entries which are set
+        """
 
-        ### Need to convert to specified nb_name (form) if needed (ex - AB to epsilon/sigma)
-        if nb_parameters["form"] == "LJ":
-            param_dict = nb_converter.convert_LJ_coeffs(param_dict, metadata.get_nb_metadata("LJ", "default"),
-                                                        nb_model)
+        if itype not in ["pair", "single"]:
+            raise KeyError("DataLayer:get_nb_parameter_table: itype '%s' not understood." % itype)
 
-        # Convert units if specified - otherwise return what is stored in datalayer
-        form_units = {}
-        if utype is not None:
-            for key in form_md["parameters"]:
-                try:
-                    form_units[key] = utype[key]
-                except KeyError:
-                    raise KeyError("Validate term dict: Did not find expected key '%s' from term (utype)'." % (key))
+        types, param_dict, mask = self._nb_parameters.get_table(nb_name, itype=itype)
 
-            for x, key in enumerate(param_dict):
-                # Convert from what is in DL (form["utype"][key] to user specified units (form_units[x]
-                cf = units.conversion_factor(form_md["utype"][key], form_units[key])
-                param_dict[key] *= cf
+        # Nothing stored for this form
+        if len(param_dict) == 0:
+            model_default = metadata.get_nb_metadata(nb_name, "default")
+            parameters = metadata.get_nb_metadata(nb_name, "parameters", model=model_default)
+            param_dict = {k: np.zeros(mask.shape) for k in parameters}
 
-        return param_dict
+        param_dict = self._convert_nb_parameters(nb_name, param_dict, nb_model=nb_model, utype=utype)
+        return types, {k: np.asarray(v, dtype=float) for k, v in param_dict.items()}, mask
 
+    @_mutation
     def mix_LJ_parameters(self, atom_type1, atom_type2, mixing_rule=None):
         """
         Mixes LJ parameters based on atom types and mixing rules. Stores in datalayer as (atom_type1, atom_type2)
@@ -1427,24 +1989,15 @@ class DataLayer(object):
         if mixing_rule == None:
             mixing_rule = self._mixing_rule
 
-        param_keys = [(atom_type1, None), (atom_type2, None)]
-
-        params = []
-
-        # Get information from data layer - check that interaction is set for atom types
-        for k in param_keys:
-            if k in self._nb_parameters.keys():
-                # Use deep copy here
-                params.append(copy.deepcopy(self._nb_parameters[k]))
-            else:
-                raise KeyError("Nonbond interaction for atom types (%s, %s) not found" % (k))
+        # Get information from data layer - raises if the interaction is not set for the atom types
+        params = [self._nb_parameters.get_parameters(k) for k in [atom_type1, atom_type2]]
 
         # Check that both parameters are LJ form
-        if params[0]["form"] != "LJ" or params[1]["form"] != "LJ":
+        if params[0][0] != "LJ" or params[1][0] != "LJ":
             raise ValueError("Can only combine LJ coefficients using mixing rules.")
 
         # Apply mixing rule
-        new_params = nb_converter.mix_LJ(params[0]["parameters"], params[1]["parameters"], mixing_rule=mixing_rule)
+        new_params = nb_converter.mix_LJ(params[0][1], params[1][1], mixing_rule=mixing_rule)
 
         # Add new parameter to datalayer!
         self.add_nb_parameter(atom_type=atom_type1, atom_type2=atom_type2, nb_parameters=new_params,
@@ -1452,6 +2005,7 @@ class DataLayer(object):
 
         return True
 
+    @_mutation
     def build_LJ_mixing_table(self):
         """
         Function applies mixing rule to (atom_type, None) pairs.
@@ -1460,38 +2014,41 @@ class DataLayer(object):
             (1...n, 1...n)
              where n is the number of atom types.
 
+        The mixing rule is applied to the whole (ntypes, ntypes) table at once.
+
         Returns: bool
             Returns True if successful
         """
 
-        parameters = self.list_nb_parameters(nb_name="LJ", nb_model="AB", itype="single")
-
-        parameter_keys = list(parameters)
+        types, parameters, mask = self.get_nb_parameter_table("LJ", itype="single")
+        types = types[mask]
 
-        for k in range(0, len(parameter_keys)):
-            for k2 in range(0, k+1):
-                self.mix_LJ_parameters(atom_type1=parameter_keys[k][0], atom_type2=parameter_keys[k2][0])
+        # Combine every (i, j) pair through broadcasting
+        params_i = {k: v[mask][:, None] for k, v in parameters.items()}
+        params_j = {k: v[mask][None, :] for k, v in parameters.items()}
+        mixed = nb_converter.mix_LJ(params_i, params_j, mixing_rule=self._mixing_rule)
 
+        rows, cols = np.triu_indices(types.shape[0])
+        self._nb_parameters.set_parameters("LJ", {k: v[rows, cols] for k, v in mixed.items()}, types[rows],
+                                           types[cols])
 
         return True
 
-
     def list_stored_nb_types(self):
         """
         Returns the type of NB interactions stored in datalayer (ex Lennard Jones, or Buckingham) as a list
             ex. - ["LJ", "Buckingham"]
         """
 
-        nb_types = []
-        for k, v in self._nb_parameters.items():
-            nb_types.append(v['form'])
-        unique_nb_types = np.unique(nb_types)
-        return unique_nb_types
+        return np.array(self._nb_parameters.stored_forms())
 
     def list_nb_parameters(self, nb_name, nb_model=None, utype=None, itype="all"):
         """
         Return all NB parameters stored in data layer which have the form specified by nb_name.
 
+        The interactions are listed in sorted atom type order, see `get_nb_parameter_table` for the parameters as
+        arrays.
+
         Parameters
         ------------------
         nb_name: str
@@ -1517,19 +2074,30 @@ class DataLayer(object):
                         }
                 }
         """
+
+        if itype == "all":
+            itypes = ["single", "pair"]
+        elif itype in ["single", "pair"]:
+            itypes = [itype]
+        else:
+            raise KeyError("DataLayer:list_nb_parameters: itype '%s' not understood." % itype)
+
         return_parameters = {}
-        term_dict = self._nb_parameters.copy()
-
-        for key, value in term_dict.items():
-            if value['form'] != nb_name:
-                continue
-
-            if (None in key) and (itype == "all" or itype == "single"):
-                return_parameters[key] = self.get_nb_parameter(
-                    atom_type=key[0], atom_type2=key[1], nb_model=nb_model, utype=utype)
-            elif (None not in key) and (itype == "all" or itype == "pair"):
-                return_parameters[key] = self.get_nb_parameter(
-                    atom_type=key[0], atom_type2=key[1], nb_model=nb_model, utype=utype)
+        for table_itype in itypes:
+            types, param_dict, mask = self.get_nb_parameter_table(
+                nb_name, nb_model=nb_model, utype=utype, itype=table_itype)
+            types = types.tolist()
+
+            if table_itype == "single":
+                index = (np.flatnonzero(mask), )
+                keys = [(types[x], None) for x in index[0]]
+            else:
+                index = np.nonzero(np.triu(mask))
+                keys = [(types[x], types[y]) for x, y in zip(*index)]
+
+            values = {k: v[index].tolist() for k, v in param_dict.items()}
+            for num, key in enumerate(keys):
+                return_parameters[key] = {k: v[num] for k, v in values.items()}
 
         return return_parameters
 
@@ -2,6 +2,22 @@
 Contains all of the machinery to evaluate a energy expression object
 """
 
-from .expression_eval import evaluate_form, evaluate_energy_expression
+from .expression_eval import evaluate_form, evaluate_energy_expression, evaluate_energy_frames
+from .batch import evaluate_energy_batch
+from .incremental import IncrementalEvaluator
+from .jacobian import evaluate_parameter_jacobian
+from .parallel import evaluate_energy_parallel
+from .parameter_sweep import evaluate_parameter_sweep
+from .streaming import evaluate_energy_streaming
+from . import batch
+from . import ewald
+from . import form_compiler
 from . import geometry
+from . import incremental
+from . import jacobian
 from . import nb_eval
+from . import neighbor_list
+from . import parallel
+from . import parameter_sweep
+from . import streaming
+from . import wolf
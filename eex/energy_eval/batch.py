@@ -0,0 +1,211 @@
+"""
+Evaluation of the energy expressions of many DataLayers in a single vectorized pass
+"""
+
+import numpy as np
+import pandas as pd
+
+from . import expression_eval
+from . import form_compiler
+from .. import metadata
+
+__all__ = ["evaluate_energy_batch"]
+
+
+def _batch_coordinates(dls):
+    """
+    Stacks the coordinates of every DataLayer into one block system.
+
+    Periodic DataLayers are made whole first, see `DataLayer.get_whole_xyz`, so every term of the block system can be
+    evaluated without a box.
+
+    Returns
+    -------
+    atom_keys : pd.Index
+        The (DataLayer, atom_index) key of every row of the block coordinates, see `_batch_keys`
+    coords : np.ndarray
+        The (N, 3) block coordinates
+    """
+
+    xyz_tables = []
+    for dl in dls:
+        if dl.get_box_size():
+            xyz_tables.append(dl.get_whole_xyz())
+        else:
+            xyz_tables.append(dl.store.read_table("xyz"))
+
+    if len(xyz_tables) == 0:
+        return pd.Index([], dtype=np.int64), np.zeros((0, 3))
+
+    owner = np.repeat(np.arange(len(xyz_tables)), [x.shape[0] for x in xyz_tables])
+    xyz = pd.concat(xyz_tables)
+
+    return pd.Index(_batch_keys(owner, xyz.index.values)), xyz[["X", "Y", "Z"]].values
+
+
+def _batch_keys(owner, index):
+    """
+    Packs (DataLayer, index) pairs into single int64 keys so they can be looked up in one pass.
+    """
+
+    return owner.astype(np.int64) * (2**32) + np.asarray(index, dtype=np.int64)
+
+
+def _batch_parameters(dls, order):
+    """
+    Concatenates the term parameters of a single order of every DataLayer into one (DataLayer, uid) table.
+
+    Returns
+    -------
+    uid_keys : pd.Index
+        The (DataLayer, uid) key of every parameter, see `_batch_keys`
+    uid_form : np.ndarray
+        The position in `forms` of the functional form of every parameter
+    uid_row : np.ndarray
+        The row of every parameter in the table of its functional form
+    forms : list of tuple
+        A list of (form_type, parameters) where parameters is a dictionary of parameter arrays
+    """
+
+    owners = []
+    uids = []
+    data = []
+    for num, dl in enumerate(dls):
+        params = dl.list_term_parameters(order)
+        owners.append(np.full(len(params), num, dtype=np.int64))
+        uids.append(np.fromiter(params.keys(), dtype=np.int64, count=len(params)))
+        data.extend(params.values())
+
+    uid_keys = pd.Index(_batch_keys(np.concatenate(owners), np.concatenate(uids)))
+
+    form_names, uid_form = np.unique(np.array([x[0] for x in data], dtype=object), return_inverse=True)
+    uid_row = np.zeros(len(data), dtype=int)
+
+    forms = []
+    for fnum, form_type in enumerate(form_names):
+        rows = np.flatnonzero(uid_form == fnum)
+        uid_row[rows] = np.arange(rows.shape[0])
+
+        table = np.array([data[x][1:] for x in rows], dtype=np.float64)
+        names = metadata.get_term_metadata(order, "forms", form_type)["parameters"]
+        forms.append((form_type, {name: table[:, col] for col, name in enumerate(names)}))
+
+    return uid_keys, uid_form, uid_row, forms
+
+
+def _batch_terms(dls, atom_keys, order):
+    """
+    Concatenates the terms of a single order of every DataLayer.
+
+    Only the raw term tables are read per DataLayer, the atom positions and the parameters of the block terms are then
+    looked up in a single pass over every DataLayer.
+
+    Returns
+    -------
+    positions : list of np.ndarray
+        The row positions of each atom column into the block coordinates
+    owner : np.ndarray
+        The position of the DataLayer of every term in `dls`
+    groups : dict
+        A {form_type: (selection, parameters)} dictionary over the block terms, see `_build_form_groups`
+    """
+
+    tables = [dl.get_terms(order) for dl in dls]
+    nterms = [x.shape[0] for x in tables]
+    if sum(nterms) == 0:
+        return None, None, {}
+
+    owner = np.repeat(np.arange(len(tables)), nterms)
+    terms = pd.concat([x for x in tables if x.shape[0]], ignore_index=True)
+
+    positions = []
+    for col in metadata.get_term_metadata(order, "index_columns"):
+        pos = atom_keys.get_indexer(_batch_keys(owner, terms[col].values))
+        if np.any(pos < 0):
+            raise KeyError("evaluate_energy_batch: Atom indices of order %d terms are not in the xyz table." % order)
+        positions.append(pos)
+
+    uid_keys, uid_form, uid_row, forms = _batch_parameters(dls, order)
+    uid_pos = uid_keys.get_indexer(_batch_keys(owner, terms["term_index"].values))
+    if np.any(uid_pos < 0):
+        raise KeyError("evaluate_energy_batch: Term uids of order %d are not registered parameters." % order)
+
+    term_form = uid_form[uid_pos]
+    term_row = uid_row[uid_pos]
+
+    groups = {}
+    for fnum, (form_type, parameters) in enumerate(forms):
+        selection = np.flatnonzero(term_form == fnum)
+        if selection.shape[0] == 0: continue
+
+        rows = term_row[selection]
+        groups[form_type] = (selection, {k: v[rows] for k, v in parameters.items()})
+
+    return positions, owner, groups
+
+
+def evaluate_energy_batch(dls, utype=None, nonbonded=False, tile_size=1024):
+    """
+    Evaluates the energy expressions of many DataLayers, such as a library of small molecules, in a single pass.
+
+    The raw coordinate, term, and parameter tables of every DataLayer are concatenated into one block system, the atom
+    positions and parameters of every term are then looked up in a single pass keyed on (DataLayer, index). Each
+    geometric variable is computed once per order and each functional form is evaluated in a single vectorized call
+    across every DataLayer that uses it. The energies are finally reduced back onto their DataLayer, so apart from the
+    table reads the Python overhead of `evaluate_energy_expression` is paid per order and form rather than per
+    DataLayer.
+
+    Parameters
+    ----------
+    dls : list of DataLayer
+        The DataLayers to evaluate
+    utype : {None, str}, optional
+        The energy unit of the output, otherwise the internal DataLayer energy units are used.
+    nonbonded : bool, optional
+        If True, adds the "vdw" and "coul" nonbonded energies of each DataLayer and "coul_long" for Ewald methods.
+        Pairs never cross DataLayers, so these are evaluated one DataLayer at a time.
+    tile_size : int, optional
+        The number of atoms along each edge of a nonbonded pair tile, bounds the temporary memory.
+
+    Returns
+    -------
+    energies : list of dict
+        The energy dictionary of every DataLayer in the order of `dls`, see `evaluate_energy_expression`.
+    """
+
+    dls = list(dls)
+    atom_keys, coords = _batch_coordinates(dls)
+
+    energy = {}
+    for order_key, order, _ in expression_eval._bonded_terms:
+        energy[order_key] = np.zeros(len(dls))
+
+        positions, owner, groups = _batch_terms(dls, atom_keys, order)
+        if positions is None: continue
+
+        variables = expression_eval._TermVariables(order, coords, positions)
+        for form_type, (selection, parameters) in groups.items():
+            kernel = form_compiler.get_term_kernel(order, form_type)
+
+            local_dict = variables.select(kernel.input_names, selection)
+            local_dict.update(parameters)
+
+            group_energy = np.broadcast_to(kernel(local_dict), selection.shape)
+            energy[order_key] += np.bincount(owner[selection], weights=group_energy, minlength=len(dls))
+
+    cf = expression_eval._energy_conversion_factor(utype)
+
+    ret = []
+    for num, dl in enumerate(dls):
+        dl_energy = {k: v[num] for k, v in energy.items()}
+        dl_energy["total"] = 0.0
+
+        if nonbonded:
+            xyz = dl.get_atoms("xyz")
+            nb_data = expression_eval._build_nonbonded_data(dl, xyz)
+            dl_energy.update(expression_eval._nonbonded_energy(xyz[["X", "Y", "Z"]].values, nb_data, tile_size))
+
+        dl_energy["total"] = sum(v for k, v in dl_energy.items() if k != "total")
+        ret.append({k: cf * v for k, v in dl_energy.items()})
+
+    return ret
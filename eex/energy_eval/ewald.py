@@ -0,0 +1,345 @@
+"""
+Ewald and smooth particle-mesh Ewald (SPME) electrostatics
+"""
+
+import itertools
+
+import numpy as np
+
+__all__ = ["erfc", "default_alpha", "default_kmax", "default_grid_size", "bspline_weights", "pme_reciprocal_energy",
+           "ewald_reciprocal_energy", "ewald_self_energy"]
+
+# Default relative accuracy of the Ewald methods
+_default_accuracy = 1.e-5
+
+
+def erfc(x):
+    """
+    The complementary error function for non-negative arguments.
+
+    Uses the Chebyshev fit of Numerical Recipes (erfcc) which has a fractional error below 1.2e-7 everywhere.
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    t = 1.0 / (1.0 + 0.5 * x)
+    poly = -1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+        0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+    return t * np.exp(-x * x + poly)
+
+
+def _fft_size(n):
+    """
+    The smallest integer >= n with only 2, 3, and 5 as prime factors.
+    """
+
+    n = max(int(np.ceil(n)), 1)
+    while True:
+        tmp = n
+        for p in [2, 3, 5]:
+            while tmp % p == 0:
+                tmp //= p
+        if tmp == 1:
+            return n
+        n += 1
+
+
+def default_alpha(cutoff, accuracy=None):
+    """
+    The Ewald splitting parameter for which the real-space sum is converged to `accuracy` at the cutoff.
+    """
+
+    if accuracy is None:
+        accuracy = _default_accuracy
+    return np.sqrt(-np.log(accuracy)) / cutoff
+
+
+def _reciprocal_extent(H, alpha, accuracy):
+    """
+    The number of reciprocal vectors along each lattice direction needed to converge to `accuracy`.
+    """
+
+    if accuracy is None:
+        accuracy = _default_accuracy
+    widths = np.abs(np.linalg.det(H)) / np.array([
+        np.linalg.norm(np.cross(H[1], H[2])),
+        np.linalg.norm(np.cross(H[2], H[0])),
+        np.linalg.norm(np.cross(H[0], H[1]))
+    ])
+    return alpha * widths * np.sqrt(-np.log(accuracy)) / np.pi
+
+
+def default_kmax(H, alpha, accuracy=None):
+    """
+    The number of reciprocal vectors in each direction for a direct Ewald sum.
+    """
+
+    return np.ceil(_reciprocal_extent(H, alpha, accuracy)).astype(int)
+
+
+def default_grid_size(H, alpha, accuracy=None):
+    """
+    The FFT friendly SPME grid size for the reciprocal vectors of the direct Ewald sum.
+
+    The grid oversamples the largest reciprocal vector so that the B-spline interpolation error near the Nyquist
+    frequency stays below the requested accuracy.
+    """
+
+    return np.array([_fft_size(x) for x in 3.0 * _reciprocal_extent(H, alpha, accuracy) + 1.0])
+
+
+def bspline_weights(w, order):
+    """
+    Computes the cardinal B-spline weights M_order(w + k) for k = 0 ... order - 1.
+
+    Parameters
+    ----------
+    w : np.ndarray
+        The (N, ) fractional offsets from the nearest lower grid point, in [0, 1).
+    order : int
+        The interpolation order, at least 2
+
+    Returns
+    -------
+    weights : np.ndarray
+        The (N, order) B-spline weights, each row sums to one.
+    """
+
+    if order < 2:
+        raise ValueError("bspline_weights: Interpolation order must be at least 2, found %d." % order)
+
+    w = np.asarray(w, dtype=np.float64)
+    M = np.zeros((w.shape[0], order))
+    M[:, 0] = w
+    M[:, 1] = 1.0 - w
+
+    for n in range(3, order + 1):
+        prev = M[:, :n - 1].copy()
+        for k in range(n):
+            upper = prev[:, k] if k < n - 1 else 0.0
+            lower = prev[:, k - 1] if k > 0 else 0.0
+            M[:, k] = ((w + k) * upper + (n - w - k) * lower) / (n - 1)
+
+    return M
+
+
+def _bspline_moduli(K, order):
+    """
+    The squared B-spline moduli |b(m)|^2 for m = 0 ... K - 1.
+    """
+
+    # M_order at the integers 1 ... order - 1
+    knots = bspline_weights(np.zeros(1), order)[0, 1:]
+
+    m = np.arange(K)
+    phase = np.exp(2.0j * np.pi * np.outer(m, np.arange(order - 1)) / K)
+    denom = np.abs(np.dot(phase, knots))**2
+
+    # Odd orders vanish at the Nyquist frequency, interpolate from the neighbors
+    bad = denom < 1.e-10
+    denom[bad] = 1.0
+    moduli = 1.0 / denom
+    for idx in np.flatnonzero(bad):
+        moduli[idx] = 0.5 * (moduli[(idx - 1) % K] + moduli[(idx + 1) % K])
+
+    return moduli
+
+
+def _spread_charges(frac, charges, grid_size, order, chunk_size=2**15):
+    """
+    Spreads the charges onto the SPME grid with B-spline weights.
+    """
+
+    grid = np.zeros(int(np.prod(grid_size)))
+    natoms = frac.shape[0]
+
+    for start in range(0, natoms, chunk_size):
+        stop = min(start + chunk_size, natoms)
+
+        u = frac[start:stop] * grid_size
+        base = np.floor(u).astype(int)
+        w = u - base
+
+        index = []
+        weights = []
+        for dim in range(3):
+            index.append((base[:, dim, None] - np.arange(order)) % grid_size[dim])
+            weights.append(bspline_weights(w[:, dim], order))
+
+        # Outer product over the three dimensions, (N, order, order, order)
+        flat = (index[0][:, :, None, None] * grid_size[1] + index[1][:, None, :, None]) * grid_size[2] + \
+            index[2][:, None, None, :]
+        values = charges[start:stop, None, None, None] * weights[0][:, :, None, None] * \
+            weights[1][:, None, :, None] * weights[2][:, None, None, :]
+
+        grid += np.bincount(flat.ravel(), weights=values.ravel(), minlength=grid.shape[0])
+
+    return grid.reshape(grid_size)
+
+
+def pme_reciprocal_energy(coords, charges, box, alpha, grid_size=None, order=5, accuracy=None, coul_constant=1.0):
+    """
+    Computes the reciprocal space Ewald energy with the smooth particle-mesh Ewald method.
+
+    Charges are spread onto a grid with cardinal B-splines and the structure factor is obtained with a real FFT,
+    the cost scales as O(N + K log K) for K grid points.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of cartesian coordinates
+    charges : np.ndarray
+        A (N, ) array of charges
+    box : np.ndarray
+        The (3, 3) matrix whose rows are the lattice vectors
+    alpha : float
+        The Ewald splitting parameter
+    grid_size : array_like, optional
+        The number of grid points along each lattice vector, defaults to `default_grid_size`.
+    order : int, optional
+        The B-spline interpolation order
+    accuracy : float, optional
+        The relative accuracy used to pick a default grid size
+    coul_constant : float, optional
+        Coulomb's constant in the units of the charges, distances, and energy.
+
+    Returns
+    -------
+    energy : float
+        The reciprocal space energy
+
+    Notes
+    -----
+    U. Essmann et al., J. Chem. Phys. 103, 8577 (1995)
+    """
+
+    H = np.asarray(box, dtype=np.float64)
+    H_inv = np.linalg.inv(H)
+    volume = np.abs(np.linalg.det(H))
+
+    if grid_size is None:
+        grid_size = default_grid_size(H, alpha, accuracy)
+    grid_size = np.array(np.broadcast_to(np.array(grid_size, dtype=int), (3, )))
+    if np.any(grid_size < order):
+        raise ValueError("pme_reciprocal_energy: Grid size %s must be at least the interpolation order %d." %
+                         (str(grid_size), order))
+
+    frac = np.dot(np.asarray(coords, dtype=np.float64), H_inv)
+    frac -= np.floor(frac)
+
+    Q = _spread_charges(frac, np.asarray(charges, dtype=np.float64), grid_size, order)
+    FQ = np.fft.rfftn(Q)
+
+    # Signed integer frequencies matching the FFT layout
+    K1, K2, K3 = grid_size
+    m1 = np.fft.fftfreq(K1) * K1
+    m2 = np.fft.fftfreq(K2) * K2
+    m3 = np.arange(K3 // 2 + 1)
+
+    # Reciprocal lattice vectors are the columns of H^-1
+    recip = H_inv.T
+    mvec = m1[:, None, None, None] * recip[0] + m2[None, :, None, None] * recip[1] + m3[None, None, :, None] * recip[2]
+    m2_norm = np.einsum("ijkl,ijkl->ijk", mvec, mvec)
+    m2_norm[0, 0, 0] = 1.0
+
+    B = _bspline_moduli(K1, order)[:, None, None] * _bspline_moduli(K2, order)[None, :, None] * \
+        _bspline_moduli(K3, order)[None, None, :K3 // 2 + 1]
+
+    kernel = np.exp(-(np.pi**2) * m2_norm / alpha**2) / m2_norm * B
+    kernel[0, 0, 0] = 0.0
+
+    # The real FFT only stores half of the last dimension
+    symmetry = np.full(K3 // 2 + 1, 2.0)
+    symmetry[0] = 1.0
+    if K3 % 2 == 0:
+        symmetry[-1] = 1.0
+
+    structure = FQ.real**2 + FQ.imag**2
+    energy = np.sum(kernel * structure * symmetry) / (2.0 * np.pi * volume)
+
+    return coul_constant * energy
+
+
+def ewald_reciprocal_energy(coords, charges, box, alpha, kmax=None, accuracy=None, coul_constant=1.0,
+                            max_elements=2**22):
+    """
+    Computes the reciprocal space Ewald energy with a direct sum over reciprocal vectors.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of cartesian coordinates
+    charges : np.ndarray
+        A (N, ) array of charges
+    box : np.ndarray
+        The (3, 3) matrix whose rows are the lattice vectors
+    alpha : float
+        The Ewald splitting parameter
+    kmax : array_like, optional
+        The largest reciprocal vector index along each lattice vector, defaults to `default_kmax`.
+    accuracy : float, optional
+        The relative accuracy used to pick a default kmax
+    coul_constant : float, optional
+        Coulomb's constant in the units of the charges, distances, and energy.
+    max_elements : int, optional
+        The maximum number of (atom, vector) phases held in memory at once.
+
+    Returns
+    -------
+    energy : float
+        The reciprocal space energy
+    """
+
+    H = np.asarray(box, dtype=np.float64)
+    H_inv = np.linalg.inv(H)
+    volume = np.abs(np.linalg.det(H))
+
+    coords = np.asarray(coords, dtype=np.float64)
+    charges = np.asarray(charges, dtype=np.float64)
+
+    if kmax is None:
+        kmax = default_kmax(H, alpha, accuracy)
+    kmax = np.broadcast_to(np.array(kmax, dtype=int), (3, ))
+
+    # Half of the vectors, the other half follow from k -> -k
+    ranges = [range(-k, k + 1) for k in kmax]
+    mvecs = np.array([m for m in itertools.product(*ranges) if m > (0, 0, 0)], dtype=np.float64)
+    if mvecs.shape[0] == 0:
+        return 0.0
+
+    kvecs = 2.0 * np.pi * np.dot(mvecs, H_inv.T)
+    k2 = np.einsum("ij,ij->i", kvecs, kvecs)
+    prefactor = np.exp(-k2 / (4.0 * alpha**2)) / k2
+
+    energy = 0.0
+    chunk_size = max(1, max_elements // max(coords.shape[0], 1))
+    for start in range(0, kvecs.shape[0], chunk_size):
+        phase = np.dot(coords, kvecs[start:start + chunk_size].T)
+        real = np.dot(charges, np.cos(phase))
+        imag = np.dot(charges, np.sin(phase))
+        energy += np.sum(prefactor[start:start + chunk_size] * (real**2 + imag**2))
+
+    return coul_constant * 4.0 * np.pi / volume * energy
+
+
+def ewald_self_energy(charges, alpha, volume, coul_constant=1.0):
+    """
+    Computes the Ewald self energy and the neutralizing background energy of a net charge.
+
+    Parameters
+    ----------
+    charges : np.ndarray
+        A (N, ) array of charges
+    alpha : float
+        The Ewald splitting parameter
+    volume : float
+        The volume of the periodic box
+    coul_constant : float, optional
+        Coulomb's constant in the units of the charges, distances, and energy.
+    """
+
+    charges = np.asarray(charges, dtype=np.float64)
+
+    self_energy = -alpha / np.sqrt(np.pi) * np.sum(charges**2)
+    background = -np.pi * np.sum(charges)**2 / (2.0 * volume * alpha**2)
+
+    return coul_constant * (self_energy + background)
@@ -4,31 +4,476 @@ Functions to compute an energy expression
 
 import numexpr as ne
 import numpy as np
+import pandas as pd
 from .. import units
 
+from . import form_compiler
 from . import geometry
+from . import nb_eval
+from . import neighbor_list
 from .. import metadata
+from .. import nb_converter
 
 
-def _compute_temporaries(order, xyz, indices):
-    if order == 2:
-        two_body_dict = {}
-        two_body_dict["r"] = geometry.compute_distance(xyz.loc[indices["atom1"]].values,
-                                                       xyz.loc[indices["atom2"]].values)
-        return two_body_dict
-    elif order == 3:
-        three_body_dict = {}
-        three_body_dict["theta"] = geometry.compute_angle(
-            xyz.loc[indices["atom1"]].values, xyz.loc[indices["atom2"]].values, xyz.loc[indices["atom3"]].values)
-        return three_body_dict
-    elif order == 4:
-        four_body_dict = {}
-        four_body_dict["phi"] = geometry.compute_dihedral(
-            xyz.loc[indices["atom1"]].values, xyz.loc[indices["atom2"]].values, xyz.loc[indices["atom3"]].values,
-            xyz.loc[indices["atom4"]].values)
-        return four_body_dict
-    else:
-        raise KeyError("_compute_temporaries: order %d not understood" % order)
+# The geometric variables of each order as (indexed kernel, gradient function, term atom columns)
+_variable_definitions = {
+    2: {
+        "r": (geometry.indexed_distance, geometry.distance_gradient, (0, 1)),
+    },
+    3: {
+        "theta": (geometry.indexed_angle, geometry.angle_gradient, (0, 1, 2)),
+        "r12": (geometry.indexed_distance, geometry.distance_gradient, (0, 1)),
+        "r23": (geometry.indexed_distance, geometry.distance_gradient, (1, 2)),
+        "r13": (geometry.indexed_distance, geometry.distance_gradient, (0, 2)),
+    },
+    4: {
+        "phi": (geometry.indexed_dihedral, geometry.dihedral_gradient, (0, 1, 2, 3)),
+        "chi": (geometry.indexed_dihedral, geometry.dihedral_gradient, (0, 1, 2, 3)),
+        "theta": (geometry.indexed_angle, geometry.angle_gradient, (0, 1, 2)),
+        "r": (geometry.indexed_plane_distance, None, (0, 1, 2, 3)),
+        "omega": (geometry.indexed_plane_angle, None, (0, 1, 2, 3)),
+    },
+}
+
+
+class _TermVariables(object):
+    """
+    Lazily computes the geometric variables of the terms of a given order.
+
+    A variable is only computed once a functional form references it and then at most once per evaluation, always
+    vectorized over every term. Values are computed directly from the term positions with the cache blocked
+    `geometry.indexed_*` kernels so no per-term point arrays are gathered.
+
+    Parameters
+    ----------
+    order : int
+        The order of the terms (2, 3, 4)
+    coords : np.ndarray
+        A (N, 3) array of cartesian coordinates or a (nframes, N, 3) stack of them
+    positions : list of np.ndarray
+        The row positions into `coords` for each atom of the terms, one array per atom column.
+    box : np.ndarray, optional
+        The (3, 3) periodic box. If given, the atoms of each term are taken as the minimum images of one another so that
+        terms that straddle the box boundary of wrapped coordinates are evaluated correctly.
+    """
+
+    def __init__(self, order, coords, positions, box=None):
+        if order not in _variable_definitions:
+            raise KeyError("_TermVariables: order %d not understood" % order)
+
+        self._definitions = _variable_definitions[order]
+        self._coords = np.ascontiguousarray(coords, dtype=np.float64)
+        self._positions = positions
+        self._box = box
+        self._shape = coords.shape[:-2] + positions[0].shape
+
+        self._points = {}
+        self._values = {}
+        self._gradients = {}
+
+    def __contains__(self, name):
+        return name in self._definitions
+
+    def _column_points(self, columns):
+        for col in columns:
+            if col not in self._points:
+                points = self._coords[..., self._positions[col], :].reshape(-1, 3)
+
+                # Every column is taken relative to the first atom of the term
+                if (self._box is not None) and (col != 0):
+                    reference = self._column_points([0])[0]
+                    points = reference + geometry.minimum_image(points - reference, self._box)
+                self._points[col] = points
+        return [self._points[col] for col in columns]
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            func, gradient_func, columns = self._definitions[name]
+            # Frames are flattened into one coordinate block with frame offset indices, a single kernel call
+            natoms = self._coords.shape[-2]
+            offsets = natoms * np.arange(int(np.prod(self._coords.shape[:-2])))[:, None]
+            indices = [(self._positions[col] + offsets).ravel() for col in columns]
+
+            value = np.empty(self._shape)
+            func(self._coords.reshape(-1, 3), *indices, box=self._box, out=value.ravel())
+            self._values[name] = value
+
+        return self._values[name]
+
+    def gradient(self, name):
+        """
+        Returns a list of (column, gradient) with the (nterms, 3) gradient of a variable for each term atom column.
+        """
+
+        if name not in self._gradients:
+            func, gradient_func, columns = self._definitions[name]
+            if gradient_func is None:
+                raise KeyError("_TermVariables: Gradients of variable '%s' are not available." % name)
+
+            value, gradients = gradient_func(*self._column_points(columns))
+            self._values[name] = value.reshape(self._shape)
+            self._gradients[name] = list(zip(columns, gradients))
+
+        return self._gradients[name]
+
+    def select(self, names, selection):
+        """
+        Builds a local dictionary of the referenced variables for a selection of terms.
+        """
+
+        return {name: self[name][..., selection] for name in names if name in self._definitions}
+
+
+def _atom_positions(atom_index, terms, order):
+    """
+    Maps the atom indices of a term table onto integer row positions of the coordinate array.
+
+    Parameters
+    ----------
+    atom_index : pd.Index
+        The atom_index of the xyz table
+    terms : pd.DataFrame
+        The term table as returned by `DataLayer.get_terms`
+    order : int
+        The order of the terms
+    """
+
+    positions = []
+    for col in metadata.get_term_metadata(order, "index_columns"):
+        pos = atom_index.get_indexer(terms[col].values)
+        if np.any(pos < 0):
+            raise KeyError("evaluate_energy_expression: Atom indices of order %d terms are not in the xyz table." % order)
+        positions.append(pos)
+
+    return positions
+
+
+def _build_form_groups(dl, order, term_index):
+    """
+    Groups the terms of a given order by functional form and gathers their parameters.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the term parameters
+    order : int
+        The order of the terms
+    term_index : np.ndarray
+        The parameter uid of every term
+
+    Returns
+    -------
+    groups : list of tuple
+        A list of (form_type, selection, parameters) where selection holds the term positions using the form and
+        parameters is a dictionary of parameter arrays aligned with the selection.
+    """
+
+    uids, inverse = np.unique(term_index, return_inverse=True)
+
+    # One lookup per distinct uid, never per term
+    forms = {}
+    uid_form = np.zeros(uids.shape[0], dtype=int)
+    uid_row = np.zeros(uids.shape[0], dtype=int)
+    for num, uid in enumerate(uids):
+        form_type, parameters = dl.get_term_parameter(order, int(uid))
+        if form_type not in forms:
+            forms[form_type] = []
+        uid_form[num] = list(forms).index(form_type)
+        uid_row[num] = len(forms[form_type])
+        forms[form_type].append(parameters)
+
+    term_form = uid_form[inverse]
+    term_row = uid_row[inverse]
+
+    groups = []
+    for fnum, (form_type, parameter_list) in enumerate(forms.items()):
+        selection = np.flatnonzero(term_form == fnum)
+        rows = term_row[selection]
+
+        parameters = {}
+        for name in metadata.get_term_metadata(order, "forms", form_type)["parameters"]:
+            table = np.array([x[name] for x in parameter_list], dtype=np.float64)
+            parameters[name] = table[rows]
+
+        groups.append((form_type, selection, parameters))
+
+    return groups
+
+
+# The bonded energy components and the DataLayer accessors of their terms
+_bonded_terms = [("two-body", 2, "get_bonds"), ("three-body", 3, "get_angles"), ("four-body", 4, "get_dihedrals")]
+
+
+def _build_bonded_terms(dl, atom_index):
+    """
+    Gathers everything about the bonded terms that does not depend on the coordinates.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the terms
+    atom_index : pd.Index
+        The atom_index of the xyz table
+
+    Returns
+    -------
+    bonded_terms : list of tuple
+        A list of (energy_key, order, positions, term_index, groups) for every order with terms, where groups is a
+        list of (form_type, kernel, selection, parameters), see `_build_form_groups`.
+    """
+
+    bonded_terms = []
+    for order_key, order, get_data in _bonded_terms:
+        terms = dl.call_by_string(get_data)
+        if terms.shape[0] == 0: continue
+
+        positions = _atom_positions(atom_index, terms, order)
+        term_index = terms["term_index"].values
+
+        # Form type is used to look up the compiled functional form (eg 'harmonic' -> K * (r-r0) ** 2)
+        groups = []
+        for form_type, selection, parameters in _build_form_groups(dl, order, term_index):
+            groups.append((form_type, form_compiler.get_term_kernel(order, form_type), selection, parameters))
+
+        bonded_terms.append((order_key, order, positions, term_index, groups))
+
+    return bonded_terms
+
+
+def _build_nb_tables(dl, atom_types):
+    """
+    Builds (ntypes, ntypes) lookup arrays of the nonbonded parameters stored in a DataLayer.
+
+    Explicit pair parameters are used when present, otherwise single atom type parameters are combined with the
+    DataLayer mixing rule.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the nonbonded parameters
+    atom_types : np.ndarray
+        The atom type of every atom
+
+    Returns
+    -------
+    nb_name : {str, None}
+        The name of the nonbonded form, None if no nonbonded parameters are stored.
+    type_index : np.ndarray
+        The position of every atom into the lookup arrays
+    tables : dict of np.ndarray
+        A lookup array for each parameter of the form
+    """
+
+    nb_names = list(dl.list_stored_nb_types())
+    if len(nb_names) == 0:
+        return None, None, None
+    elif len(nb_names) > 1:
+        raise ValueError("evaluate_energy_expression: Only a single nonbonded form can be evaluated, found %s." %
+                         str(nb_names))
+
+    nb_name = nb_names[0]
+    types, type_index = np.unique(atom_types, return_inverse=True)
+
+    # Positions of the atom types into the dense DataLayer tables
+    stored_types, pair_tables, pair_mask = dl.get_nb_parameter_table(nb_name, itype="pair")
+    pos = np.minimum(np.searchsorted(stored_types, types), stored_types.shape[0] - 1)
+    known = stored_types[pos] == types
+    if not np.all(known):
+        raise KeyError("evaluate_energy_expression: Nonbonded parameters for atom type %s not found." %
+                       str(types[~known][0]))
+
+    index = np.ix_(pos, pos)
+    tables = {k: v[index] for k, v in pair_tables.items()}
+    found = pair_mask[index]
+
+    # Explicit pair parameters take precedence over the mixing rule
+    if not np.all(found):
+        _, single_tables, single_mask = dl.get_nb_parameter_table(nb_name, itype="single")
+        single_found = single_mask[pos]
+        mixable = single_found[:, None] & single_found[None, :] & ~found
+
+        x, y = np.nonzero(~found & ~mixable)
+        if x.shape[0]:
+            raise KeyError("evaluate_energy_expression: Nonbonded parameters for atom types (%s, %s) not found." %
+                           (str(types[x[0]]), str(types[y[0]])))
+
+        mixing_rule = dl.get_mixing_rule()
+        if (nb_name != "LJ") or (mixing_rule == ''):
+            x, y = np.nonzero(mixable)
+            raise KeyError("evaluate_energy_expression: Nonbonded parameters for atom types (%s, %s) not "
+                           "found and cannot be mixed." % (str(types[x[0]]), str(types[y[0]])))
+
+        # Mix the whole table at once
+        params = {k: v[pos] for k, v in single_tables.items()}
+        mixed = nb_converter.mix_LJ({k: v[:, None] for k, v in params.items()},
+                                    {k: v[None, :] for k, v in params.items()}, mixing_rule)
+
+        tables = {k: np.where(mixable, mixed[k], v) for k, v in tables.items()}
+
+    return nb_name, type_index, tables
+
+
+def _build_pair_scalings(dl, atom_index):
+    """
+    Maps the pair scalings stored in a DataLayer onto unique (i < j) coordinate positions.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the pair scalings
+    atom_index : pd.Index
+        The atom_index of the xyz table
+
+    Returns
+    -------
+    pair_scalings : dict
+        A {"vdw": (i, j, scale), "coul": (i, j, scale)} dictionary, the first scaling of a repeated pair is kept.
+    """
+
+    pair_scalings = {}
+    stored_tables = dl.list_tables()
+    for label in metadata.additional_metadata.nb_scaling["data"]:
+        if label not in stored_tables: continue
+
+        scalings = dl.get_pair_scalings(nb_labels=[label])[label]
+        pos1 = atom_index.get_indexer(scalings.index.get_level_values(0))
+        pos2 = atom_index.get_indexer(scalings.index.get_level_values(1))
+        if np.any(pos1 < 0) or np.any(pos2 < 0):
+            raise KeyError("evaluate_energy_expression: Atom indices of the pair scalings are not in the xyz table.")
+
+        i = np.minimum(pos1, pos2)
+        j = np.maximum(pos1, pos2)
+        scale = scalings.values.astype(np.float64)
+
+        # Remove self pairs and repeated pairs
+        keep = i != j
+        i, j, scale = i[keep], j[keep], scale[keep]
+        _, first = np.unique(i * atom_index.shape[0] + j, return_index=True)
+        first.sort()
+
+        pair_scalings[label.replace("_scale", "")] = (i[first], j[first], scale[first])
+
+    return pair_scalings
+
+
+def _build_nonbonded_data(dl, xyz):
+    """
+    Gathers the nonbonded data of a DataLayer that does not depend on the coordinates.
+    """
+
+    kernel = None
+    atom_types = dl.get_atoms("atom_type").reindex(xyz.index)["atom_type"].values
+    nb_name, type_index, tables = _build_nb_tables(dl, atom_types)
+    if nb_name is not None:
+        kernel = form_compiler.get_nb_kernel(nb_name)
+
+    charges = None
+    if "charge" in dl.list_atom_properties():
+        charges = dl.get_atoms("charge", by_value=True).reindex(xyz.index)["charge"].values.astype(np.float64)
+        if not np.any(charges):
+            charges = None
+
+    nb_data = {
+        "type_index": type_index,
+        "kernel": kernel,
+        "parameter_tables": tables,
+        "charges": charges,
+        "coul_constant": nb_eval.coulomb_constant(),
+        "pair_scalings": _build_pair_scalings(dl, xyz.index)
+    }
+
+    # Isolated systems sum over every pair
+    electrostatics = dl.get_electrostatics()
+    if electrostatics:
+        box, origin = neighbor_list.box_from_datalayer(dl)
+        nb_data.update({
+            "cutoff": electrostatics["cutoff"],
+            "box": box,
+            "origin": origin,
+            "method": electrostatics["method"],
+            "parameters": electrostatics["parameters"]
+        })
+
+    return nb_data
+
+
+def _nonbonded_energy(coords, nb_data, tile_size):
+    """
+    Evaluates the pairwise energy of a single frame, see `_build_nonbonded_data`.
+    """
+
+    if "cutoff" not in nb_data:
+        return nb_eval.nonbonded_energy(coords, tile_size=tile_size, **nb_data)
+
+    return nb_eval.cutoff_nonbonded_energy(coords, **nb_data)
+
+
+def _energy_conversion_factor(utype):
+    """
+    The factor from the internal DataLayer energy units to utype.
+    """
+
+    if utype is None:
+        return 1.0
+
+    dl_energy_units = units.convert_contexts("[energy]")
+    return units.conversion_factor(dl_energy_units, utype)
+
+
+def _decompose_energy(dl, xyz, term_energies, cf):
+    """
+    Reduces the energy of every bonded term onto term uids, atoms, molecules, and residues.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the atoms
+    xyz : pd.DataFrame
+        The xyz table
+    term_energies : list of tuple
+        A list of (energy_key, positions, term_index, energy) for every order with terms
+    cf : float
+        The energy conversion factor
+
+    Returns
+    -------
+    decomposition : dict
+        The "uid" energies as a {energy_key: pd.Series} dictionary and the "atom", "molecule", and "residue" energies as
+        DataFrames with a column per energy key and the total. Molecule and residue energies are only present if the
+        atoms have a molecule_index or residue_index.
+    """
+
+    natoms = xyz.shape[0]
+    keys = [x[0] for x in _bonded_terms]
+
+    decomposition = {"uid": {}}
+    atom_energy = pd.DataFrame(0.0, index=xyz.index, columns=keys)
+
+    for order_key, positions, term_index, energy in term_energies:
+        energy = cf * energy
+
+        uids, inverse = np.unique(term_index, return_inverse=True)
+        uid_energy = np.bincount(inverse, weights=energy, minlength=uids.shape[0])
+        decomposition["uid"][order_key] = pd.Series(uid_energy, index=pd.Index(uids, name="term_index"), name=order_key)
+
+        # Each term is split evenly across its atoms
+        weights = np.tile(energy / len(positions), len(positions))
+        atom_energy[order_key] = np.bincount(np.concatenate(positions), weights=weights, minlength=natoms)
+
+    atom_energy["total"] = atom_energy[keys].sum(axis=1)
+    decomposition["atom"] = atom_energy
+
+    stored_properties = dl.list_atom_properties()
+    for label, prop in [("molecule", "molecule_index"), ("residue", "residue_index")]:
+        if prop not in stored_properties: continue
+
+        groups = dl.get_atoms(prop).reindex(xyz.index)[prop].values
+        values, inverse = np.unique(groups, return_inverse=True)
+        reduced = {k: np.bincount(inverse, weights=atom_energy[k].values, minlength=values.shape[0])
+                   for k in atom_energy.columns}
+        decomposition[label] = pd.DataFrame(reduced, index=pd.Index(values, name=prop), columns=atom_energy.columns)
+
+    return decomposition
 
 
 def evaluate_form(form, parameters, global_dict=None, out=None, evaluate=True):
@@ -51,62 +496,226 @@ def evaluate_form(form, parameters, global_dict=None, out=None, evaluate=True):
         return ne.NumExpr(form)
 
 
-def evaluate_energy_expression(dl, utype):
+def evaluate_energy_expression(dl, utype, nonbonded=False, tile_size=1024, forces=False, decompose=False):
+    """
+    Evaluates the energy expression stored in a DataLayer.
+
+    Each geometric variable referenced by a functional form is computed once per order over all terms using integer
+    position arrays, see `_TermVariables`. The term parameters are then gathered by `term_index` and every functional
+    form is evaluated in a single vectorized call across all terms that share it. Functional forms are compiled once
+    per process, see `form_compiler`. If the DataLayer has a box, the atoms of each term are taken as minimum images of
+    one another so wrapped coordinates do not need to be unwrapped first.
+
+    Nonbonded terms use (ntypes, ntypes) parameter lookup arrays, the per-atom charges, and the stored pair scalings.
+    Without electrostatics settings every atom pair of the isolated system is evaluated, see
+    `nb_eval.nonbonded_energy`, otherwise pairs within the cutoff are found with a cell list and Ewald methods add the
+    long range "coul_long" energy, see `nb_eval.cutoff_nonbonded_energy`.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer to evaluate
+    utype : {None, str}
+        The energy unit of the output, otherwise the internal DataLayer energy units are used.
+    nonbonded : bool, optional
+        If True, adds the "vdw" and "coul" nonbonded energies and "coul_long" for Ewald methods.
+    tile_size : int, optional
+        The number of atoms along each edge of a nonbonded pair tile, bounds the temporary memory.
+    forces : bool, optional
+        If True, also returns the analytic forces of the bonded terms. The derivative of each functional form with
+        respect to its variable is derived once, see `form_compiler.get_term_derivative_kernel`, and combined with the
+        geometric gradients by the chain rule.
+    decompose : bool, optional
+        If True, also returns the bonded energy per term uid, per atom (each term is split evenly across its atoms),
+        per molecule_index, and per residue_index, see `_decompose_energy`.
+
+    Returns
+    -------
+    energy : dict
+        The energy of each component and the total energy
+    forces : np.ndarray
+        The (N, 3) forces in the order of the xyz table, only returned if `forces` is True
+    decomposition : dict
+        The decomposed bonded energy, only returned if `decompose` is True
+    """
+
+    if forces and nonbonded:
+        raise ValueError("evaluate_energy_expression: Forces are only available for the bonded terms.")
+    if decompose and nonbonded:
+        raise ValueError("evaluate_energy_expression: Energy decomposition is only available for the bonded terms.")
+
     energy = {"two-body": 0.0, "three-body": 0.0, "four-body": 0.0, "total": 0.0}
-    loop_data = {
-        "two-body": {
-            "order": 2,
-            "get_data": "get_bonds"
-        },
-        "three-body": {
-            "order": 3,
-            "get_data": "get_angles"
-        },
-        "four-body": {
-             "order": 4,
-             "get_data": "get_dihedrals"
-         }
-    }
 
     # Do the N-body terms
     xyz = dl.get_atoms("xyz")
+    coords = xyz[["X", "Y", "Z"]].values
+    box, _ = neighbor_list.box_from_datalayer(dl)
+
+    # Per-atom force contributions, scattered once at the end
+    force_positions = []
+    force_values = []
+
+    # The energy of every term for the decomposition
+    term_energies = []
 
+    for order_key, order, positions, term_index, groups in _build_bonded_terms(dl, xyz.index):
 
-    for order_key, inst in loop_data.items():
-        indices = dl.call_by_string(inst["get_data"])
-        order = inst["order"]
-        for idx, df in indices.groupby("term_index"):
-            if df.shape[0] == 0: continue
+        # Variables are computed distances and angles based on xyz positions
+        variables = _TermVariables(order, coords, positions, box=box)
 
-            # Variables are computed distances and angles based on xyz positions
-            variables = _compute_temporaries(order, xyz, df)
+        if decompose:
+            term_energies.append((order_key, positions, term_index, np.zeros(term_index.shape[0])))
 
-            # Form type is name of functional form (eg 'harmonic' and parameters contains parameters and values (eg 'K' : 200)
-            form_type, parameters = dl.get_term_parameter(order, idx)
+        for form_type, kernel, selection, parameters in groups:
 
-            # Above values are used to look up functional form (eg 'harmonic' -> K * (r-r0) ** 2)
-            form = metadata.get_term_metadata(order, "forms", form_type)["form"]
+            local_dict = variables.select(kernel.input_names, selection)
+            local_dict.update(parameters)
 
-            energy[order_key] += np.sum(evaluate_form(form, parameters, variables))
+            group_energy = kernel(local_dict)
+            energy[order_key] += np.sum(group_energy)
 
-    # LJ terms
-    # Electostatics
+            if decompose:
+                term_energies[-1][-1][selection] = group_energy
 
-    # Handle units
-    cf = 1.0
-    if utype is not None:
+            if not forces: continue
 
-        # Get the energy units stored in the data layer
-        dl_energy_units = units.convert_contexts("[energy]")
-        cf = units.conversion_factor(dl_energy_units, utype)
+            # Chain rule, F = -dE/dvariable * dvariable/dx
+            for name in kernel.input_names:
+                if name not in variables: continue
+
+                dkernel = form_compiler.get_term_derivative_kernel(order, form_type, name)
+                dE = np.broadcast_to(dkernel(local_dict), selection.shape)
+                for column, grad in variables.gradient(name):
+                    force_positions.append(positions[column][selection])
+                    force_values.append(-dE[:, None] * grad[selection])
+
+    # LJ terms and electrostatics
+    if nonbonded:
+        energy.update(_nonbonded_energy(coords, _build_nonbonded_data(dl, xyz), tile_size))
 
     # Sum up the dict
+    cf = _energy_conversion_factor(utype)
+    energy["total"] = sum(v for k, v in energy.items() if k != "total")
     for k, v in energy.items():
         energy[k] = cf * v
 
+    if not (forces or decompose):
+        return energy
+
+    ret = [energy]
+    if forces:
+        force_array = np.zeros((coords.shape[0], 3))
+        if len(force_positions):
+            force_positions = np.concatenate(force_positions)
+            force_values = np.concatenate(force_values)
+            for dim in range(3):
+                force_array[:, dim] = np.bincount(force_positions, weights=force_values[:, dim],
+                                                  minlength=coords.shape[0])
+        ret.append(cf * force_array)
+
+    if decompose:
+        ret.append(_decompose_energy(dl, xyz, term_energies, cf))
+
+    return tuple(ret)
+
+
+def _frame_chunks(frames, natoms, chunk_size):
+    """
+    Yields (nchunk, natoms, 3) arrays from a coordinate stack or an iterator of (natoms, 3) frames.
+    """
+
+    if isinstance(frames, np.ndarray):
+        if (frames.ndim != 3) or (frames.shape[1:] != (natoms, 3)):
+            raise ValueError("evaluate_energy_frames: Expected frames of shape (nframes, %d, 3), found %s." %
+                             (natoms, str(frames.shape)))
+        for start in range(0, frames.shape[0], chunk_size):
+            yield np.asarray(frames[start:start + chunk_size], dtype=np.float64)
+        return
+
+    chunk = []
+    for frame in frames:
+        frame = np.asarray(frame, dtype=np.float64)
+        if frame.shape != (natoms, 3):
+            raise ValueError("evaluate_energy_frames: Expected a frame of shape (%d, 3), found %s." %
+                             (natoms, str(frame.shape)))
+        chunk.append(frame)
+        if len(chunk) == chunk_size:
+            yield np.array(chunk)
+            chunk = []
+
+    if len(chunk):
+        yield np.array(chunk)
+
+
+def evaluate_energy_frames(dl, frames, utype=None, nonbonded=False, tile_size=1024, max_elements=2**22):
+    """
+    Evaluates the energy expression stored in a DataLayer for many sets of coordinates.
+
+    The topology positions, parameter gathers, compiled kernels, and nonbonded tables are built once. Bonded
+    geometry is then vectorized across chunks of frames, the chunk size is picked so that roughly `max_elements`
+    term values are held at once. Nonbonded energies are evaluated one frame at a time.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the energy expression
+    frames : {np.ndarray, iterable}
+        A (nframes, N, 3) coordinate stack or an iterable of (N, 3) frames, atoms are in the order of
+        `get_atoms("xyz")` and in the internal length units.
+    utype : {None, str}
+        The energy unit of the output, otherwise the internal DataLayer energy units are used.
+    nonbonded : bool, optional
+        If True, adds the "vdw" and "coul" nonbonded energies and "coul_long" for Ewald methods.
+    tile_size : int, optional
+        The number of atoms along each edge of a nonbonded pair tile, bounds the temporary memory.
+    max_elements : int, optional
+        The approximate number of term values evaluated at once.
+
+    Returns
+    -------
+    energy : dict of np.ndarray
+        The (nframes, ) energy of each component and the total energy
+    """
+
+    xyz = dl.get_atoms("xyz")
+    natoms = xyz.shape[0]
+    box, _ = neighbor_list.box_from_datalayer(dl)
+
+    bonded_terms = _build_bonded_terms(dl, xyz.index)
+    nb_data = None
+    if nonbonded:
+        nb_data = _build_nonbonded_data(dl, xyz)
+
+    nterms = max([natoms] + [x[3].shape[0] for x in bonded_terms])
+    chunk_size = max(1, max_elements // nterms)
+
+    energy = {"two-body": [], "three-body": [], "four-body": []}
+    for chunk in _frame_chunks(frames, natoms, chunk_size):
+        nchunk = chunk.shape[0]
+        for key in ["two-body", "three-body", "four-body"]:
+            energy[key].append(np.zeros(nchunk))
+
+        for order_key, order, positions, term_index, groups in bonded_terms:
+            variables = _TermVariables(order, chunk, positions, box=box)
+
+            # Parameters broadcast along the frame axis
+            for form_type, kernel, selection, parameters in groups:
+                local_dict = variables.select(kernel.input_names, selection)
+                local_dict.update(parameters)
+
+                energy[order_key][-1] += np.sum(kernel(local_dict), axis=1)
+
+        if nonbonded:
+            for frame in chunk:
+                for k, v in _nonbonded_energy(frame, nb_data, tile_size).items():
+                    if k not in energy:
+                        energy[k] = []
+                    energy[k].append(np.atleast_1d(v))
+
+    cf = _energy_conversion_factor(utype)
+    for k, v in energy.items():
+        energy[k] = cf * (np.concatenate(v) if len(v) else np.zeros(0))
 
-        # To avoid counting total
-        if k is not "total":
-            energy["total"] += v
+    energy["total"] = sum(v for k, v in energy.items())
 
     return energy
@@ -0,0 +1,446 @@
+"""
+Compiles the metadata functional forms into cached NumExpr kernels
+"""
+
+import ast
+import collections
+import re
+
+import numexpr as ne
+import numpy as np
+from numexpr import necompiler
+
+from .. import metadata
+
+__all__ = [
+    "FormKernel", "KernelCache", "kernel_cache", "compile_form", "differentiate_form", "get_term_kernel",
+    "get_term_derivative_kernel", "get_nb_kernel", "get_nb_derivative_kernel"
+]
+
+# Constants that may appear inside of a functional form
+_known_constants = {"PI": np.pi}
+
+# Always evaluate with true division regardless of the calling frame
+_context = {"truediv": True}
+
+
+class FormKernel(object):
+    """
+    A compiled functional form.
+
+    The form is parsed and compiled exactly once. NumExpr collapses duplicate subtrees during compilation so common
+    subexpressions, such as `(r-r0)` in the class2 bond, are only computed once per element.
+    """
+
+    def __init__(self, form, input_names, program, uses_vml=False):
+        self.form = form
+        self.input_names = tuple(input_names)
+        self._program = program
+        self._uses_vml = uses_vml
+
+    def __call__(self, local_dict, out=None):
+        """
+        Evaluates the kernel.
+
+        Parameters
+        ----------
+        local_dict : dict
+            A dictionary of variable and parameter arrays, extra keys are ignored.
+        out : np.ndarray, optional
+            An output array to write the result into.
+        """
+
+        try:
+            args = [local_dict[name] for name in self.input_names]
+        except KeyError as e:
+            raise KeyError("FormKernel: Did not find value '%s' for form '%s'." % (e.args[0], self.form))
+
+        return self._program(*args, out=out, order="K", casting="safe", ex_uses_vml=self._uses_vml)
+
+    def __repr__(self):
+        return "FormKernel('%s')" % self.form
+
+
+def _substitute_constants(form):
+    for name, value in _known_constants.items():
+        form = re.sub(r"\b%s\b" % name, repr(float(value)), form)
+    return form
+
+
+def _expression_names(form):
+    names, uses_vml = necompiler.getExprNames(form, _context)
+    return sorted(names), uses_vml
+
+
+class KernelCache(object):
+    """
+    A least recently used cache of compiled FormKernels.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of kernels held in memory.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._kernels = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._kernels)
+
+    def __contains__(self, key):
+        return key in self._kernels
+
+    def clear(self):
+        """
+        Clears the compiled kernels.
+        """
+        self._kernels.clear()
+
+    def get(self, key):
+        """
+        Returns the kernel stored under key or None if it has not been compiled.
+        """
+
+        if key not in self._kernels:
+            return None
+
+        self.hits += 1
+        kernel = self._kernels.pop(key)
+        self._kernels[key] = kernel
+        return kernel
+
+    def add(self, key, form, signature, uses_vml=False):
+        """
+        Compiles `form` with the given `signature` and stores the kernel under key.
+        """
+
+        self.misses += 1
+        program = ne.NumExpr(form, signature=signature, **_context)
+        kernel = FormKernel(form, [x[0] for x in signature], program, uses_vml=uses_vml)
+
+        self._kernels[key] = kernel
+        while len(self._kernels) > self.maxsize:
+            self._kernels.popitem(last=False)
+
+        return kernel
+
+
+# The process wide kernel cache
+kernel_cache = KernelCache()
+
+
+def compile_form(form, names, key=None, cache=None):
+    """
+    Compiles an arbitrary form string into a cached kernel.
+
+    Parameters
+    ----------
+    form : str
+        The functional form to compile
+    names : list of str
+        The variables and parameters allowed in the form
+    key : hashable, optional
+        The cache key, defaults to the form and the allowed names.
+    cache : KernelCache, optional
+        The cache to use, defaults to the process wide cache.
+
+    Returns
+    -------
+    kernel : FormKernel
+        The compiled kernel
+    """
+
+    if cache is None:
+        cache = kernel_cache
+
+    if key is None:
+        key = (form, tuple(names))
+
+    # Fast path, no parsing at all
+    kernel = cache.get(key)
+    if kernel is not None:
+        return kernel
+
+    form = _substitute_constants(form)
+    used_names, uses_vml = _expression_names(form)
+
+    missing = set(used_names) - set(names)
+    if missing:
+        raise KeyError("compile_form: Not all names for form %s resolved, missing %s" % (form, sorted(missing)))
+
+    signature = tuple((name, np.double) for name in used_names)
+    return cache.add(key, form, signature, uses_vml=uses_vml)
+
+
+# Derivatives of the single argument functions NumExpr understands, "{0}" is the argument
+_function_derivatives = {
+    "sin": "cos({0})",
+    "cos": "(-sin({0}))",
+    "tan": "(1.0 / cos({0}) ** 2)",
+    "arcsin": "(1.0 / sqrt(1.0 - ({0}) ** 2))",
+    "arccos": "(-1.0 / sqrt(1.0 - ({0}) ** 2))",
+    "arctan": "(1.0 / (1.0 + ({0}) ** 2))",
+    "sinh": "cosh({0})",
+    "cosh": "sinh({0})",
+    "tanh": "(1.0 - tanh({0}) ** 2)",
+    "exp": "exp({0})",
+    "expm1": "exp({0})",
+    "log": "(1.0 / ({0}))",
+    "log1p": "(1.0 / (1.0 + ({0})))",
+    "log10": "(1.0 / (({0}) * %r))" % float(np.log(10.0)),
+    "sqrt": "(0.5 / sqrt({0}))",
+}
+
+
+def _node_source(node):
+    """
+    Writes a fully parenthesized expression for an ast node.
+    """
+
+    if isinstance(node, ast.Num):
+        return repr(float(node.n))
+    elif isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.UnaryOp):
+        op = {ast.USub: "-", ast.UAdd: "+"}[type(node.op)]
+        return "(%s%s)" % (op, _node_source(node.operand))
+    elif isinstance(node, ast.BinOp):
+        op = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/", ast.Pow: "**"}[type(node.op)]
+        return "(%s %s %s)" % (_node_source(node.left), op, _node_source(node.right))
+    elif isinstance(node, ast.Call):
+        return "%s(%s)" % (node.func.id, ", ".join(_node_source(x) for x in node.args))
+    else:
+        raise TypeError("differentiate_form: Expression node '%s' not understood." % type(node).__name__)
+
+
+def _depends_on(node, variable):
+    return any(isinstance(x, ast.Name) and (x.id == variable) for x in ast.walk(node))
+
+
+def _multiply(left, right):
+    if (left is None) or (right is None):
+        return None
+    if right == "1.0":
+        return left
+    if left == "1.0":
+        return right
+    return "(%s * %s)" % (left, right)
+
+
+def _sum(terms):
+    if len(terms) == 1:
+        return terms[0]
+    return "(%s)" % " + ".join(terms)
+
+
+def _node_derivative(node, variable):
+    """
+    Returns the derivative of an ast node as an expression string, None is an exact zero.
+    """
+
+    if not _depends_on(node, variable):
+        return None
+
+    if isinstance(node, ast.Name):
+        return "1.0"
+
+    elif isinstance(node, ast.UnaryOp):
+        d = _node_derivative(node.operand, variable)
+        if isinstance(node.op, ast.USub):
+            return "(-%s)" % d
+        return d
+
+    elif isinstance(node, ast.BinOp):
+        left, right = node.left, node.right
+        dl = _node_derivative(left, variable)
+        dr = _node_derivative(right, variable)
+
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            if dr is None:
+                return dl
+            if isinstance(node.op, ast.Sub):
+                dr = "(-%s)" % dr
+            if dl is None:
+                return dr
+            return "(%s + %s)" % (dl, dr)
+
+        elif isinstance(node.op, ast.Mult):
+            terms = [x for x in [_multiply(dl, _node_source(right)), _multiply(_node_source(left), dr)] if x]
+            return _sum(terms)
+
+        elif isinstance(node.op, ast.Div):
+            terms = []
+            if dl is not None:
+                terms.append("(%s / %s)" % (dl, _node_source(right)))
+            if dr is not None:
+                terms.append("(-%s * %s / %s ** 2)" % (_node_source(left), dr, _node_source(right)))
+            return _sum(terms)
+
+        elif isinstance(node.op, ast.Pow):
+            base, exponent = _node_source(left), _node_source(right)
+
+            # Constant exponents keep negative bases well defined
+            power = "(%s * %s ** (%s - 1.0))" % (exponent, base, exponent)
+            if dr is None:
+                return _multiply(power, dl)
+
+            terms = [_multiply("(%s ** %s * log(%s))" % (base, exponent, base), dr), _multiply(power, dl)]
+            return _sum([x for x in terms if x])
+
+    elif isinstance(node, ast.Call):
+        name = node.func.id
+        if (name not in _function_derivatives) or (len(node.args) != 1):
+            raise KeyError("differentiate_form: Cannot differentiate function '%s'." % name)
+
+        arg = node.args[0]
+        return _multiply(_function_derivatives[name].format(_node_source(arg)), _node_derivative(arg, variable))
+
+    raise TypeError("differentiate_form: Expression node '%s' not understood." % type(node).__name__)
+
+
+def differentiate_form(form, variable):
+    """
+    Symbolically differentiates a functional form.
+
+    Parameters
+    ----------
+    form : str
+        The functional form (eg 'K*(r-R0) ** 2')
+    variable : str
+        The variable to differentiate with respect to
+
+    Returns
+    -------
+    derivative : str
+        The derivative as a NumExpr compatible expression, "0.0" if the form does not depend on the variable.
+
+    Examples
+    --------
+    >>> differentiate_form("K*(r-R0) ** 2", "r")
+    '(K * (2.0 * (r - R0) ** (2.0 - 1.0)))'
+    """
+
+    tree = ast.parse(_substitute_constants(form).strip(), mode="eval")
+    derivative = _node_derivative(tree.body, variable)
+    if derivative is None:
+        return "0.0"
+    return derivative
+
+
+def get_term_kernel(order, form_name, cache=None):
+    """
+    Obtains the compiled kernel of a registered two, three, or four-body functional form.
+
+    Parameters
+    ----------
+    order : {int, str}
+        The order of the functional form (2, 3, 4)
+    form_name : str
+        The name of the functional form (eg 'harmonic')
+    cache : KernelCache, optional
+        The cache to use, defaults to the process wide cache.
+    """
+
+    order = metadata.sanitize_term_order_name(order)
+    term_md = metadata.get_term_metadata(order, "forms", form_name)
+
+    names = list(metadata.get_term_metadata(order, "variables")) + term_md["parameters"]
+    key = (order, form_name, term_md["form"], tuple(term_md["parameters"]))
+    return compile_form(term_md["form"], names, key=key, cache=cache)
+
+
+def get_term_derivative_kernel(order, form_name, variable, cache=None):
+    """
+    Obtains the compiled derivative of a registered two, three, or four-body functional form.
+
+    The derivative is derived symbolically on the first request and cached like any other kernel.
+
+    Parameters
+    ----------
+    order : {int, str}
+        The order of the functional form (2, 3, 4)
+    form_name : str
+        The name of the functional form (eg 'harmonic')
+    variable : str
+        The variable to differentiate with respect to (eg 'r')
+    cache : KernelCache, optional
+        The cache to use, defaults to the process wide cache.
+    """
+
+    order = metadata.sanitize_term_order_name(order)
+    term_md = metadata.get_term_metadata(order, "forms", form_name)
+
+    names = list(metadata.get_term_metadata(order, "variables")) + term_md["parameters"]
+    if variable not in names:
+        raise KeyError("get_term_derivative_kernel: Variable '%s' not found for order %d." % (variable, order))
+
+    key = ("d", order, form_name, variable, term_md["form"], tuple(term_md["parameters"]))
+    if cache is None:
+        cache = kernel_cache
+    kernel = cache.get(key)
+    if kernel is not None:
+        return kernel
+
+    return compile_form(differentiate_form(term_md["form"], variable), names, key=key, cache=cache)
+
+
+def get_nb_kernel(form_name, model=None, cache=None):
+    """
+    Obtains the compiled kernel of a registered nonbonded functional form.
+
+    Parameters
+    ----------
+    form_name : str
+        The name of the nonbonded form (eg 'LJ')
+    model : str, optional
+        The model of the form (eg 'AB'), defaults to the default model of the form.
+    cache : KernelCache, optional
+        The cache to use, defaults to the process wide cache.
+    """
+
+    if model is None:
+        model = metadata.get_nb_metadata(form_name, "default")
+    form_md = metadata.get_nb_metadata(form_name, model=model)
+
+    names = list(metadata.nb_metadata["variables"]) + form_md["parameters"]
+    key = ("nb", form_name, model, form_md["form"], tuple(form_md["parameters"]))
+    return compile_form(form_md["form"], names, key=key, cache=cache)
+
+
+def get_nb_derivative_kernel(form_name, variable, model=None, cache=None):
+    """
+    Obtains the compiled derivative of a registered nonbonded functional form.
+
+    Parameters
+    ----------
+    form_name : str
+        The name of the nonbonded form (eg 'LJ')
+    variable : str
+        The variable or parameter to differentiate with respect to (eg 'r' or 'A')
+    model : str, optional
+        The model of the form (eg 'AB'), defaults to the default model of the form.
+    cache : KernelCache, optional
+        The cache to use, defaults to the process wide cache.
+    """
+
+    if model is None:
+        model = metadata.get_nb_metadata(form_name, "default")
+    form_md = metadata.get_nb_metadata(form_name, model=model)
+
+    names = list(metadata.nb_metadata["variables"]) + form_md["parameters"]
+    if variable not in names:
+        raise KeyError("get_nb_derivative_kernel: Variable '%s' not found for form '%s'." % (variable, form_name))
+
+    key = ("d", "nb", form_name, model, variable, form_md["form"], tuple(form_md["parameters"]))
+    if cache is None:
+        cache = kernel_cache
+    kernel = cache.get(key)
+    if kernel is not None:
+        return kernel
+
+    return compile_form(differentiate_form(form_md["form"], variable), names, key=key, cache=cache)
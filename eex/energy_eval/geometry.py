@@ -14,7 +14,18 @@ def _norm(points):
     return np.sqrt(np.einsum("ij,ij->i", tmp, tmp))
 
 
-def compute_distance(points1, points2):
+def _displacement(points1, points2, box):
+    """
+    Returns points1 - points2, shifted to the minimum image if a box is given.
+    """
+
+    vectors = np.atleast_2d(points1) - np.atleast_2d(points2)
+    if box is not None:
+        vectors = minimum_image(vectors, box)
+    return vectors
+
+
+def compute_distance(points1, points2, box=None):
     """
     Computes the pairwise distance between all points in points1 and points2.
 
@@ -24,6 +35,8 @@ def compute_distance(points1, points2):
         The first list of points, can be 1D or 2D
     points2 : np.ndarray
         The second list of points, can be 1D or 2D
+    box : np.ndarray, optional
+        The (3, 3) periodic box, see `box_matrix`. If given, every displacement uses the minimum image.
 
     Returns
     -------
@@ -35,13 +48,10 @@ def compute_distance(points1, points2):
     Units are not considered inside these expressions, please preconvert to the same units before using.
     """
 
-    points1 = np.atleast_2d(points1)
-    points2 = np.atleast_2d(points2)
+    return _norm(_displacement(points1, points2, box))
 
-    return _norm(points1 - points2)
 
-
-def compute_angle(points1, points2, points3, degrees=False):
+def compute_angle(points1, points2, points3, degrees=False, box=None):
     """
     Computes the angle (p1, p2 [vertex], p3) between the provided points on a per-row basis.
 
@@ -55,6 +65,8 @@ def compute_angle(points1, points2, points3, degrees=False):
         The third list of points, can be 1D or 2D
     degrees : bool, options
         Returns the angle in degress rather than radians if True
+    box : np.ndarray, optional
+        The (3, 3) periodic box, see `box_matrix`. If given, every displacement uses the minimum image.
 
     Returns
     -------
@@ -66,12 +78,8 @@ def compute_angle(points1, points2, points3, degrees=False):
     Units are not considered inside these expressions, please preconvert to the same units before using.
     """
 
-    points1 = np.atleast_2d(points1)
-    points2 = np.atleast_2d(points2)
-    points3 = np.atleast_2d(points3)
-
-    v12 = points1 - points2
-    v23 = points2 - points3
+    v12 = _displacement(points1, points2, box)
+    v23 = _displacement(points2, points3, box)
 
     denom = _norm(v12) * _norm(v23)
     cosine_angle = np.einsum("ij,ij->i", v12, v23) / denom
@@ -84,7 +92,7 @@ def compute_angle(points1, points2, points3, degrees=False):
         return angle
 
 
-def compute_dihedral(points1, points2, points3, points4, degrees=False):
+def compute_dihedral(points1, points2, points3, points4, degrees=False, box=None):
     """
     Computes the dihedral angle (p1, p2, p3, p4) between the provided points on a per-row basis.
 
@@ -100,6 +108,8 @@ def compute_dihedral(points1, points2, points3, points4, degrees=False):
         The third list of points, can be 1D or 2D
     degrees : bool, options
         Returns the dihedral angle in degress rather than radians if True
+    box : np.ndarray, optional
+        The (3, 3) periodic box, see `box_matrix`. If given, every displacement uses the minimum image.
 
     Returns
     -------
@@ -111,15 +121,10 @@ def compute_dihedral(points1, points2, points3, points4, degrees=False):
     Units are not considered inside these expressions, please preconvert to the same units before using.
     """
 
-    points1 = np.atleast_2d(points1)
-    points2 = np.atleast_2d(points2)
-    points3 = np.atleast_2d(points3)
-    points4 = np.atleast_2d(points4)
-
     # Build the three vectors
-    v12 = points1 - points2
-    v23 = points2 - points3
-    v34 = points3 - points4
+    v12 = _displacement(points1, points2, box)
+    v23 = _displacement(points2, points3, box)
+    v34 = _displacement(points3, points4, box)
 
     # Build vectors normal to the two planes
     n123 = np.cross(v12, v23)
@@ -135,3 +140,676 @@ def compute_dihedral(points1, points2, points3, points4, degrees=False):
         return np.degrees(angle)
     else:
         return angle
+
+
+def compute_plane_distance(points1, points2, points3, points4, box=None):
+    """
+    Computes the signed distance of points1 from the plane through (p2, p3, p4) on a per-row basis.
+
+    Parameters
+    ----------
+    points1 : np.ndarray
+        The out of plane points, can be 1D or 2D
+    points2 : np.ndarray
+        The first list of plane points, can be 1D or 2D
+    points3 : np.ndarray
+        The second list of plane points, can be 1D or 2D
+    points4 : np.ndarray
+        The third list of plane points, can be 1D or 2D
+    box : np.ndarray, optional
+        The (3, 3) periodic box, see `box_matrix`. If given, every displacement uses the minimum image.
+
+    Returns
+    -------
+    distances : np.ndarray
+        The distance along the plane normal (p3 - p2) x (p4 - p2)
+
+    Notes
+    -----
+    Units are not considered inside these expressions, please preconvert to the same units before using.
+    """
+
+    normal = np.cross(_displacement(points3, points2, box), _displacement(points4, points2, box))
+    return np.einsum("ij,ij->i", _displacement(points1, points2, box), normal) / _norm(normal)
+
+
+def compute_plane_angle(points1, points2, points3, points4, degrees=False, box=None):
+    """
+    Computes the angle between the vector (p1 -> p4) and the plane through (p1, p2, p3) on a per-row basis.
+
+    Parameters
+    ----------
+    points1 : np.ndarray
+        The central points, can be 1D or 2D
+    points2 : np.ndarray
+        The second list of plane points, can be 1D or 2D
+    points3 : np.ndarray
+        The third list of plane points, can be 1D or 2D
+    points4 : np.ndarray
+        The out of plane points, can be 1D or 2D
+    degrees : bool, options
+        Returns the angle in degress rather than radians if True
+    box : np.ndarray, optional
+        The (3, 3) periodic box, see `box_matrix`. If given, every displacement uses the minimum image.
+
+    Returns
+    -------
+    angles : np.ndarray
+        The signed angle in radians, positive along the plane normal (p2 - p1) x (p3 - p1)
+
+    Notes
+    -----
+    Units are not considered inside these expressions, please preconvert to the same units before using.
+    """
+
+    normal = np.cross(_displacement(points2, points1, box), _displacement(points3, points1, box))
+    v14 = _displacement(points4, points1, box)
+
+    sine_angle = np.einsum("ij,ij->i", normal, v14) / (_norm(normal) * _norm(v14))
+    angle = np.arcsin(np.clip(sine_angle, -1.0, 1.0))
+
+    if degrees:
+        return np.degrees(angle)
+    else:
+        return angle
+
+
+def distance_gradient(points1, points2):
+    """
+    Computes the distance between points1 and points2 and its gradient with respect to each point.
+
+    Parameters
+    ----------
+    points1 : np.ndarray
+        The first list of points, 2D
+    points2 : np.ndarray
+        The second list of points, 2D
+
+    Returns
+    -------
+    distances : np.ndarray
+        The (N, ) distances
+    gradients : list of np.ndarray
+        The (N, 3) gradients of the distance with respect to points1 and points2
+    """
+
+    v12 = np.atleast_2d(points1) - np.atleast_2d(points2)
+    r = _norm(v12)
+    g1 = v12 / r[:, None]
+
+    return r, [g1, -g1]
+
+
+def angle_gradient(points1, points2, points3):
+    """
+    Computes the angle (p1, p2 [vertex], p3) in radians and its gradient with respect to each point.
+
+    Parameters
+    ----------
+    points1 : np.ndarray
+        The first list of points, 2D
+    points2 : np.ndarray
+        The vertex points, 2D
+    points3 : np.ndarray
+        The third list of points, 2D
+
+    Returns
+    -------
+    angles : np.ndarray
+        The (N, ) angles in radians
+    gradients : list of np.ndarray
+        The (N, 3) gradients of the angle with respect to points1, points2, and points3
+
+    Notes
+    -----
+    The gradient is singular for linear angles.
+    """
+
+    u = np.atleast_2d(points1) - np.atleast_2d(points2)
+    v = np.atleast_2d(points3) - np.atleast_2d(points2)
+
+    ru = _norm(u)
+    rv = _norm(v)
+    u_hat = u / ru[:, None]
+    v_hat = v / rv[:, None]
+
+    cosine_angle = np.clip(np.einsum("ij,ij->i", u_hat, v_hat), -1.0, 1.0)
+    angle = np.arccos(cosine_angle)
+    sine_angle = np.sqrt(1.0 - cosine_angle**2)
+
+    g1 = (cosine_angle[:, None] * u_hat - v_hat) / (ru * sine_angle)[:, None]
+    g3 = (cosine_angle[:, None] * v_hat - u_hat) / (rv * sine_angle)[:, None]
+
+    return angle, [g1, -g1 - g3, g3]
+
+
+def dihedral_gradient(points1, points2, points3, points4):
+    """
+    Computes the dihedral angle (p1, p2, p3, p4) in radians and its gradient with respect to each point.
+
+    Parameters
+    ----------
+    points1 : np.ndarray
+        The first list of points, 2D
+    points2 : np.ndarray
+        The second list of points, 2D
+    points3 : np.ndarray
+        The third list of points, 2D
+    points4 : np.ndarray
+        The fourth list of points, 2D
+
+    Returns
+    -------
+    dihedrals : np.ndarray
+        The (N, ) dihedral angles in radians, matching `compute_dihedral`
+    gradients : list of np.ndarray
+        The (N, 3) gradients of the dihedral with respect to each point
+
+    Notes
+    -----
+    H. Bekker, Molecular dynamics simulation methods revised, PhD thesis, University of Groningen (1996)
+    """
+
+    angle = compute_dihedral(points1, points2, points3, points4)
+
+    b1 = np.atleast_2d(points2) - np.atleast_2d(points1)
+    b2 = np.atleast_2d(points3) - np.atleast_2d(points2)
+    b3 = np.atleast_2d(points4) - np.atleast_2d(points3)
+
+    m = np.cross(b1, b2)
+    n = np.cross(b2, b3)
+
+    b2_sq = np.einsum("ij,ij->i", b2, b2)
+    b2_norm = np.sqrt(b2_sq)
+
+    # compute_dihedral measures the angle with the opposite sign of Bekker
+    g1 = (b2_norm / np.einsum("ij,ij->i", m, m))[:, None] * m
+    g4 = -(b2_norm / np.einsum("ij,ij->i", n, n))[:, None] * n
+
+    p = -(np.einsum("ij,ij->i", b1, b2) / b2_sq)[:, None]
+    q = -(np.einsum("ij,ij->i", b3, b2) / b2_sq)[:, None]
+
+    g2 = (p - 1.0) * g1 - q * g4
+    g3 = (q - 1.0) * g4 - p * g1
+
+    return angle, [g1, g2, g3, g4]
+
+
+def box_matrix(box_size):
+    """
+    Builds the (3, 3) matrix of lattice vectors from the lattice constants of a box.
+
+    The first vector lies along x and the second in the xy plane, this matches the LAMMPS convention so that the
+    tilt factors are H[1, 0] (xy), H[2, 0] (xz), and H[2, 1] (yz).
+
+    Parameters
+    ----------
+    box_size : dict
+        The {'a', 'b', 'c', 'alpha', 'beta', 'gamma'} lattice constants as returned by `DataLayer.get_box_size`, angles
+        are in radians.
+
+    Returns
+    -------
+    H : np.ndarray
+        The (3, 3) matrix whose rows are the lattice vectors
+    """
+
+    for key in ["a", "b", "c", "alpha", "beta", "gamma"]:
+        if key not in box_size:
+            raise KeyError("box_matrix: Could not find key '%s'." % key)
+
+    a, b, c = box_size["a"], box_size["b"], box_size["c"]
+
+    lx = a
+    xy = b * np.cos(box_size["gamma"])
+    xz = c * np.cos(box_size["beta"])
+    ly = np.sqrt(b**2 - xy**2)
+    yz = (b * c * np.cos(box_size["alpha"]) - xy * xz) / ly
+    lz = np.sqrt(c**2 - xz**2 - yz**2)
+
+    # Remove round off from right angles
+    H = np.array([[lx, 0.0, 0.0], [xy, ly, 0.0], [xz, yz, lz]])
+    H[np.abs(H) < 1.e-12 * max(a, b, c)] = 0.0
+
+    return H
+
+
+def minimum_image(vectors, box):
+    """
+    Shifts displacement vectors to their nearest periodic image.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        A (N, 3) array of displacement vectors
+    box : np.ndarray
+        The (3, 3) matrix whose rows are the lattice vectors, see `box_matrix`.
+
+    Returns
+    -------
+    vectors : np.ndarray
+        The (N, 3) minimum image displacement vectors
+
+    Notes
+    -----
+    The image is found in fractional coordinates which is exact for orthorhombic boxes and for triclinic boxes whose
+    tilt factors are at most half of the box length, as in LAMMPS.
+    """
+
+    box = np.asarray(box, dtype=np.float64)
+    vectors = np.atleast_2d(vectors)
+
+    # Orthorhombic boxes do not need the fractional transform
+    lengths = np.diag(box)
+    if np.count_nonzero(box - np.diag(lengths)) == 0:
+        return vectors - lengths * np.round(vectors / lengths)
+
+    frac = np.dot(vectors, np.linalg.inv(box))
+    frac -= np.round(frac)
+    return np.dot(frac, box)
+
+
+def make_whole(coords, bonds, box):
+    """
+    Unwraps molecules that were split across the periodic boundaries.
+
+    Every connected component of the bond graph is walked breadth first from its lowest atom position, which stays in
+    place, and each newly reached atom is moved to the minimum image of the atom it was reached from. Each level of the
+    walk is vectorized across every molecule so the number of Python iterations is the depth of the deepest molecule.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of cartesian coordinates
+    bonds : np.ndarray
+        A (nbonds, 2) array of the row positions of the bonded atoms
+    box : np.ndarray
+        The (3, 3) matrix whose rows are the lattice vectors, see `box_matrix`.
+
+    Returns
+    -------
+    coords : np.ndarray
+        The (N, 3) unwrapped coordinates, the input is not modified.
+
+    Notes
+    -----
+    Every bond must be shorter than half of the box, see `minimum_image`.
+    """
+
+    coords = np.array(coords, dtype=np.float64)
+    natoms = coords.shape[0]
+
+    bonds = np.asarray(bonds, dtype=np.intp).reshape(-1, 2)
+    if bonds.shape[0] and ((bonds.min() < 0) or (bonds.max() >= natoms)):
+        raise IndexError("make_whole: Bond positions out of bounds for %d coordinates." % natoms)
+
+    # Symmetric adjacency in compressed sparse row form
+    source = np.concatenate((bonds[:, 0], bonds[:, 1]))
+    target = np.concatenate((bonds[:, 1], bonds[:, 0]))
+    order = np.argsort(source, kind="mergesort")
+    target = target[order]
+    degree = np.bincount(source, minlength=natoms)
+    offsets = np.cumsum(degree) - degree
+
+    # Label every molecule by its lowest atom position, pointer jumping shortens the propagation
+    labels = np.arange(natoms)
+    bonded = np.flatnonzero(degree)
+    while bonded.shape[0]:
+        new_labels = labels.copy()
+        new_labels[bonded] = np.minimum(labels[bonded], np.minimum.reduceat(labels[target], offsets[bonded]))
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+    # Walk outwards from the roots of every molecule at once
+    frontier = np.flatnonzero(labels == np.arange(natoms))
+    visited = np.zeros(natoms, dtype=bool)
+    visited[frontier] = True
+    while frontier.shape[0]:
+        counts = degree[frontier]
+        total = counts.sum()
+        if total == 0:
+            break
+
+        parents = np.repeat(frontier, counts)
+        within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        children = target[np.repeat(offsets[frontier], counts) + within]
+
+        keep = ~visited[children]
+        children, first = np.unique(children[keep], return_index=True)
+        parents = parents[keep][first]
+
+        coords[children] = coords[parents] + minimum_image(coords[children] - coords[parents], box)
+        visited[children] = True
+        frontier = children
+
+    return coords
+
+
+# The number of terms processed at once by the indexed kernels, the scratch buffers stay within the L2 cache
+_default_block_size = 2048
+
+
+class _Scratch(object):
+    """
+    Fixed size scratch buffers reused across the blocks of an indexed kernel.
+    """
+
+    def __init__(self, block_size, dtype, nvectors, nscalars):
+        self.vectors = [np.empty((block_size, 3), dtype=dtype) for x in range(nvectors)]
+        self.scalars = [np.empty(block_size, dtype=dtype) for x in range(nscalars)]
+
+    def view(self, n):
+        return [x[:n] for x in self.vectors], [x[:n] for x in self.scalars]
+
+
+def _prepare_indexed(coords, indices, box, out, dtype, block_size):
+    """
+    Validates the inputs of an indexed kernel and allocates the output.
+
+    The box is returned as the (lattice, inverse) pair used by `_apply_image`, the diagonals for orthorhombic boxes.
+    """
+
+    if dtype is None:
+        dtype = np.float64
+    dtype = np.dtype(dtype)
+    if dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+        raise TypeError("geometry: Only float32 and float64 kernels are available, found %s." % str(dtype))
+
+    coords = np.ascontiguousarray(coords, dtype=dtype)
+    if (coords.ndim != 2) or (coords.shape[1] != 3):
+        raise ValueError("geometry: Coordinates must have shape (N, 3), found %s." % str(coords.shape))
+
+    indices = [np.asarray(x, dtype=np.intp) for x in indices]
+    nterms = indices[0].shape[0]
+    for index in indices:
+        if index.shape != (nterms, ):
+            raise ValueError("geometry: Index arrays must be one dimensional and of the same length.")
+        if nterms and ((index.min() < 0) or (index.max() >= coords.shape[0])):
+            raise IndexError("geometry: Index out of bounds for %d coordinates." % coords.shape[0])
+
+    if out is None:
+        out = np.empty(nterms, dtype=dtype)
+    elif out.shape != (nterms, ):
+        raise ValueError("geometry: Output buffer must have shape (%d, ), found %s." % (nterms, str(out.shape)))
+
+    if block_size is None:
+        block_size = _default_block_size
+
+    image = None
+    if box is not None:
+        box = np.asarray(box, dtype=np.float64)
+        if box.shape != (3, 3):
+            raise ValueError("geometry: Box must have shape (3, 3), found %s." % str(box.shape))
+        lengths = np.diag(box)
+        if np.count_nonzero(box - np.diag(lengths)) == 0:
+            image = (lengths.astype(dtype), (1.0 / lengths).astype(dtype))
+        else:
+            image = (box.astype(dtype), np.linalg.inv(box).astype(dtype))
+
+    return coords, indices, image, out, dtype, block_size
+
+
+def _take(coords, index, out):
+    # Indices are validated up front, "clip" avoids the buffered copy of the default mode
+    return np.take(coords, index, axis=0, out=out, mode="clip")
+
+
+def _apply_image(out, tmp, image):
+    """
+    Shifts the displacements in out to their minimum image in place, see `minimum_image`.
+    """
+
+    lattice, inverse = image
+    if lattice.ndim == 1:
+        np.multiply(out, inverse, out=tmp)
+    else:
+        np.dot(out, inverse, out=tmp)
+
+    # frac - round(frac) back to cartesian
+    np.rint(tmp, out=out)
+    np.subtract(tmp, out, out=tmp)
+
+    if lattice.ndim == 1:
+        return np.multiply(tmp, lattice, out=out)
+    else:
+        return np.dot(tmp, lattice, out=out)
+
+
+def _subtract_points(coords, index1, index2, out, tmp, image=None):
+    """
+    out = coords[index1] - coords[index2] without temporaries, the minimum image if image is not None
+    """
+    _take(coords, index1, out)
+    _take(coords, index2, tmp)
+    np.subtract(out, tmp, out=out)
+    if image is not None:
+        _apply_image(out, tmp, image)
+    return out
+
+
+def _dot(a, b, out):
+    return np.einsum("ij,ij->i", a, b, out=out)
+
+
+def _cross(a, b, out, tmp):
+    """
+    out = a x b without temporaries, tmp is a scalar buffer
+    """
+
+    for x, y, z in [(0, 1, 2), (1, 2, 0), (2, 0, 1)]:
+        np.multiply(a[:, y], b[:, z], out=out[:, x])
+        np.multiply(a[:, z], b[:, y], out=tmp)
+        np.subtract(out[:, x], tmp, out=out[:, x])
+    return out
+
+
+def indexed_distance(coords, index1, index2, box=None, out=None, dtype=None, block_size=None):
+    """
+    Computes the distance between coords[index1] and coords[index2] in cache sized blocks.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of coordinates
+    index1, index2 : np.ndarray
+        The (nterms, ) row positions of each point
+    box : np.ndarray, optional
+        The (3, 3) periodic box, see `box_matrix`. If given, every displacement uses the minimum image.
+    out : np.ndarray, optional
+        A (nterms, ) output buffer of the kernel dtype
+    dtype : {np.float64, np.float32}, optional
+        The precision of the computation, defaults to float64
+    block_size : int, optional
+        The number of terms computed at once, bounds the scratch memory.
+
+    Returns
+    -------
+    distances : np.ndarray
+        The (nterms, ) distances, `out` if provided
+    """
+
+    coords, (index1, index2), image, out, dtype, block_size = _prepare_indexed(coords, [index1, index2], box, out,
+                                                                              dtype, block_size)
+    scratch = _Scratch(block_size, dtype, 2, 0)
+
+    for start in range(0, out.shape[0], block_size):
+        stop = min(start + block_size, out.shape[0])
+        (v12, tmp), _ = scratch.view(stop - start)
+
+        _subtract_points(coords, index1[start:stop], index2[start:stop], v12, tmp, image)
+        np.sqrt(_dot(v12, v12, out[start:stop]), out=out[start:stop])
+
+    return out
+
+
+def indexed_angle(coords, index1, index2, index3, box=None, out=None, dtype=None, block_size=None):
+    """
+    Computes the angle (p1, p2 [vertex], p3) in radians from row positions into coords in cache sized blocks.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of coordinates
+    index1, index2, index3 : np.ndarray
+        The (nterms, ) row positions of each point
+    box : np.ndarray, optional
+        The (3, 3) periodic box, see `box_matrix`. If given, every displacement uses the minimum image.
+    out : np.ndarray, optional
+        A (nterms, ) output buffer of the kernel dtype
+    dtype : {np.float64, np.float32}, optional
+        The precision of the computation, defaults to float64
+    block_size : int, optional
+        The number of terms computed at once, bounds the scratch memory.
+
+    Returns
+    -------
+    angles : np.ndarray
+        The (nterms, ) angles in radians, `out` if provided
+    """
+
+    coords, (index1, index2, index3), image, out, dtype, block_size = _prepare_indexed(
+        coords, [index1, index2, index3], box, out, dtype, block_size)
+    scratch = _Scratch(block_size, dtype, 3, 1)
+
+    for start in range(0, out.shape[0], block_size):
+        stop = min(start + block_size, out.shape[0])
+        (u, v, tmp), (norm, ) = scratch.view(stop - start)
+        result = out[start:stop]
+
+        _subtract_points(coords, index1[start:stop], index2[start:stop], u, tmp, image)
+        _subtract_points(coords, index3[start:stop], index2[start:stop], v, tmp, image)
+
+        # cos(theta) = u.v / (|u| |v|)
+        _dot(u, u, result)
+        _dot(v, v, norm)
+        np.multiply(result, norm, out=norm)
+        np.sqrt(norm, out=norm)
+        _dot(u, v, result)
+        np.divide(result, norm, out=result)
+
+        np.clip(result, -1.0, 1.0, out=result)
+        np.arccos(result, out=result)
+
+    return out
+
+
+def indexed_dihedral(coords, index1, index2, index3, index4, box=None, out=None, dtype=None, block_size=None):
+    """
+    Computes the dihedral angle (p1, p2, p3, p4) in radians from row positions into coords in cache sized blocks.
+
+    Matches `compute_dihedral`.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of coordinates
+    index1, index2, index3, index4 : np.ndarray
+        The (nterms, ) row positions of each point
+    box : np.ndarray, optional
+        The (3, 3) periodic box, see `box_matrix`. If given, every displacement uses the minimum image.
+    out : np.ndarray, optional
+        A (nterms, ) output buffer of the kernel dtype
+    dtype : {np.float64, np.float32}, optional
+        The precision of the computation, defaults to float64
+    block_size : int, optional
+        The number of terms computed at once, bounds the scratch memory.
+
+    Returns
+    -------
+    dihedrals : np.ndarray
+        The (nterms, ) dihedral angles in radians, `out` if provided
+    """
+
+    coords, (index1, index2, index3, index4), image, out, dtype, block_size = _prepare_indexed(
+        coords, [index1, index2, index3, index4], box, out, dtype, block_size)
+    scratch = _Scratch(block_size, dtype, 6, 2)
+
+    for start in range(0, out.shape[0], block_size):
+        stop = min(start + block_size, out.shape[0])
+        (v12, v23, v34, n123, n234, tmp), (left, scalar_tmp) = scratch.view(stop - start)
+        block = slice(start, stop)
+
+        _subtract_points(coords, index1[block], index2[block], v12, tmp, image)
+        _subtract_points(coords, index2[block], index3[block], v23, tmp, image)
+        _subtract_points(coords, index3[block], index4[block], v34, tmp, image)
+
+        # Normals of the two planes, then n123 x n234 reuses v12
+        _cross(v12, v23, n123, scalar_tmp)
+        _cross(v23, v34, n234, scalar_tmp)
+        _cross(n123, n234, v12, scalar_tmp)
+
+        # left = (n1234 . v23) / |v23|, right = n123 . n234
+        _dot(v12, v23, left)
+        _dot(v23, v23, scalar_tmp)
+        np.sqrt(scalar_tmp, out=scalar_tmp)
+        np.divide(left, scalar_tmp, out=left)
+
+        _dot(n123, n234, out[block])
+        np.arctan2(left, out[block], out=out[block])
+
+    return out
+
+
+def indexed_plane_distance(coords, index1, index2, index3, index4, box=None, out=None, dtype=None, block_size=None):
+    """
+    Computes the signed distance of p1 from the plane through (p2, p3, p4) in cache sized blocks.
+
+    Matches `compute_plane_distance`, see `indexed_distance` for the parameters.
+    """
+
+    coords, (index1, index2, index3, index4), image, out, dtype, block_size = _prepare_indexed(
+        coords, [index1, index2, index3, index4], box, out, dtype, block_size)
+    scratch = _Scratch(block_size, dtype, 4, 1)
+
+    for start in range(0, out.shape[0], block_size):
+        stop = min(start + block_size, out.shape[0])
+        (v23, v24, normal, tmp), (norm, ) = scratch.view(stop - start)
+        block = slice(start, stop)
+
+        _subtract_points(coords, index3[block], index2[block], v23, tmp, image)
+        _subtract_points(coords, index4[block], index2[block], v24, tmp, image)
+        _cross(v23, v24, normal, norm)
+
+        _subtract_points(coords, index1[block], index2[block], v23, tmp, image)
+        _dot(v23, normal, out[block])
+        _dot(normal, normal, norm)
+        np.sqrt(norm, out=norm)
+        np.divide(out[block], norm, out=out[block])
+
+    return out
+
+
+def indexed_plane_angle(coords, index1, index2, index3, index4, box=None, out=None, dtype=None, block_size=None):
+    """
+    Computes the angle between (p1 -> p4) and the plane through (p1, p2, p3) in radians in cache sized blocks.
+
+    Matches `compute_plane_angle`, see `indexed_distance` for the parameters.
+    """
+
+    coords, (index1, index2, index3, index4), image, out, dtype, block_size = _prepare_indexed(
+        coords, [index1, index2, index3, index4], box, out, dtype, block_size)
+    scratch = _Scratch(block_size, dtype, 4, 2)
+
+    for start in range(0, out.shape[0], block_size):
+        stop = min(start + block_size, out.shape[0])
+        (v12, v13, normal, tmp), (norm, scalar_tmp) = scratch.view(stop - start)
+        block = slice(start, stop)
+
+        _subtract_points(coords, index2[block], index1[block], v12, tmp, image)
+        _subtract_points(coords, index3[block], index1[block], v13, tmp, image)
+        _cross(v12, v13, normal, norm)
+
+        _subtract_points(coords, index4[block], index1[block], v12, tmp, image)
+        _dot(normal, normal, norm)
+        _dot(v12, v12, scalar_tmp)
+        np.multiply(norm, scalar_tmp, out=norm)
+        np.sqrt(norm, out=norm)
+
+        _dot(normal, v12, out[block])
+        np.divide(out[block], norm, out=out[block])
+        np.clip(out[block], -1.0, 1.0, out=out[block])
+        np.arcsin(out[block], out=out[block])
+
+    return out
@@ -0,0 +1,216 @@
+"""
+Incremental evaluation of the bonded energy for partial coordinate moves
+"""
+
+import numpy as np
+
+from . import expression_eval
+from . import neighbor_list
+
+__all__ = ["IncrementalEvaluator"]
+
+
+class _OrderTerms(object):
+    """
+    The cached terms of a single order.
+    """
+
+    def __init__(self, order_key, order, positions, groups, natoms, box=None):
+        self.order_key = order_key
+        self.order = order
+        self.positions = positions
+        self.box = box
+        self.nterms = positions[0].shape[0]
+
+        # Which group and row within the group every term uses
+        self.groups = []
+        self.term_group = np.zeros(self.nterms, dtype=int)
+        self.term_row = np.zeros(self.nterms, dtype=int)
+        for num, (form_type, kernel, selection, parameters) in enumerate(groups):
+            self.groups.append((kernel, parameters))
+            self.term_group[selection] = num
+            self.term_row[selection] = np.arange(selection.shape[0])
+
+        # Atom to term index in compressed sparse row form
+        atoms = np.concatenate(positions)
+        terms = np.tile(np.arange(self.nterms), len(positions))
+        atom_order = np.argsort(atoms, kind="mergesort")
+        self.atom_terms = terms[atom_order]
+        self.atom_offsets = np.concatenate(([0], np.cumsum(np.bincount(atoms, minlength=natoms))))
+
+        self.term_energy = np.zeros(self.nterms)
+
+    def affected_terms(self, atoms):
+        """
+        The unique terms that contain any of the given atom positions.
+        """
+
+        slices = [self.atom_terms[self.atom_offsets[x]:self.atom_offsets[x + 1]] for x in atoms]
+        if len(slices) == 0:
+            return np.zeros(0, dtype=int)
+        return np.unique(np.concatenate(slices))
+
+    def compute(self, coords, terms=None):
+        """
+        Computes the energy of the given terms, all terms if None.
+        """
+
+        if terms is None:
+            terms = np.arange(self.nterms)
+
+        energy = np.zeros(terms.shape[0])
+        if terms.shape[0] == 0:
+            return energy
+
+        variables = expression_eval._TermVariables(self.order, coords, [x[terms] for x in self.positions], box=self.box)
+
+        term_group = self.term_group[terms]
+        for num, (kernel, parameters) in enumerate(self.groups):
+            mask = term_group == num
+            if not np.any(mask): continue
+
+            rows = self.term_row[terms[mask]]
+            local_dict = variables.select(kernel.input_names, mask)
+            local_dict.update({k: v[rows] for k, v in parameters.items()})
+            energy[mask] = kernel(local_dict)
+
+        return energy
+
+
+class IncrementalEvaluator(object):
+    """
+    Evaluates the bonded energy of a DataLayer and updates it as atoms are moved.
+
+    An atom to term index is built for every order and the energy of every term is cached, so that moving a handful of
+    atoms only recomputes the terms that contain them. The coordinates are held by the evaluator, the DataLayer is not
+    modified.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the energy expression
+    utype : {None, str}, optional
+        The energy unit of the output, otherwise the internal DataLayer energy units are used.
+
+    Examples
+    --------
+    >>> evaluator = IncrementalEvaluator(dl)
+    >>> trial = evaluator.trial([5], [[0.0, 1.0, 2.0]])
+    >>> if trial["total"] < evaluator.energy()["total"]:
+    ...     evaluator.accept()
+    """
+
+    def __init__(self, dl, utype=None):
+
+        xyz = dl.get_atoms("xyz")
+        self._atom_index = xyz.index
+        self._coords = xyz[["X", "Y", "Z"]].values.astype(np.float64)
+        self._cf = expression_eval._energy_conversion_factor(utype)
+        box, _ = neighbor_list.box_from_datalayer(dl)
+
+        self._orders = []
+        for order_key, order, positions, term_index, groups in expression_eval._build_bonded_terms(dl, xyz.index):
+            self._orders.append(_OrderTerms(order_key, order, positions, groups, self._coords.shape[0], box=box))
+
+        self._totals = {}
+        self._pending = None
+        self.refresh()
+
+    @property
+    def coordinates(self):
+        """
+        A copy of the current (N, 3) coordinates in the order of `get_atoms("xyz")`.
+        """
+        return self._coords.copy()
+
+    def refresh(self):
+        """
+        Recomputes every term from the current coordinates, removing any accumulated round off.
+        """
+
+        self._totals = {"two-body": 0.0, "three-body": 0.0, "four-body": 0.0}
+        for terms in self._orders:
+            terms.term_energy = terms.compute(self._coords)
+            self._totals[terms.order_key] = float(np.sum(terms.term_energy))
+        self._pending = None
+
+    def energy(self):
+        """
+        Returns the energy of the current coordinates.
+        """
+
+        return self._energy_dict(self._totals)
+
+    def _energy_dict(self, totals):
+        energy = {k: self._cf * v for k, v in totals.items()}
+        energy["total"] = sum(energy.values())
+        return energy
+
+    def trial(self, atom_indices, coords):
+        """
+        Computes the energy after moving atoms without changing the current state.
+
+        Parameters
+        ----------
+        atom_indices : array_like
+            The atom_index of every moved atom
+        coords : array_like
+            The (n, 3) new coordinates of the moved atoms in the internal length units
+
+        Returns
+        -------
+        energy : dict
+            The energy of each component and the total energy after the move
+        """
+
+        positions = self._atom_index.get_indexer(np.atleast_1d(atom_indices))
+        if np.any(positions < 0):
+            raise KeyError("IncrementalEvaluator: Atom indices %s not found." %
+                           str(np.atleast_1d(atom_indices)[positions < 0]))
+
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        if coords.shape[0] != positions.shape[0]:
+            raise ValueError("IncrementalEvaluator: Found %d atom indices, but %d coordinates." %
+                             (positions.shape[0], coords.shape[0]))
+
+        # Move in place and restore, copying the coordinates would be O(N)
+        saved = self._coords[positions].copy()
+        self._coords[positions] = coords
+
+        totals = dict(self._totals)
+        updates = []
+        try:
+            for terms in self._orders:
+                affected = terms.affected_terms(positions)
+                energy = terms.compute(self._coords, affected)
+                totals[terms.order_key] += float(np.sum(energy) - np.sum(terms.term_energy[affected]))
+                updates.append((terms, affected, energy))
+        finally:
+            self._coords[positions] = saved
+
+        self._pending = (positions, coords, totals, updates)
+        return self._energy_dict(totals)
+
+    def accept(self):
+        """
+        Applies the last trial move.
+        """
+
+        if self._pending is None:
+            raise ValueError("IncrementalEvaluator: No trial move to accept.")
+
+        positions, coords, totals, updates = self._pending
+        self._coords[positions] = coords
+        for terms, affected, energy in updates:
+            terms.term_energy[affected] = energy
+        self._totals = totals
+        self._pending = None
+
+    def update(self, atom_indices, coords):
+        """
+        Moves atoms and returns the new energy, see `trial`.
+        """
+
+        energy = self.trial(atom_indices, coords)
+        self.accept()
+        return energy
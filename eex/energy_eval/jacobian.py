@@ -0,0 +1,165 @@
+"""
+Analytic derivatives of the energy with respect to the stored term and nonbonded parameters
+"""
+
+import numpy as np
+import pandas as pd
+
+from . import expression_eval
+from . import form_compiler
+from . import geometry
+from . import nb_eval
+from . import neighbor_list
+from .. import metadata
+
+__all__ = ["evaluate_parameter_jacobian"]
+
+
+def _term_jacobian(dl, xyz, box):
+    """
+    Sums d(form)/d(parameter) of every bonded term onto its (order, uid) row.
+    """
+
+    # Every registered uid has a row, unused uids have zero derivatives
+    rows = []
+    columns = []
+    for order in [2, 3, 4]:
+        for uid in sorted(dl.list_term_uids(order)):
+            rows.append((order, uid))
+            form_type, _ = dl.get_term_parameter(order, uid)
+            for name in metadata.get_term_metadata(order, "forms", form_type)["parameters"]:
+                if name not in columns:
+                    columns.append(name)
+
+    row_index = {k: num for num, k in enumerate(rows)}
+    jacobian = np.full((len(rows), len(columns)), np.nan)
+    for num, (order, uid) in enumerate(rows):
+        form_type, _ = dl.get_term_parameter(order, uid)
+        for name in metadata.get_term_metadata(order, "forms", form_type)["parameters"]:
+            jacobian[num, columns.index(name)] = 0.0
+
+    coords = xyz[["X", "Y", "Z"]].values
+    for order_key, order, positions, term_index, groups in expression_eval._build_bonded_terms(dl, xyz.index):
+        variables = expression_eval._TermVariables(order, coords, positions, box=box)
+
+        uids, inverse = np.unique(term_index, return_inverse=True)
+        uid_rows = np.array([row_index[(order, int(x))] for x in uids])
+
+        for form_type, kernel, selection, parameters in groups:
+            local_dict = variables.select(kernel.input_names, selection)
+            local_dict.update(parameters)
+
+            for name in parameters:
+                dkernel = form_compiler.get_term_derivative_kernel(order, form_type, name)
+                dE = np.broadcast_to(dkernel(local_dict), selection.shape)
+                jacobian[uid_rows, columns.index(name)] += np.bincount(inverse[selection], weights=dE,
+                                                                       minlength=uids.shape[0])
+
+    index = pd.MultiIndex.from_tuples(rows, names=["order", "uid"]) if len(rows) else None
+    return pd.DataFrame(jacobian, index=index, columns=columns)
+
+
+def _pair_derivatives(type_index, dkernels, parameter_tables, ntypes, i, j, r, weights):
+    """
+    Sums the weighted parameter derivatives of each pair onto the flattened (ntypes, ntypes) upper triangle.
+    """
+
+    ti = type_index[i]
+    tj = type_index[j]
+    flat = np.minimum(ti, tj) * ntypes + np.maximum(ti, tj)
+
+    local_dict = {k: v[ti, tj] for k, v in parameter_tables.items()}
+    local_dict["r"] = r
+
+    ret = {}
+    for name, dkernel in dkernels.items():
+        dE = weights * np.broadcast_to(dkernel(local_dict), r.shape)
+        ret[name] = np.bincount(flat, weights=dE, minlength=ntypes * ntypes)
+    return ret
+
+
+def _nonbonded_jacobian(dl, xyz, tile_size):
+    """
+    Sums d(form)/d(parameter) of every van der Waals pair onto its (atom_type1, atom_type2) row.
+    """
+
+    atom_types = dl.get_atoms("atom_type").reindex(xyz.index)["atom_type"].values
+    nb_name, type_index, tables = expression_eval._build_nb_tables(dl, atom_types)
+    if nb_name is None:
+        return pd.DataFrame()
+
+    types = np.unique(atom_types)
+    ntypes = types.shape[0]
+    dkernels = {name: form_compiler.get_nb_derivative_kernel(nb_name, name) for name in tables}
+    jacobian = {name: np.zeros(ntypes * ntypes) for name in tables}
+
+    def accumulate(i, j, r, weights):
+        for k, v in _pair_derivatives(type_index, dkernels, tables, ntypes, i, j, r, weights).items():
+            jacobian[k] += v
+
+    coords = xyz[["X", "Y", "Z"]].values
+    electrostatics = dl.get_electrostatics()
+    box = None
+    cutoff = None
+    if electrostatics:
+        cutoff = electrostatics["cutoff"]
+        box, origin = neighbor_list.box_from_datalayer(dl)
+        i, j, r = neighbor_list.find_pairs(coords, cutoff, box=box, origin=origin)
+        accumulate(i, j, r, 1.0)
+    else:
+        for i, j in nb_eval.pair_tiles(coords.shape[0], tile_size=tile_size):
+            accumulate(i, j, geometry.compute_distance(coords[i], coords[j]), 1.0)
+
+    # Scaled pairs are counted at full strength above
+    pair_scalings = expression_eval._build_pair_scalings(dl, xyz.index)
+    if "vdw" in pair_scalings:
+        i, j, scale = pair_scalings["vdw"]
+        r = geometry.compute_distance(coords[i], coords[j], box=box)
+        weights = scale - 1.0
+        if cutoff is not None:
+            weights = weights * (r < cutoff)
+        accumulate(i, j, r, weights)
+
+    upper = np.triu_indices(ntypes)
+    rows = pd.MultiIndex.from_arrays([types[upper[0]], types[upper[1]]], names=["atom_type1", "atom_type2"])
+    data = {k: v.reshape(ntypes, ntypes)[upper] for k, v in jacobian.items()}
+    return pd.DataFrame(data, index=rows, columns=list(tables))
+
+
+def evaluate_parameter_jacobian(dl, utype=None, nonbonded=False, tile_size=1024):
+    """
+    Evaluates the derivatives of the energy with respect to every stored parameter.
+
+    The derivative of each functional form with respect to each of its parameters is derived symbolically once and
+    cached, see `form_compiler.get_term_derivative_kernel`. Every order is then visited a single time, each form group
+    evaluates its parameter derivatives in one vectorized call and the terms are summed onto their uid.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the energy expression
+    utype : {None, str}, optional
+        The energy unit of the output, otherwise the internal DataLayer energy units are used. Parameters are always
+        in the internal DataLayer units.
+    nonbonded : bool, optional
+        If True, also returns the derivatives of the van der Waals energy with respect to the (atom_type1, atom_type2)
+        pair parameters of the default model (eg LJ A and B). Mixed pairs are reported as their own pair parameters.
+    tile_size : int, optional
+        The number of atoms along each edge of a nonbonded pair tile, bounds the temporary memory.
+
+    Returns
+    -------
+    jacobian : dict of pd.DataFrame
+        The "terms" (order, uid) x parameter name matrix of dE/dparameter, NaN where a parameter is not part of the
+        form of the uid, and if `nonbonded` the "nonbonded" (atom_type1, atom_type2) x parameter name matrix.
+    """
+
+    xyz = dl.get_atoms("xyz")
+    box, _ = neighbor_list.box_from_datalayer(dl)
+    cf = expression_eval._energy_conversion_factor(utype)
+
+    ret = {"terms": cf * _term_jacobian(dl, xyz, box)}
+    if nonbonded:
+        ret["nonbonded"] = cf * _nonbonded_jacobian(dl, xyz, tile_size)
+
+    return ret
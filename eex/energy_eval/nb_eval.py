@@ -2,12 +2,18 @@
 Computes the electrostatics of a expression
 """
 
-import itertools
 import copy
+import itertools
 
 import numpy as np
 import numexpr as ne
 
+from . import ewald
+from . import geometry
+from . import neighbor_list
+from . import wolf
+from .. import units
+
 ### Electrostatic like terms
 
 
@@ -16,19 +22,81 @@ def _coulomb_energy(qij, R):
     return np.sum(qij / R)
 
 
-def _fast_coulomb_sum(coords, charges, shift, efunc):
+def _home_box_energy(coords, charges, tile_size):
+    """
+    Computes the Coulomb energy of every unique pair in the home box.
+    """
 
     energy = 0.0
+    for i, j in pair_tiles(coords.shape[0], tile_size=tile_size):
+        dR = geometry.compute_distance(coords[i], coords[j])
+        energy += _coulomb_energy(charges[i] * charges[j], dR)
 
-    for i in range(coords.shape[0]):
-        tmp = coords + (shift - coords[i])
-        dR = np.sqrt(np.einsum('ij,ij->i', tmp, tmp))
-        energy += efunc(charges[i] * charges, dR)
+    return energy
 
-    return 0.5 * energy
 
+def _image_energy(coords, charges, shifts, tile_size, max_elements=2**20):
+    """
+    Computes sum_n sum_ij q_i q_j / |r_j + n - r_i| for a block of image shift vectors n.
 
-def lattice_sum(coords, charges, boxlength, nboxes, func="coulomb", return_shells=False, spherical_truncation=True):
+    Atom pairs are visited in (tile_size, tile_size) tiles and shift vectors are vectorized over so that no temporary
+    holds more than roughly `max_elements` distances.
+    """
+
+    natoms = coords.shape[0]
+    shift_block = max(1, max_elements // (tile_size * tile_size))
+
+    energy = 0.0
+    for i0 in range(0, natoms, tile_size):
+        ci = coords[i0:i0 + tile_size]
+        qi = charges[i0:i0 + tile_size]
+        for j0 in range(0, natoms, tile_size):
+            diff = coords[None, j0:j0 + tile_size] - ci[:, None]
+            local_dict = {
+                "qij": (qi[:, None] * charges[None, j0:j0 + tile_size])[:, :, None],
+                "dx": diff[:, :, 0, None],
+                "dy": diff[:, :, 1, None],
+                "dz": diff[:, :, 2, None]
+            }
+
+            for s0 in range(0, shifts.shape[0], shift_block):
+                block = shifts[s0:s0 + shift_block]
+                local_dict["sx"] = block[None, None, :, 0]
+                local_dict["sy"] = block[None, None, :, 1]
+                local_dict["sz"] = block[None, None, :, 2]
+                energy += float(ne.evaluate(_image_expression, local_dict=local_dict))
+
+    return energy
+
+
+# The Coulomb energy of a tile of pairs for a block of image shifts
+_image_expression = "sum(qij / sqrt((dx + sx) ** 2 + (dy + sy) ** 2 + (dz + sz) ** 2))"
+
+
+# Coordinates shared with the workers of a lattice sum process pool
+_pool_data = {}
+
+
+def _pool_initializer(coords, charges, tile_size):
+    _pool_data["coords"] = coords
+    _pool_data["charges"] = charges
+    _pool_data["tile_size"] = tile_size
+
+
+def _pool_image_energy(shifts):
+    return _image_energy(_pool_data["coords"], _pool_data["charges"], shifts, _pool_data["tile_size"])
+
+
+def lattice_sum(coords,
+                charges,
+                boxlength,
+                nboxes,
+                func="coulomb",
+                return_shells=False,
+                spherical_truncation=True,
+                nprocs=1,
+                tile_size=128,
+                shifts_per_task=32):
     """
     Computes the direct latice sum electostatic energy.
 
@@ -48,8 +116,27 @@ def lattice_sum(coords, charges, boxlength, nboxes, func="coulomb", return_shell
         The type of operator to sum over
     return_shells : bool, optional
         Return the energy of each shell, if false just returns the total energy.
+    nprocs : int, optional
+        The number of processes to distribute the image shells over.
+    tile_size : int, optional
+        The number of atoms along each edge of a pair tile.
+    shifts_per_task : int, optional
+        The maximum number of image boxes evaluated in a single task.
+
+    Notes
+    -----
+    Image boxes are grouped by shell and split into tasks of at most `shifts_per_task` boxes, only one of each n and
+    -n image pair is evaluated. Task results are always reduced in shell order so that serial and parallel
+    evaluations give identical energies.
     """
 
+    if func != "coulomb":
+        raise KeyError("lattice_sum: Function '%s' not understood." % func)
+
+    coords = np.asarray(coords, dtype=np.float64)
+    charges = np.asarray(charges, dtype=np.float64)
+    boxlength = np.asarray(boxlength, dtype=np.float64)
+
     # Setup boxes
     halfbox = nboxes // 2
     boxlist = list(range(-halfbox, halfbox + 1))
@@ -58,24 +145,40 @@ def lattice_sum(coords, charges, boxlength, nboxes, func="coulomb", return_shell
     energy = {"home": 0.0}
     energy.update({k: 0.0 for k in range(1, int(halfbox**1.5) + 2)})
 
-    # Handle 'home' box, only use lower triangular of pairs
-    for i in range(1, coords.shape[0]):
-        tmp = coords[:i] - coords[i]
-        dR = np.sqrt(np.einsum('ij,ij->i', tmp, tmp))
-        energy["home"] += _coulomb_energy(charges[i] * charges[:i], dR)
-
-    # Image boxes
-    for nvecs in itertools.product(boxlist, boxlist, boxlist):
-        shell = int(np.linalg.norm(nvecs))
-        # Skip the home box
-        if shell == 0: continue
-
-        # We only want the sphere, not the box
-        if spherical_truncation and (shell > nboxes):
-            continue
+    # Handle 'home' box, only use unique pairs
+    energy["home"] += _home_box_energy(coords, charges, tile_size)
+
+    # Image boxes, skip the home box and only keep the sphere rather than the box if requested
+    nvecs = np.array(list(itertools.product(boxlist, boxlist, boxlist)))
+    shells = np.linalg.norm(nvecs, axis=1).astype(int)
+    mask = shells != 0
+    if spherical_truncation:
+        mask &= shells <= nboxes
+
+    # The images n and -n share a shell and an energy, so only half of each shell is evaluated
+    half = np.array([tuple(x) > (0, 0, 0) for x in nvecs])
+
+    tasks = []
+    for shell in np.unique(shells[mask]):
+        shifts = nvecs[mask & half & (shells == shell)] * boxlength
+        for start in range(0, shifts.shape[0], shifts_per_task):
+            tasks.append((int(shell), shifts[start:start + shifts_per_task]))
+
+    if nprocs > 1 and len(tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=nprocs, initializer=_pool_initializer,
+                                    initargs=(coords, charges, tile_size))
+        try:
+            results = pool.map(_pool_image_energy, [x[1] for x in tasks])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_image_energy(coords, charges, x[1], tile_size) for x in tasks]
 
-        shiftvec = np.array(nvecs) * boxlength
-        energy[shell] += _fast_coulomb_sum(coords, charges, shiftvec, _coulomb_energy)
+    # Deterministic reduction order
+    for (shell, _), value in zip(tasks, results):
+        energy[shell] += value
 
     # Sum up the energy
     energy["total"] = sum(v for k, v in energy.items())
@@ -122,3 +225,376 @@ def nonbonded_eval(coords, atom_types, form, parameters):
         energy += expr.run(*(local_params[key] for key in expr.input_names))
 
     return energy
+
+
+### Pairwise nonbonded terms
+
+# Coulomb's constant, 1 / (4 pi epsilon_0), per mole of pairs
+_coulomb_constant = "8.9875517873681764e9 * kilogram * meter ** 3 / (second ** 2 * coulomb ** 2) * 6.022140857e23 / mol"
+
+
+def coulomb_constant(utype=None):
+    """
+    Returns Coulomb's constant, 1 / (4 pi epsilon_0).
+
+    Parameters
+    ----------
+    utype : str, optional
+        The units of the constant, defaults to the internal [energy] * [length] / [charge] ** 2 units.
+    """
+
+    if utype is None:
+        utype = units.convert_contexts("[energy] * [length] / [charge] ** 2")
+
+    return units.conversion_factor(_coulomb_constant, utype)
+
+
+def pair_tiles(natoms, tile_size=1024):
+    """
+    Yields every unique (i < j) pair of a system in blocks of at most `tile_size` ** 2 pairs.
+
+    Parameters
+    ----------
+    natoms : int
+        The number of atoms in the system
+    tile_size : int, optional
+        The number of atoms along each edge of a tile
+
+    Yields
+    ------
+    i, j : np.ndarray
+        The positions of the first and second atom of each pair in the tile
+    """
+
+    for i0, j0 in tile_origins(natoms, tile_size):
+        yield pair_tile(natoms, i0, j0, tile_size)
+
+
+def tile_origins(natoms, tile_size=1024):
+    """
+    The (i0, j0) first atom positions of every tile visited by `pair_tiles`, in order.
+    """
+
+    return [(i0, j0) for i0 in range(0, natoms, tile_size) for j0 in range(i0, natoms, tile_size)]
+
+
+def pair_tile(natoms, i0, j0, tile_size=1024):
+    """
+    The unique (i < j) pairs of the tile starting at atom positions (i0, j0), see `pair_tiles`.
+    """
+
+    i1 = min(i0 + tile_size, natoms)
+    j1 = min(j0 + tile_size, natoms)
+
+    # Diagonal tiles only hold the upper triangle
+    if i0 == j0:
+        i, j = np.triu_indices(i1 - i0, 1)
+        return i + i0, j + j0
+    else:
+        i, j = np.meshgrid(np.arange(i0, i1), np.arange(j0, j1), indexing="ij")
+        return i.ravel(), j.ravel()
+
+
+def pair_energy(coords, i, j, type_index=None, kernel=None, parameter_tables=None, charges=None, coul_constant=1.0,
+                r=None):
+    """
+    Computes the van der Waals and Coulomb energy of each given pair.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of cartesian coordinates
+    i, j : np.ndarray
+        The positions of the first and second atom of each pair
+    type_index : np.ndarray, optional
+        A (N,) array of positions into the parameter tables for each atom
+    kernel : FormKernel, optional
+        The compiled nonbonded form, if None the van der Waals energy is zero.
+    parameter_tables : dict of np.ndarray, optional
+        A (ntypes, ntypes) lookup array for each parameter of the form
+    charges : np.ndarray, optional
+        A (N,) array of charges, if None the Coulomb energy is zero.
+    coul_constant : float, optional
+        Coulomb's constant in the units of the charges, distances, and energy.
+    r : np.ndarray, optional
+        The precomputed (eg minimum image) distance of each pair.
+
+    Returns
+    -------
+    vdw, coul : np.ndarray
+        The energy of each pair
+    """
+
+    if r is None:
+        dR = geometry.compute_distance(coords[i], coords[j])
+    else:
+        dR = r
+
+    if kernel is None:
+        vdw = np.zeros_like(dR)
+    else:
+        ti = type_index[i]
+        tj = type_index[j]
+        local_dict = {k: v[ti, tj] for k, v in parameter_tables.items()}
+        local_dict["r"] = dR
+        vdw = kernel(local_dict)
+
+    if charges is None:
+        coul = np.zeros_like(dR)
+    else:
+        coul = coul_constant * charges[i] * charges[j] / dR
+
+    return vdw, coul
+
+
+def nonbonded_energy(coords,
+                     type_index=None,
+                     kernel=None,
+                     parameter_tables=None,
+                     charges=None,
+                     coul_constant=1.0,
+                     pair_scalings=None,
+                     tile_size=1024):
+    """
+    Computes the pairwise van der Waals and Coulomb energy of an isolated system.
+
+    Every unique pair is visited in tiles of at most `tile_size` ** 2 pairs so that no (N, N) temporary is built.
+    Scaled pairs are first included at full strength and then corrected by `(scale - 1)` times their energy.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of cartesian coordinates
+    type_index : np.ndarray, optional
+        A (N,) array of positions into the parameter tables for each atom
+    kernel : FormKernel, optional
+        The compiled nonbonded form, if None the van der Waals energy is zero.
+    parameter_tables : dict of np.ndarray, optional
+        A (ntypes, ntypes) lookup array for each parameter of the form
+    charges : np.ndarray, optional
+        A (N,) array of charges, if None the Coulomb energy is zero.
+    coul_constant : float, optional
+        Coulomb's constant in the units of the charges, distances, and energy.
+    pair_scalings : dict, optional
+        A {"vdw": (i, j, scale), "coul": (i, j, scale)} dictionary of unique scaled pairs.
+    tile_size : int, optional
+        The number of atoms along each edge of a tile.
+
+    Returns
+    -------
+    energy : dict
+        The {"vdw": float, "coul": float} energy of the system
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    energy = {"vdw": 0.0, "coul": 0.0}
+
+    if (kernel is None) and (charges is None):
+        return energy
+
+    for i, j in pair_tiles(coords.shape[0], tile_size=tile_size):
+        vdw, coul = pair_energy(coords, i, j, type_index, kernel, parameter_tables, charges, coul_constant)
+        energy["vdw"] += np.sum(vdw)
+        energy["coul"] += np.sum(coul)
+
+    for k, v in scaled_pair_correction(coords, pair_scalings, type_index, kernel, parameter_tables, charges,
+                                       coul_constant).items():
+        energy[k] += v
+
+    return energy
+
+
+def scaled_pair_correction(coords,
+                           pair_scalings,
+                           type_index=None,
+                           kernel=None,
+                           parameter_tables=None,
+                           charges=None,
+                           coul_constant=1.0):
+    """
+    Computes `(scale - 1)` times the energy of the scaled pairs of an isolated system, see `nonbonded_energy`.
+
+    Returns
+    -------
+    energy : dict
+        The {"vdw": float, "coul": float} correction
+    """
+
+    energy = {"vdw": 0.0, "coul": 0.0}
+    if pair_scalings is None:
+        return energy
+
+    for label, (i, j, scale) in pair_scalings.items():
+        if i.shape[0] == 0: continue
+
+        vdw, coul = pair_energy(coords, i, j, type_index, kernel, parameter_tables, charges, coul_constant)
+        pair_data = {"vdw": vdw, "coul": coul}
+        energy[label] += np.sum((scale - 1.0) * pair_data[label])
+
+    return energy
+
+
+# Electrostatic methods evaluated with an Ewald split
+_ewald_methods = ["ewald", "pme", "pppm"]
+
+# Every electrostatics method the cutoff evaluator understands
+_electrostatics_methods = ["cut"] + _ewald_methods + wolf._damped_methods
+
+
+def _ewald_parameters(method, parameters, H, cutoff):
+    """
+    Translates the `_electrostatics` metadata parameters of an Ewald method into reciprocal space settings.
+    """
+
+    accuracy = parameters.get("accuracy", None)
+
+    if method == "ewald":
+        alpha = parameters.get("alpha", None)
+    else:
+        alpha = parameters.get("g_ewald", None)
+    if alpha is None:
+        alpha = ewald.default_alpha(cutoff, accuracy)
+
+    if method == "ewald":
+        kmax = parameters.get("kmax", None)
+        if "kmaxx" in parameters:
+            kmax = [parameters["kmax" + x] for x in "xyz"]
+        return alpha, {"kmax": kmax, "accuracy": accuracy}
+    else:
+        grid_size = parameters.get("grid_size", None)
+        if "grid_size_x" in parameters:
+            grid_size = [parameters["grid_size_" + x] for x in "xyz"]
+        if grid_size is not None:
+            grid_size = np.broadcast_to(np.array(grid_size, dtype=int), (3, ))
+        order = int(parameters.get("order", 5))
+        return alpha, {"grid_size": grid_size, "order": order, "accuracy": accuracy}
+
+
+def cutoff_nonbonded_energy(coords,
+                            cutoff,
+                            box=None,
+                            origin=None,
+                            type_index=None,
+                            kernel=None,
+                            parameter_tables=None,
+                            charges=None,
+                            coul_constant=1.0,
+                            pair_scalings=None,
+                            method="cut",
+                            parameters=None):
+    """
+    Computes the pairwise van der Waals and Coulomb energy within a cutoff using a cell list.
+
+    For the Ewald methods ("ewald", "pme", "pppm") the real-space Coulomb sum is damped by erfc(alpha * r) and the
+    reciprocal space, self, and exclusion energies are returned as "coul_long". Scaled pairs are removed from the
+    reciprocal space sum with an erf(alpha * r) / r correction regardless of their distance.
+
+    The Wolf and damped shifted force methods ("wolf", "dsf") are evaluated entirely within the cutoff, their self
+    energy is included in "coul". Scaled pairs inside of the cutoff remove (1 - scale) of their bare Coulomb energy.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of cartesian coordinates
+    cutoff : float
+        The pair distance cutoff
+    box : np.ndarray, optional
+        The (3, 3) matrix whose rows are the lattice vectors, if None the system is not periodic.
+    origin : np.ndarray, optional
+        The lower corner of the periodic box
+    type_index : np.ndarray, optional
+        A (N,) array of positions into the parameter tables for each atom
+    kernel : FormKernel, optional
+        The compiled nonbonded form, if None the van der Waals energy is zero.
+    parameter_tables : dict of np.ndarray, optional
+        A (ntypes, ntypes) lookup array for each parameter of the form
+    charges : np.ndarray, optional
+        A (N,) array of charges, if None the Coulomb energy is zero.
+    coul_constant : float, optional
+        Coulomb's constant in the units of the charges, distances, and energy.
+    pair_scalings : dict, optional
+        A {"vdw": (i, j, scale), "coul": (i, j, scale)} dictionary of unique scaled pairs.
+    method : str, optional
+        The electrostatics method, one of "cut", "ewald", "pme", "pppm", "wolf", or "dsf".
+    parameters : dict, optional
+        The parameters of the electrostatics method as described by the `_electrostatics` metadata. The splitting
+        or damping parameter, k-vectors, and grid size are derived from the cutoff and accuracy when not given.
+
+    Returns
+    -------
+    energy : dict
+        The {"vdw": float, "coul": float, "coul_long": float} energy of the system
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    energy = {"vdw": 0.0, "coul": 0.0, "coul_long": 0.0}
+
+    if method not in _electrostatics_methods:
+        raise KeyError("cutoff_nonbonded_energy: Electrostatics method '%s' not understood." % method)
+
+    if parameters is None:
+        parameters = {}
+
+    if pair_scalings is None:
+        pair_scalings = {}
+
+    use_ewald = (method in _ewald_methods) and (charges is not None)
+    if use_ewald:
+        if box is None:
+            raise ValueError("cutoff_nonbonded_energy: The '%s' method requires a periodic box." % method)
+        alpha, reciprocal_settings = _ewald_parameters(method, parameters, box, cutoff)
+
+    use_damped = (method in wolf._damped_methods) and (charges is not None)
+    if use_damped:
+        alpha = parameters.get("alpha", None)
+        if alpha is None:
+            alpha = ewald.default_alpha(cutoff, parameters.get("accuracy", None))
+        damping_func = wolf.wolf_damping if method == "wolf" else wolf.dsf_damping
+
+    # Real space pairs
+    i, j, r = neighbor_list.find_pairs(coords, cutoff, box=box, origin=origin)
+    vdw, coul = pair_energy(coords, i, j, type_index, kernel, parameter_tables, charges, coul_constant, r=r)
+    if use_ewald:
+        coul *= ewald.erfc(alpha * r)
+    elif use_damped:
+        coul *= damping_func(r, alpha, cutoff)
+
+    energy["vdw"] += np.sum(vdw)
+    energy["coul"] += np.sum(coul)
+
+    # Correct the scaled pairs, both the real and reciprocal space hold them at full strength
+    for label, (i, j, scale) in pair_scalings.items():
+        if i.shape[0] == 0: continue
+
+        dR = coords[j] - coords[i]
+        if box is not None:
+            dR = geometry.minimum_image(dR, box)
+        r = np.sqrt(np.einsum("ij,ij->i", dR, dR))
+        inside = r < cutoff
+
+        vdw, coul = pair_energy(coords, i, j, type_index, kernel, parameter_tables, charges, coul_constant, r=r)
+        if label == "vdw":
+            energy["vdw"] += np.sum((scale - 1.0) * vdw * inside)
+        elif use_ewald:
+            damping = ewald.erfc(alpha * r)
+            energy["coul"] += np.sum((scale - 1.0) * coul * damping * inside)
+            energy["coul_long"] += np.sum((scale - 1.0) * coul * (1.0 - damping))
+        else:
+            # Cut, Wolf, and DSF pairs all remove the bare Coulomb energy
+            energy["coul"] += np.sum((scale - 1.0) * coul * inside)
+
+    # Reciprocal space and self energy
+    if use_ewald:
+        if method == "ewald":
+            energy["coul_long"] += ewald.ewald_reciprocal_energy(
+                coords, charges, box, alpha, coul_constant=coul_constant, **reciprocal_settings)
+        else:
+            energy["coul_long"] += ewald.pme_reciprocal_energy(
+                coords, charges, box, alpha, coul_constant=coul_constant, **reciprocal_settings)
+
+        energy["coul_long"] += ewald.ewald_self_energy(charges, alpha, np.abs(np.linalg.det(box)), coul_constant)
+
+    if use_damped:
+        energy["coul"] += wolf.damped_self_energy(charges, alpha, cutoff, coul_constant)
+
+    return energy
@@ -0,0 +1,387 @@
+"""
+Cell list and Verlet neighbor list searches for pairwise nonbonded terms
+"""
+
+import itertools
+
+import numpy as np
+
+from . import geometry
+
+__all__ = ["find_pairs", "box_from_datalayer", "NeighborList"]
+
+
+def _half_stencil(reach):
+    """
+    The neighboring cell offsets that visit every pair of distinct neighboring cells exactly once.
+    """
+    return [x for x in itertools.product(range(-reach, reach + 1), repeat=3) if x > (0, 0, 0)]
+
+
+def _full_stencil(ncells, reach):
+    """
+    Every unique neighboring cell offset when some periodic dimensions are too small for the half stencil.
+    """
+    offsets = []
+    for n in ncells:
+        offsets.append(sorted(set(x % n for x in range(-reach, reach + 1))))
+    return list(itertools.product(*offsets))
+
+
+def _box_data(box, origin):
+    """
+    Canonicalizes a box and origin to a (3, 3) lattice matrix and (3,) origin.
+    """
+
+    if isinstance(box, dict):
+        box = geometry.box_matrix(box)
+
+    H = np.array(box, dtype=np.float64)
+    if H.shape == (3, ):
+        H = np.diag(H)
+    elif H.shape != (3, 3):
+        raise ValueError("find_pairs: Box shape %s not understood, expected a (3, ) or (3, 3) array." % str(H.shape))
+
+    if origin is None:
+        origin = np.zeros(3)
+
+    return H, np.array(origin, dtype=np.float64)
+
+
+def _perpendicular_widths(H):
+    """
+    The distances between opposite faces of the box.
+    """
+
+    volume = abs(np.linalg.det(H))
+    areas = [np.linalg.norm(np.cross(H[1], H[2])), np.linalg.norm(np.cross(H[2], H[0])), np.linalg.norm(np.cross(H[0], H[1]))]
+    return volume / np.array(areas)
+
+
+def _cap_cells(ncells, natoms):
+    """
+    Limits the total number of cells to the number of atoms so that sparse systems do not build huge empty grids.
+    """
+
+    total = np.prod(ncells)
+    if total > max(natoms, 1):
+        scale = (float(total) / max(natoms, 1))**(1.0 / 3.0)
+        ncells = np.maximum(1, np.floor(ncells / scale)).astype(int)
+    return ncells
+
+
+def find_pairs(coords, cutoff, box=None, origin=None, max_candidates=2**22, cell_subdivisions=2):
+    """
+    Finds every unique (i < j) pair of atoms within a cutoff using a cell list.
+
+    Atoms are binned into cells at least `cutoff / cell_subdivisions` wide so that only cells within
+    `cell_subdivisions` of each other need to be searched, the cost scales linearly with the number of atoms. Smaller
+    cells visit fewer candidate pairs that lie outside of the cutoff.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A (N, 3) array of cartesian coordinates
+    cutoff : float
+        The pair distance cutoff
+    box : {None, dict, np.ndarray}, optional
+        The periodic box as either the lattice constants from `DataLayer.get_box_size`, the (3, ) lengths of an
+        orthorhombic box, or a (3, 3) matrix of lattice vectors. If None, the system is not periodic.
+    origin : np.ndarray, optional
+        The lower corner of the periodic box, defaults to the origin.
+    max_candidates : int, optional
+        The maximum number of candidate pairs held in memory at once.
+    cell_subdivisions : int, optional
+        The number of cells per cutoff length.
+
+    Returns
+    -------
+    i, j : np.ndarray
+        The positions of the first and second atom of each pair, in cell order
+    r : np.ndarray
+        The (minimum image) distance of each pair
+
+    Notes
+    -----
+    For periodic boxes the cutoff must be less than half of the smallest distance between opposite box faces so that
+    each pair has a single image within the cutoff. Triclinic boxes are assumed to use LAMMPS-like tilt factors of at
+    most half of the box length.
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    natoms = coords.shape[0]
+    cutoff = float(cutoff)
+
+    if cutoff <= 0.0:
+        raise ValueError("find_pairs: The cutoff must be positive, found %s." % cutoff)
+
+    periodic = box is not None
+    reach = int(cell_subdivisions)
+    if reach < 1:
+        raise ValueError("find_pairs: The number of cell subdivisions must be at least one, found %s." % reach)
+    cell_width = cutoff / reach
+
+    # Bin the atoms into cells
+    if periodic:
+        H, origin = _box_data(box, origin)
+        H_inv = np.linalg.inv(H)
+
+        widths = _perpendicular_widths(H)
+        if cutoff > 0.5 * widths.min():
+            raise ValueError("find_pairs: The cutoff (%s) must be less than half of the smallest box width (%s)." %
+                             (cutoff, widths.min()))
+
+        ncells = _cap_cells(np.maximum(1, np.floor(widths / cell_width)).astype(int), natoms)
+        frac = np.dot(coords - origin, H_inv)
+        frac -= np.floor(frac)
+        cell_xyz = np.floor(frac * ncells).astype(int)
+    else:
+        H = None
+        if natoms:
+            lower = coords.min(axis=0)
+            extent = coords.max(axis=0) - lower
+        else:
+            lower = extent = np.zeros(3)
+
+        ncells = _cap_cells(np.maximum(1, np.floor(extent / cell_width)).astype(int), natoms)
+        width = np.maximum(extent / ncells, cell_width)
+        cell_xyz = np.floor((coords - lower) / width).astype(int)
+
+    cell_xyz = np.minimum(np.maximum(cell_xyz, 0), ncells - 1)
+    cell_id = np.ravel_multi_index(cell_xyz.T, ncells)
+
+    # Work in cell order so that the candidates of a cell are contiguous in memory
+    order = np.argsort(cell_id, kind="mergesort")
+    counts = np.bincount(cell_id, minlength=np.prod(ncells))
+    starts = np.cumsum(counts) - counts
+    cell_xyz = cell_xyz[order]
+    sorted_coords = coords[order]
+
+    # The self cell and the half stencil visit every pair once, small periodic grids need every unique neighbor
+    if periodic and np.any(ncells < 2 * reach + 1):
+        stencil = _full_stencil(ncells, reach)
+        lower_only = [True] * len(stencil)
+    else:
+        stencil = [(0, 0, 0)] + _half_stencil(reach)
+        lower_only = [True] + [False] * (len(stencil) - 1)
+
+    cutoff2 = cutoff * cutoff
+    atoms = np.arange(natoms)
+    found_i, found_j, found_r = [], [], []
+    for offset, filter_lower in zip(stencil, lower_only):
+
+        # Find the neighboring cell of every atom
+        neighbor_xyz = cell_xyz + np.array(offset)
+        if periodic:
+            neighbor_xyz %= ncells
+            valid = atoms
+        else:
+            mask = np.all((neighbor_xyz >= 0) & (neighbor_xyz < ncells), axis=1)
+            valid = atoms[mask]
+            neighbor_xyz = neighbor_xyz[mask]
+
+        if valid.shape[0] == 0: continue
+
+        neighbor_cell = np.ravel_multi_index(neighbor_xyz.T, ncells)
+        ncandidates = counts[neighbor_cell]
+
+        # Expand the candidates in memory bounded chunks of atoms
+        cumulative = np.cumsum(ncandidates)
+        splits = np.searchsorted(cumulative, np.arange(max_candidates, cumulative[-1], max_candidates))
+        for chunk in np.split(np.arange(valid.shape[0]), np.unique(splits)):
+            if chunk.shape[0] == 0: continue
+
+            chunk_counts = ncandidates[chunk]
+            total = chunk_counts.sum()
+            if total == 0: continue
+
+            i = np.repeat(valid[chunk], chunk_counts)
+            within = np.arange(total) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            j = np.repeat(starts[neighbor_cell[chunk]], chunk_counts) + within
+
+            if filter_lower:
+                keep = i < j
+                i, j = i[keep], j[keep]
+
+            dR = sorted_coords[j] - sorted_coords[i]
+            if periodic:
+                dR = geometry.minimum_image(dR, H)
+            r2 = np.einsum("ij,ij->i", dR, dR)
+
+            keep = r2 < cutoff2
+            found_i.append(i[keep])
+            found_j.append(j[keep])
+            found_r.append(np.sqrt(r2[keep]))
+
+    if len(found_i) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+
+    # Map back to the original positions and store as (i < j)
+    i = order[np.concatenate(found_i)]
+    j = order[np.concatenate(found_j)]
+    r = np.concatenate(found_r)
+    return np.minimum(i, j), np.maximum(i, j), r
+
+
+def box_from_datalayer(dl):
+    """
+    Obtains the lattice vectors and lower corner of the periodic box stored in a DataLayer.
+
+    Returns
+    -------
+    H : {None, np.ndarray}
+        The (3, 3) matrix whose rows are the lattice vectors, None if no box size is set.
+    origin : {None, np.ndarray}
+        The lower corner of the box, None if no box center is set.
+    """
+
+    box_size = dl.get_box_size()
+    if not box_size:
+        return None, None
+
+    H = geometry.box_matrix(box_size)
+    origin = None
+    box_center = dl.get_box_center()
+    if box_center:
+        center = np.array([box_center["x"], box_center["y"], box_center["z"]], dtype=np.float64)
+        origin = center - 0.5 * H.sum(axis=0)
+
+    return H, origin
+
+
+class NeighborList(object):
+    """
+    A Verlet neighbor list built on top of a cell list search.
+
+    Pairs within `cutoff + skin` are stored and reused for new coordinates until an atom has moved more than half of
+    the skin, at which point the list is rebuilt.
+
+    Parameters
+    ----------
+    cutoff : float
+        The pair distance cutoff
+    skin : float, optional
+        The Verlet skin distance, see the "verlet" entry of the `_neighbor` metadata.
+    box : {None, dict, np.ndarray}, optional
+        The periodic box, see `find_pairs`. If None, the system is not periodic.
+    origin : np.ndarray, optional
+        The lower corner of the periodic box, defaults to the origin.
+    """
+
+    def __init__(self, cutoff, skin=0.0, box=None, origin=None):
+
+        if skin < 0.0:
+            raise ValueError("NeighborList: The skin must be non-negative, found %s." % skin)
+
+        self.cutoff = float(cutoff)
+        self.skin = float(skin)
+
+        self.box = None
+        self.origin = None
+        if box is not None:
+            self.box, self.origin = _box_data(box, origin)
+
+        self.nbuilds = 0
+        self._reference = None
+        self._i = None
+        self._j = None
+
+    @classmethod
+    def from_datalayer(cls, dl, cutoff, skin=0.0):
+        """
+        Builds a NeighborList for the box stored in a DataLayer.
+
+        Parameters
+        ----------
+        dl : DataLayer
+            The DataLayer holding the box, if no box size is set the system is not periodic.
+        cutoff : float
+            The pair distance cutoff
+        skin : float, optional
+            The Verlet skin distance in internal length units. The DataLayer stores no neighbor settings, the
+            `_neighbor` metadata only describes the units of the "verlet" skin, so the skin is never read from `dl`
+            and must be given here.
+        """
+
+        H, origin = box_from_datalayer(dl)
+        return cls(cutoff, skin=skin, box=H, origin=origin)
+
+    def _displacements(self, coords):
+        dR = coords - self._reference
+        if self.box is not None:
+            dR = geometry.minimum_image(dR, self.box)
+        return dR
+
+    def build(self, coords):
+        """
+        Builds the list of pairs within the cutoff plus skin.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            A (N, 3) array of cartesian coordinates
+        """
+
+        coords = np.asarray(coords, dtype=np.float64)
+        self._i, self._j, _ = find_pairs(coords, self.cutoff + self.skin, box=self.box, origin=self.origin)
+        self._reference = coords.copy()
+        self.nbuilds += 1
+
+    def needs_rebuild(self, coords):
+        """
+        Checks if any atom has moved more than half of the skin since the last build.
+        """
+
+        if self._reference is None:
+            return True
+
+        coords = np.asarray(coords, dtype=np.float64)
+        if coords.shape != self._reference.shape:
+            return True
+
+        dR = self._displacements(coords)
+        max_displacement = np.sqrt(np.max(np.einsum("ij,ij->i", dR, dR))) if coords.shape[0] else 0.0
+        return max_displacement > 0.5 * self.skin
+
+    def update(self, coords):
+        """
+        Rebuilds the list if required.
+
+        Returns
+        -------
+        rebuilt : bool
+            True if the list was rebuilt
+        """
+
+        if self.needs_rebuild(coords):
+            self.build(coords)
+            return True
+        return False
+
+    def get_pairs(self, coords):
+        """
+        Obtains every unique (i < j) pair within the cutoff for the given coordinates.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            A (N, 3) array of cartesian coordinates
+
+        Returns
+        -------
+        i, j : np.ndarray
+            The positions of the first and second atom of each pair, in cell order
+        r : np.ndarray
+            The (minimum image) distance of each pair
+        """
+
+        coords = np.asarray(coords, dtype=np.float64)
+        self.update(coords)
+
+        dR = coords[self._j] - coords[self._i]
+        if self.box is not None:
+            dR = geometry.minimum_image(dR, self.box)
+        r = np.sqrt(np.einsum("ij,ij->i", dR, dR))
+
+        keep = r < self.cutoff
+        return self._i[keep], self._j[keep], r[keep]
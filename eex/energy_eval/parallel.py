@@ -0,0 +1,175 @@
+"""
+Process-pool parallel evaluation of the energy expression
+"""
+
+import numpy as np
+
+from . import expression_eval
+from . import form_compiler
+from . import nb_eval
+from . import neighbor_list
+
+__all__ = ["evaluate_energy_parallel"]
+
+# The coordinates and term tables shared with the workers of a process pool
+_pool_data = {}
+
+
+def _pool_initializer(data):
+    _pool_data.clear()
+    _pool_data.update(data)
+
+
+def _bonded_task(data, num, start, stop):
+    """
+    The energy of the terms [start, stop) of a single order.
+    """
+
+    order_key, order, positions, groups = data["bonded_terms"][num]
+    variables = expression_eval._TermVariables(order, data["coords"], [x[start:stop] for x in positions],
+                                               box=data["box"])
+
+    energy = 0.0
+    for form_type, selection, parameters in groups:
+
+        # Selections are sorted, so the terms of the chunk are a contiguous slice
+        lower, upper = np.searchsorted(selection, [start, stop])
+        if lower == upper: continue
+
+        kernel = form_compiler.get_term_kernel(order, form_type)
+        local_dict = variables.select(kernel.input_names, selection[lower:upper] - start)
+        local_dict.update({k: v[lower:upper] for k, v in parameters.items()})
+        energy += np.sum(kernel(local_dict))
+
+    return {order_key: energy}
+
+
+def _tile_task(data, i0, j0):
+    """
+    The van der Waals and Coulomb energy of a single pair tile of an isolated system.
+    """
+
+    nb_data = data["nb_data"]
+    coords = data["coords"]
+
+    kernel = None
+    if nb_data["nb_name"] is not None:
+        kernel = form_compiler.get_nb_kernel(nb_data["nb_name"])
+
+    i, j = nb_eval.pair_tile(coords.shape[0], i0, j0, data["tile_size"])
+    vdw, coul = nb_eval.pair_energy(coords, i, j, nb_data["type_index"], kernel, nb_data["parameter_tables"],
+                                    nb_data["charges"], nb_data["coul_constant"])
+
+    return {"vdw": np.sum(vdw), "coul": np.sum(coul)}
+
+
+_task_functions = {"bonded": _bonded_task, "tile": _tile_task}
+
+
+def _run_task(data, task):
+    return _task_functions[task[0]](data, *task[1:])
+
+
+def _pool_task(task):
+    return _run_task(_pool_data, task)
+
+
+def evaluate_energy_parallel(dl, utype=None, nonbonded=False, nprocs=1, chunk_size=2**16, tile_size=1024):
+    """
+    Evaluates the energy expression stored in a DataLayer with a pool of worker processes.
+
+    The bonded terms of every order are split into chunks of `chunk_size` terms and the pairs of an isolated system
+    into tiles, each chunk or tile is a task. The coordinates, term positions, and parameters are handed to every
+    worker once through the pool initializer, with the fork start method they are shared copy-on-write and never
+    pickled, a task only carries its kind and bounds. Tasks are independent of `nprocs` and their partial sums are
+    reduced in task order, so the result is identical for any number of workers.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer to evaluate
+    utype : {None, str}, optional
+        The energy unit of the output, otherwise the internal DataLayer energy units are used.
+    nonbonded : bool, optional
+        If True, adds the "vdw" and "coul" nonbonded energies and "coul_long" for Ewald methods. Pairs within an
+        electrostatics cutoff are found with a single cell list search and are evaluated in the calling process.
+    nprocs : int, optional
+        The number of worker processes, the tasks are evaluated in the calling process if one.
+    chunk_size : int, optional
+        The number of bonded terms in a single task.
+    tile_size : int, optional
+        The number of atoms along each edge of a nonbonded pair tile.
+
+    Returns
+    -------
+    energy : dict
+        The energy of each component and the total energy, see `evaluate_energy_expression`.
+    """
+
+    if chunk_size < 1:
+        raise ValueError("evaluate_energy_parallel: The chunk size must be positive, found %d." % chunk_size)
+
+    xyz = dl.get_atoms("xyz")
+    coords = np.ascontiguousarray(xyz[["X", "Y", "Z"]].values, dtype=np.float64)
+    box, _ = neighbor_list.box_from_datalayer(dl)
+
+    # Compiled kernels do not cross process boundaries, workers look them up by form name
+    bonded_terms = []
+    tasks = []
+    for order_key, order, positions, term_index, groups in expression_eval._build_bonded_terms(dl, xyz.index):
+        num = len(bonded_terms)
+        bonded_terms.append((order_key, order, positions, [(x[0], x[2], x[3]) for x in groups]))
+
+        for start in range(0, term_index.shape[0], chunk_size):
+            tasks.append(("bonded", num, start, min(start + chunk_size, term_index.shape[0])))
+
+    data = {"coords": coords, "box": box, "bonded_terms": bonded_terms, "tile_size": tile_size}
+
+    nb_data = None
+    serial_nonbonded = False
+    if nonbonded:
+        nb_data = expression_eval._build_nonbonded_data(dl, xyz)
+        if "cutoff" in nb_data:
+            serial_nonbonded = True
+        elif (nb_data["kernel"] is not None) or (nb_data["charges"] is not None):
+            nb_names = list(dl.list_stored_nb_types())
+            worker_nb_data = {k: v for k, v in nb_data.items() if k != "kernel"}
+            worker_nb_data["nb_name"] = nb_names[0] if (nb_data["kernel"] is not None) else None
+            data["nb_data"] = worker_nb_data
+
+            tasks.extend(("tile", i0, j0) for i0, j0 in nb_eval.tile_origins(coords.shape[0], tile_size))
+
+    if (nprocs > 1) and (len(tasks) > 1):
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=nprocs, initializer=_pool_initializer, initargs=(data, ))
+        try:
+            results = pool.map(_pool_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_run_task(data, task) for task in tasks]
+
+    # Deterministic reduction order
+    energy = {"two-body": 0.0, "three-body": 0.0, "four-body": 0.0}
+    if nonbonded:
+        energy.update({"vdw": 0.0, "coul": 0.0})
+    for result in results:
+        for k, v in result.items():
+            energy[k] += v
+
+    if serial_nonbonded:
+        for k, v in expression_eval._nonbonded_energy(coords, nb_data, tile_size).items():
+            energy[k] = energy.get(k, 0.0) + v
+    elif "nb_data" in data:
+        correction = nb_eval.scaled_pair_correction(coords, nb_data["pair_scalings"], nb_data["type_index"],
+                                                    nb_data["kernel"], nb_data["parameter_tables"],
+                                                    nb_data["charges"], nb_data["coul_constant"])
+        for k, v in correction.items():
+            energy[k] += v
+
+    cf = expression_eval._energy_conversion_factor(utype)
+    energy = {k: cf * v for k, v in energy.items()}
+    energy["total"] = sum(energy.values())
+
+    return energy
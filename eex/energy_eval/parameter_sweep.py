@@ -0,0 +1,141 @@
+"""
+Evaluation of the bonded energy for many candidate term parameter sets at fixed coordinates
+"""
+
+import numpy as np
+
+from . import expression_eval
+from . import neighbor_list
+from .. import metadata
+
+__all__ = ["evaluate_parameter_sweep"]
+
+
+def _candidate_table(dl, order, uid, values):
+    """
+    Canonicalizes the candidates of a single uid to a (ncandidates, nparameters) array in the form parameter order.
+    """
+
+    form_type, _ = dl.get_term_parameter(order, uid)
+    names = metadata.get_term_metadata(order, "forms", form_type)["parameters"]
+
+    if isinstance(values, dict):
+        missing = set(names) - set(values)
+        if len(missing):
+            raise KeyError("evaluate_parameter_sweep: Candidates of term (%d, %d) are missing parameters %s." %
+                           (order, uid, str(sorted(missing))))
+        values = np.column_stack([np.atleast_1d(np.asarray(values[x], dtype=np.float64)) for x in names])
+    else:
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+
+    if (values.ndim != 2) or (values.shape[1] != len(names)):
+        raise ValueError("evaluate_parameter_sweep: Candidates of term (%d, %d) must have shape (ncandidates, %d), "
+                         "found %s." % (order, uid, len(names), str(values.shape)))
+
+    return names, values
+
+
+def evaluate_parameter_sweep(dl, candidates, utype=None, max_elements=2**22):
+    """
+    Evaluates the bonded energy of a DataLayer for many candidate term parameter sets.
+
+    The topology, coordinates, and geometric variables are built once. Terms whose uid is not swept are evaluated a
+    single time and shared by every candidate, terms of a swept uid broadcast their variables against the candidate
+    axis so each functional form is evaluated in one vectorized call per chunk of candidates.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer holding the energy expression
+    candidates : dict
+        A {(order, uid): values} dictionary where values is either a (ncandidates, nparameters) array with columns in
+        the parameter order of the stored functional form, or a dictionary of (ncandidates, ) arrays keyed by parameter
+        name. Every entry must have the same number of candidates, values are in the internal DataLayer units.
+    utype : {None, str}, optional
+        The energy unit of the output, otherwise the internal DataLayer energy units are used.
+    max_elements : int, optional
+        The approximate number of (candidate, term) values evaluated at once.
+
+    Returns
+    -------
+    energy : dict of np.ndarray
+        The (ncandidates, ) energy of each bonded component and the total energy
+
+    Examples
+    --------
+    >>> K = np.linspace(100.0, 500.0, 50)
+    >>> energy = evaluate_parameter_sweep(dl, {(2, 1): {"K": K, "R0": np.full(50, 1.5)}})
+    """
+
+    # Canonicalize the candidates
+    swept = {2: {}, 3: {}, 4: {}}
+    ncandidates = None
+    for key, values in candidates.items():
+        order, uid = key
+        order = metadata.sanitize_term_order_name(order)
+        names, table = _candidate_table(dl, order, uid, values)
+
+        if ncandidates is None:
+            ncandidates = table.shape[0]
+        elif ncandidates != table.shape[0]:
+            raise ValueError("evaluate_parameter_sweep: Every uid must have the same number of candidates, found %d "
+                             "and %d." % (ncandidates, table.shape[0]))
+
+        swept[order][uid] = {name: table[:, num] for num, name in enumerate(names)}
+
+    if ncandidates is None:
+        raise ValueError("evaluate_parameter_sweep: No candidates were given.")
+
+    xyz = dl.get_atoms("xyz")
+    coords = xyz[["X", "Y", "Z"]].values
+    box, _ = neighbor_list.box_from_datalayer(dl)
+
+    energy = {"two-body": np.zeros(ncandidates), "three-body": np.zeros(ncandidates),
+              "four-body": np.zeros(ncandidates)}
+
+    for order_key, order, positions, term_index, groups in expression_eval._build_bonded_terms(dl, xyz.index):
+
+        # Variables are computed once and shared by every candidate
+        variables = expression_eval._TermVariables(order, coords, positions, box=box)
+
+        for form_type, kernel, selection, parameters in groups:
+            uids = term_index[selection]
+            is_swept = np.isin(uids, list(swept[order]))
+
+            # Terms that keep their stored parameters
+            fixed = selection[~is_swept]
+            if fixed.shape[0]:
+                local_dict = variables.select(kernel.input_names, fixed)
+                local_dict.update({k: v[~is_swept] for k, v in parameters.items()})
+                energy[order_key] += np.sum(kernel(local_dict))
+
+            if not np.any(is_swept): continue
+
+            # Swept terms gather a (ncandidates, nterms) table of every parameter
+            rows = np.flatnonzero(is_swept)
+            swept_uids = uids[rows]
+            candidate_columns = {uid: np.flatnonzero(swept_uids == uid) for uid in np.unique(swept_uids)}
+
+            local_dict = variables.select(kernel.input_names, selection[rows])
+            chunk_size = max(1, max_elements // rows.shape[0])
+            for start in range(0, ncandidates, chunk_size):
+                stop = min(start + chunk_size, ncandidates)
+
+                for name in parameters:
+                    table = np.empty((stop - start, rows.shape[0]))
+                    for uid, columns in candidate_columns.items():
+                        table[:, columns] = swept[order][uid][name][start:stop, None]
+                    local_dict[name] = table
+
+                group_energy = np.broadcast_to(kernel(local_dict), (stop - start, rows.shape[0]))
+                energy[order_key][start:stop] += np.sum(group_energy, axis=1)
+
+    cf = expression_eval._energy_conversion_factor(utype)
+    for k, v in energy.items():
+        energy[k] = cf * v
+
+    energy["total"] = sum(v for k, v in energy.items())
+
+    return energy
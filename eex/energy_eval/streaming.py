@@ -0,0 +1,97 @@
+"""
+Out-of-core evaluation of the energy expression, streaming the term tables from the DataLayer store
+"""
+
+import numpy as np
+
+from . import expression_eval
+from . import form_compiler
+from . import neighbor_list
+
+__all__ = ["evaluate_energy_streaming"]
+
+
+def _chunk_coordinates(dl, atom_index, terms, order):
+    """
+    Reads the coordinates of the atoms referenced by a chunk of terms.
+
+    Returns
+    -------
+    coords : np.ndarray
+        The (natoms_chunk, 3) coordinates of the referenced atoms in stored row order
+    positions : list of np.ndarray
+        The row positions into `coords` for each atom column of the terms
+    """
+
+    positions = expression_eval._atom_positions(atom_index, terms, order)
+
+    # Sorted unique rows, the store reads them in a single pass
+    rows, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+    coords = dl.get_atoms("xyz", rows=rows)[["X", "Y", "Z"]].values
+
+    return coords, np.split(inverse, order)
+
+
+def evaluate_energy_streaming(dl, utype=None, nonbonded=False, chunk_size=2**20, tile_size=1024):
+    """
+    Evaluates the energy expression stored in a DataLayer while holding at most `chunk_size` terms in memory.
+
+    The term tables are read from the DataLayer store in chunks, see `DataLayer.get_terms`. For every chunk only the
+    coordinates of the atoms it references are read, the geometric variables and functional forms are evaluated as in
+    `evaluate_energy_expression`, and the energies are accumulated. Only the atom_index of the xyz table is held for the
+    whole evaluation, so systems with far more terms than fit in memory can be evaluated from the HDF5 backend.
+
+    Parameters
+    ----------
+    dl : DataLayer
+        The DataLayer to evaluate
+    utype : {None, str}, optional
+        The energy unit of the output, otherwise the internal DataLayer energy units are used.
+    nonbonded : bool, optional
+        If True, adds the "vdw" and "coul" nonbonded energies and "coul_long" for Ewald methods. Pairs span the whole
+        system so the full coordinates are read for these terms.
+    chunk_size : int, optional
+        The number of terms read from the store at once.
+    tile_size : int, optional
+        The number of atoms along each edge of a nonbonded pair tile, bounds the temporary memory.
+
+    Returns
+    -------
+    energy : dict
+        The energy of each component and the total energy, see `evaluate_energy_expression`.
+    """
+
+    if chunk_size < 1:
+        raise ValueError("evaluate_energy_streaming: The chunk size must be positive, found %d." % chunk_size)
+
+    energy = {"two-body": 0.0, "three-body": 0.0, "four-body": 0.0}
+
+    atom_index = dl.get_atom_index("xyz")
+    box, _ = neighbor_list.box_from_datalayer(dl)
+
+    for order_key, order, _ in expression_eval._bonded_terms:
+        for terms in dl.get_terms(order, chunksize=chunk_size):
+            if terms.shape[0] == 0: continue
+
+            coords, positions = _chunk_coordinates(dl, atom_index, terms, order)
+            variables = expression_eval._TermVariables(order, coords, positions, box=box)
+
+            term_index = terms["term_index"].values
+            for form_type, selection, parameters in expression_eval._build_form_groups(dl, order, term_index):
+                kernel = form_compiler.get_term_kernel(order, form_type)
+
+                local_dict = variables.select(kernel.input_names, selection)
+                local_dict.update(parameters)
+                energy[order_key] += np.sum(kernel(local_dict))
+
+    if nonbonded:
+        xyz = dl.get_atoms("xyz")
+        coords = xyz[["X", "Y", "Z"]].values
+        nb_data = expression_eval._build_nonbonded_data(dl, xyz)
+        energy.update(expression_eval._nonbonded_energy(coords, nb_data, tile_size))
+
+    cf = expression_eval._energy_conversion_factor(utype)
+    energy = {k: cf * v for k, v in energy.items()}
+    energy["total"] = sum(energy.values())
+
+    return energy
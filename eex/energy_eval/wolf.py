@@ -0,0 +1,147 @@
+"""
+Wolf and damped shifted force (DSF) electrostatics
+"""
+
+import numpy as np
+
+from . import ewald
+
+__all__ = ["wolf_damping", "dsf_damping", "damped_self_energy", "damped_coulomb_energy"]
+
+_damped_methods = ["wolf", "dsf"]
+
+
+def wolf_damping(r, alpha, cutoff):
+    """
+    The factor that turns the bare Coulomb energy q_i q_j / r into the Wolf energy.
+
+    The Wolf pair energy is q_i q_j (erfc(alpha r) / r - erfc(alpha rc) / rc), which goes to zero at the cutoff.
+
+    Parameters
+    ----------
+    r : np.ndarray
+        The (N, ) pair distances, all below the cutoff
+    alpha : float
+        The damping parameter
+    cutoff : float
+        The pair distance cutoff
+
+    Returns
+    -------
+    damping : np.ndarray
+        The (N, ) factors
+
+    Notes
+    -----
+    D. Wolf et al., J. Chem. Phys. 110, 8254 (1999)
+    """
+
+    r = np.asarray(r, dtype=np.float64)
+    e_shift = ewald.erfc(alpha * cutoff) / cutoff
+    return ewald.erfc(alpha * r) - r * e_shift
+
+
+def dsf_damping(r, alpha, cutoff):
+    """
+    The factor that turns the bare Coulomb energy q_i q_j / r into the damped shifted force energy.
+
+    Both the DSF pair energy and force go to zero at the cutoff.
+
+    Parameters
+    ----------
+    r : np.ndarray
+        The (N, ) pair distances, all below the cutoff
+    alpha : float
+        The damping parameter
+    cutoff : float
+        The pair distance cutoff
+
+    Returns
+    -------
+    damping : np.ndarray
+        The (N, ) factors
+
+    Notes
+    -----
+    C. J. Fennell and J. D. Gezelter, J. Chem. Phys. 124, 234104 (2006)
+    """
+
+    r = np.asarray(r, dtype=np.float64)
+    erfc_cut = ewald.erfc(alpha * cutoff)
+    e_shift = erfc_cut / cutoff
+    f_shift = erfc_cut / cutoff**2 + 2.0 * alpha / np.sqrt(np.pi) * np.exp(-(alpha * cutoff)**2) / cutoff
+    return ewald.erfc(alpha * r) - r * e_shift + r * f_shift * (r - cutoff)
+
+
+def damped_self_energy(charges, alpha, cutoff, coul_constant=1.0):
+    """
+    Computes the self energy shared by the Wolf and DSF methods.
+
+    Parameters
+    ----------
+    charges : np.ndarray
+        A (N, ) array of charges
+    alpha : float
+        The damping parameter
+    cutoff : float
+        The pair distance cutoff
+    coul_constant : float, optional
+        Coulomb's constant in the units of the charges, distances, and energy.
+    """
+
+    charges = np.asarray(charges, dtype=np.float64)
+    e_shift = ewald.erfc(alpha * cutoff) / cutoff
+    return -coul_constant * (0.5 * e_shift + alpha / np.sqrt(np.pi)) * np.sum(charges**2)
+
+
+def damped_coulomb_energy(charges, i, j, r, cutoff, alpha, method="wolf", coul_constant=1.0, scaled_pairs=None):
+    """
+    Computes the Wolf or DSF Coulomb energy from a pair list.
+
+    Scaled pairs follow the LAMMPS convention, (scale - 1) times the bare Coulomb energy is added for every scaled
+    pair inside of the cutoff so that an excluded pair also removes its share of the self energy.
+
+    Parameters
+    ----------
+    charges : np.ndarray
+        A (N, ) array of charges
+    i, j : np.ndarray
+        The unique (i, j) pairs within the cutoff
+    r : np.ndarray
+        The distance of each pair
+    cutoff : float
+        The pair distance cutoff
+    alpha : float
+        The damping parameter
+    method : {"wolf", "dsf"}, optional
+        The damping method
+    coul_constant : float, optional
+        Coulomb's constant in the units of the charges, distances, and energy.
+    scaled_pairs : tuple of np.ndarray, optional
+        The (i, j, r, scale) of each scaled pair, pairs outside of the cutoff are ignored.
+
+    Returns
+    -------
+    energy : float
+        The Coulomb energy including the self energy
+    """
+
+    if method == "wolf":
+        damping = wolf_damping
+    elif method == "dsf":
+        damping = dsf_damping
+    else:
+        raise KeyError("damped_coulomb_energy: Method '%s' not understood." % method)
+
+    charges = np.asarray(charges, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+
+    energy = coul_constant * np.sum(charges[i] * charges[j] / r * damping(r, alpha, cutoff))
+
+    if scaled_pairs is not None:
+        si, sj, sr, scale = scaled_pairs
+        sr = np.asarray(sr, dtype=np.float64)
+        inside = sr < cutoff
+        energy += coul_constant * np.sum((scale - 1.0) * charges[si] * charges[sj] / sr * inside)
+
+    return energy + damped_self_energy(charges, alpha, cutoff, coul_constant)
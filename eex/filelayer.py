@@ -4,6 +4,7 @@ Base class for the filelayer.
 
 import os
 
+import numpy as np
 import pandas as pd
 
 
@@ -80,24 +81,50 @@ class HDFStore(BaseStore):
     def read_table(self, key, rows=None, where=None, chunksize=None):
         """
         Reads the table using either the rows or where syntax
-        Appends or builds a new table
 
         Parameters
         ----------
         key : str
             The name of the table
-        data : pd.DataFrame
-            The data to append to the table
+        rows : array_like, optional
+            The integer row positions to read
+        where : {str, list}, optional
+            A PyTables selection of the rows to read
+        chunksize : int, optional
+            If given, returns an iterator over DataFrames of at most chunksize rows.
         """
 
-        if rows:
-            raise Exception("NYI")
-        
-        if key in self.list_tables():
-            return pd.read_hdf(self.store, key)
-        else:
+        if (rows is not None) and (where is not None):
+            raise KeyError("HDFStore:read_table: Only one of rows or where can be given.")
+
+        if rows is not None:
+            where = pd.Index(np.asarray(rows, dtype=np.int64))
+
+        if key not in self.list_tables():
+            if chunksize is not None:
+                return iter([])
             return pd.DataFrame()
 
+        if (rows is not None) and (where.shape[0] == 0):
+            return self.store.select(key, start=0, stop=0)
+
+        return self.store.select(key, where=where, chunksize=chunksize)
+
+    def read_index(self, key):
+        """
+        Reads only the index of a table.
+
+        Parameters
+        ----------
+        key : str
+            The name of the table
+        """
+
+        if key not in self.list_tables():
+            return pd.Index([])
+
+        return pd.Index(self.store.select_column(key, "index").values)
+
     def close(self):
         """
         Closes the FL file.
@@ -152,7 +179,7 @@ class MemoryStore(BaseStore):
         else:
             self.table_frags[key].append(data)
 
-    def read_table(self, key):
+    def _concat_table(self, key):
         if key not in list(self.tables):
             raise KeyError("Key %s does not exist" % key)
 
@@ -163,7 +190,24 @@ class MemoryStore(BaseStore):
             self.tables[key] = pd.concat(self.table_frags[key])
             self.table_frags[key] = []
 
-        return self.tables[key].copy()
+        return self.tables[key]
+
+    def read_table(self, key, rows=None, where=None, chunksize=None):
+        if where is not None:
+            raise KeyError("MemoryStore:read_table: The where syntax is only available for the HDF5 store.")
+
+        table = self._concat_table(key)
+        if rows is not None:
+            table = table.iloc[np.asarray(rows, dtype=np.int64)]
+
+        if chunksize is not None:
+            return (table.iloc[start:start + chunksize].copy() for start in range(0, table.shape[0], chunksize))
+
+        return table.copy()
+
+    def read_index(self, key):
+
+        return self._concat_table(key).index
 
     def close(self):
         """
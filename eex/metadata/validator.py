@@ -2,6 +2,8 @@
 Provides helper functions that validate the functional data.
 """
 
+import numpy as np
+
 from .. import units
 
 term_requied_fields = ['variables', 'store_name', 'store_indices', 'forms']
@@ -34,20 +36,7 @@ def validate_term_dict(name, functional_form, parameters, utype=None):
 
     # Deal with units
     if utype is not None:
-        if isinstance(utype, (list, tuple)):
-            if len(utype) != len(functional_form["utype"]):
-                raise ValueError("Validate term dict: Number of units passed is %d, expected %d for terms %s" %
-                                 (len(utype), len(functional_form["utype"]), name))
-            form_units = list(utype)
-        elif isinstance(utype, dict):
-            form_units = []
-            for key in functional_form["parameters"]:
-                try:
-                    form_units.append(utype[key])
-                except KeyError:
-                    raise KeyError("Validate term dict: Did not find expected key '%s' from term '%s'." % (key, name))
-        else:
-            raise TypeError("Validate term dict: Unit type '%s' not understood" % str(type(utype)))
+        form_units = _parse_form_units(name, functional_form, utype)
 
         # Convert units to internal
         for x, key in enumerate(functional_form["parameters"]):
@@ -59,6 +48,71 @@ def validate_term_dict(name, functional_form, parameters, utype=None):
     return list(map(float, params))
 
 
+def validate_term_table(name, functional_form, table, utype=None):
+    """
+    Validates a table of terms with one column per parameter
+
+    Parameters
+    ----------
+    name : str
+        The name of the functional form
+    functional_form : dict
+        The functional form metadata
+    table : pd.DataFrame
+        A table holding at least a column for each parameter of the functional form
+    utype : {list, tuple, dict}, optional
+        The units of the table columns, otherwise the internal units are assumed.
+
+    Returns
+    -------
+    params : np.ndarray
+        The (nrows, nparameters) parameters in the internal units and in the parameter order of the functional form
+    """
+
+    missing = [key for key in functional_form["parameters"] if key not in table.columns]
+    if len(missing):
+        raise KeyError("Validate term table: Did not find expected key(s) %s from term '%s'." % (missing, name))
+
+    params = np.empty((table.shape[0], len(functional_form["parameters"])))
+    for x, key in enumerate(functional_form["parameters"]):
+        column = table[key]
+        if not np.issubdtype(column.dtype, np.number):
+            raise TypeError("Validate term table: Parameters must be floats, found type %s for '%s'." % (column.dtype,
+                                                                                                       key))
+        params[:, x] = column.values
+
+    # One conversion factor per column
+    if utype is not None:
+        form_units = _parse_form_units(name, functional_form, utype)
+        for x, key in enumerate(functional_form["parameters"]):
+            params[:, x] *= units.conversion_factor(form_units[x], functional_form["utype"][key])
+
+    return params
+
+
+def _parse_form_units(name, functional_form, utype):
+    """
+    Orders the units of a list, tuple, or dict utype by the parameters of the functional form
+    """
+
+    if isinstance(utype, (list, tuple)):
+        if len(utype) != len(functional_form["utype"]):
+            raise ValueError("Validate term dict: Number of units passed is %d, expected %d for terms %s" %
+                             (len(utype), len(functional_form["utype"]), name))
+        form_units = list(utype)
+    elif isinstance(utype, dict):
+        form_units = []
+        for key in functional_form["parameters"]:
+            try:
+                form_units.append(utype[key])
+            except KeyError:
+                raise KeyError("Validate term dict: Did not find expected key '%s' from term '%s'." % (key, name))
+    else:
+        raise TypeError("Validate term dict: Unit type '%s' not understood" % str(type(utype)))
+
+    return form_units
+
+
 def validate_functional_form_dict(name, functional_form):
     """
     Checks an individual functional form for corretness
@@ -1,14 +1,20 @@
 """
 Converts various NB forms to other equivalents. In addtion, programs combining rules
+
+Coefficients may be scalars or NumPy arrays of any shape, arrays are converted and mixed elementwise.
 """
 
+import numpy as np
+
 
 ## LJ Conversions
 def _LJ_ab_to_ab(coeffs):
     """
     Convert AB representation to AB representation of the LJ potential
     """
-    return {'A': coeffs['A'], 'B': coeffs['B']}
+    A = np.asarray(coeffs['A'], dtype=float)
+    B = np.asarray(coeffs['B'], dtype=float)
+    return {'A': A[()], 'B': B[()]}
 
 
 def _LJ_epsilonsigma_to_ab(coeffs):
@@ -16,9 +22,27 @@ def _LJ_epsilonsigma_to_ab(coeffs):
     Convert epsilon/sigma representation to AB representation of the LJ
     potential
     """
-    A = 4.0 * coeffs['epsilon'] * coeffs['sigma']**12.0
-    B = 4.0 * coeffs['epsilon'] * coeffs['sigma']**6.0
-    return {"A": A, "B": B}
+    epsilon = np.asarray(coeffs['epsilon'], dtype=float)
+    sigma = np.asarray(coeffs['sigma'], dtype=float)
+
+    A = 4.0 * epsilon * sigma**12.0
+    B = 4.0 * epsilon * sigma**6.0
+    return {"A": A[()], "B": B[()]}
+
+
+def _LJ_ab_zero_mask(coeffs):
+    """
+    Returns the A and B coefficients as arrays together with the mask of the entries where both are zero
+    """
+    A = np.asarray(coeffs['A'], dtype=float)
+    B = np.asarray(coeffs['B'], dtype=float)
+
+    zero = (A == 0.0) & (B == 0.0)
+    if np.any((A == 0.0) != (B == 0.0)):
+        raise ZeroDivisionError("Lennard Jones functional form conversion not possible, division by zero found.")
+
+    # Replace the zero entries so the conversions below never divide by zero
+    return np.where(zero, 1.0, A), np.where(zero, 1.0, B), zero
 
 
 def _LJ_ab_to_epsilonsigma(coeffs):
@@ -26,17 +50,12 @@ def _LJ_ab_to_epsilonsigma(coeffs):
     Convert AB representation to epsilon/sigma representation of the LJ
     potential
     """
-    if (coeffs['A'] == 0.0 and coeffs['B'] == 0.0):
-        return {"sigma": 0.0, "epsilon": 0.0}
+    A, B, zero = _LJ_ab_zero_mask(coeffs)
 
-    try:
-        sigma = (coeffs['A'] / coeffs['B'])**(1.0 / 6.0)
-        epsilon = coeffs['B']**2.0 / (4.0 * coeffs['A'])
+    sigma = np.where(zero, 0.0, (A / B)**(1.0 / 6.0))
+    epsilon = np.where(zero, 0.0, B**2.0 / (4.0 * A))
 
-    except ZeroDivisionError:
-        raise ZeroDivisionError("Lennard Jones functional form conversion not possible, division by zero found.")
-
-    return {"sigma": sigma, "epsilon": epsilon}
+    return {"sigma": sigma[()], "epsilon": epsilon[()]}
 
 
 def _LJ_rminepsilon_to_ab(coeffs):
@@ -44,27 +63,24 @@ def _LJ_rminepsilon_to_ab(coeffs):
     Convert rmin/epsilon representation to AB representation of the LJ
     potential
     """
-    A = coeffs['epsilon'] * coeffs['Rmin']**12.0
-    B = 2 * coeffs['epsilon'] * coeffs['Rmin']**6.0
-    return {"A": A, "B": B}
+    epsilon = np.asarray(coeffs['epsilon'], dtype=float)
+    Rmin = np.asarray(coeffs['Rmin'], dtype=float)
+
+    A = epsilon * Rmin**12.0
+    B = 2 * epsilon * Rmin**6.0
+    return {"A": A[()], "B": B[()]}
 
 
 def _LJ_ab_to_rminepsilon(coeffs):
     """
     Convert AB representation to Rmin/epsilon representation of the LJ potential
     """
+    A, B, zero = _LJ_ab_zero_mask(coeffs)
 
-    if (coeffs['A'] == 0.0 and coeffs['B'] == 0.0):
-        return {"sigma": 0.0, "epsilon": 0.0}
+    Rmin = np.where(zero, 0.0, (2.0 * A / B)**(1.0 / 6.0))
+    Eps = np.where(zero, 0.0, B**2.0 / (4.0 * A))
 
-    try:
-        Rmin = (2.0 * coeffs['A'] / coeffs['B'])**(1.0 / 6.0)
-        Eps = coeffs['B']**2.0 / (4.0 * coeffs['A'])
-
-    except ZeroDivisionError:
-        raise ZeroDivisionError("Lennard Jones functional form conversion not possible, division by zero found.")
-
-    return {"Rmin": Rmin, "epsilon": Eps}
+    return {"Rmin": Rmin[()], "epsilon": Eps[()]}
 
 
 _LJ_conversion_matrix = {
@@ -75,6 +91,24 @@ _LJ_conversion_matrix = {
 
 
 def convert_LJ_coeffs(coeffs, origin, final):
+    """
+    Converts LJ coefficients between models.
+
+    Parameters
+    ----------
+    coeffs : dict
+        A {parameter_name: value} dictionary in the origin model, values may be scalars or arrays of any shape
+    origin : str
+        The model of the coefficients (eg "AB", "epsilon/sigma", "epsilon/Rmin")
+    final : str
+        The model to convert to
+
+    Returns
+    -------
+    ret : dict
+        A {parameter_name: value} dictionary in the final model, arrays keep the shape of the input. Entries where
+        every coefficient is zero are converted to zero.
+    """
 
     difference = set([origin, final]) - set(_LJ_conversion_matrix.keys())
     if (difference):
@@ -86,7 +120,11 @@ def convert_LJ_coeffs(coeffs, origin, final):
         raise KeyError("The key %s in the coefficient dictionary is not in the list of allowed keys %s" %
                        (difference, _LJ_conversion_matrix[origin][0]))
 
+    # Models other than AB are converted through the internal AB representation
     internal = _LJ_conversion_matrix[origin][1](coeffs)
+    if final == "AB":
+        return internal
+
     external = _LJ_conversion_matrix[final][2](internal)
     return external
 
@@ -114,33 +152,58 @@ def _geometric(sigma_epsilon_i, sigma_epsilon_j):
 def _sixthpower(sigma_epsilon_i, sigma_epsilon_j):
     new_params = {}
 
-    new_params['sigma'] = ((sigma_epsilon_i['sigma']**6. * sigma_epsilon_j['sigma'] ** 6.) / 2.) ** (1./6.)
+    sigma6 = sigma_epsilon_i['sigma']**6. * sigma_epsilon_j['sigma']**6.
+
+    new_params['sigma'] = (sigma6 / 2.)**(1. / 6.)
 
-    new_params['epsilon'] = (2 * (sigma_epsilon_i['epsilon'] * sigma_epsilon_j['epsilon']) ** (1./2.) * sigma_epsilon_i['sigma'] ** 3.
-                            * sigma_epsilon_j['sigma'] ** 3.) /(sigma_epsilon_i['sigma'] ** 6. * sigma_epsilon_j['sigma'] ** 6.)
+    # A zero sigma has no LJ interaction, mask it rather than divide by zero
+    zero = (sigma6 == 0.0)
+    new_params['epsilon'] = np.where(
+        zero, 0.0, (2 * (sigma_epsilon_i['epsilon'] * sigma_epsilon_j['epsilon'])**(1. / 2.) *
+                    sigma_epsilon_i['sigma']**3. * sigma_epsilon_j['sigma']**3.) / np.where(zero, 1.0, sigma6))
     return new_params
 
+
 def mix_LJ(coeff_i, coeff_j, mixing_rule, origin="AB", final="AB"):
-    # Calculate interactions between two atom types based on specified mixing rules
+    """
+    Calculate interactions between two atom types based on specified mixing rules
+
+    Parameters
+    ----------
+    coeff_i : dict
+        The coefficients of the first atom types, values may be scalars or arrays
+    coeff_j : dict
+        The coefficients of the second atom types, broadcast against coeff_i. For example, (ntypes, 1) and (1, ntypes)
+        arrays of the same coefficients mix a full (ntypes, ntypes) table.
+    mixing_rule : str
+        The mixing rule, see `LJ_mixing_functions`
+    origin : str, optional
+        The model of the input coefficients
+    final : str, optional
+        The model of the mixed coefficients
+
+    Returns
+    -------
+    ret : dict
+        The mixed coefficients in the final model
+    """
 
-    # First convert from input form to internal AB representation
-    internal_coeff_i = convert_LJ_coeffs(coeff_i, origin=origin, final="AB")
-    internal_coeff_j = convert_LJ_coeffs(coeff_j, origin=origin, final="AB")
+    mixing_rule = mixing_rule.lower()
+    if mixing_rule not in LJ_mixing_functions:
+        raise KeyError("mix_LJ: Mixing rule '%s' not understood, available rules: %s." %
+                       (mixing_rule, str(list(LJ_mixing_functions))))
 
-    # Convert from internal AB representation to epsilon/sigma
-    sigma_epsilon_i = convert_LJ_coeffs(internal_coeff_i, origin="AB", final="epsilon/sigma")
-    sigma_epsilon_j = convert_LJ_coeffs(internal_coeff_j, origin="AB", final="epsilon/sigma")
+    # Convert from input form to epsilon/sigma
+    sigma_epsilon_i = convert_LJ_coeffs(coeff_i, origin=origin, final="epsilon/sigma")
+    sigma_epsilon_j = convert_LJ_coeffs(coeff_j, origin=origin, final="epsilon/sigma")
 
     # Calculate new parameters based on mixing rules
-    mixing_rule = mixing_rule.lower()
     new_params = LJ_mixing_functions[mixing_rule](sigma_epsilon_i, sigma_epsilon_j)
+    new_params = {k: np.asarray(v, dtype=float)[()] for k, v in new_params.items()}
 
-    # Convert from epsilon-sigma to AB, then to final specified form. Double conversion is necessary because of
-    # form of conversion matrix.
-    convert_params_temp = convert_LJ_coeffs(new_params, origin="epsilon/sigma", final="AB")
-    convert_params = convert_LJ_coeffs(convert_params_temp, origin="AB", final=final)
+    # Convert from epsilon-sigma to the final specified form
+    return convert_LJ_coeffs(new_params, origin="epsilon/sigma", final=final)
 
-    return convert_params
 
 LJ_mixing_functions = {
     "lorentz-berthelot" : _lorentz_berthelot,
@@ -148,4 +211,4 @@ LJ_mixing_functions = {
     "geometric" : _geometric,
     "sixthpower" : _sixthpower,
     #"kong": _kong,
-}
\ No newline at end of file
+}
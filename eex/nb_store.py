@@ -0,0 +1,216 @@
+"""
+Columnar storage of the nonbonded parameters of a DataLayer
+"""
+
+import numpy as np
+
+__all__ = ["NBParameterStore"]
+
+
+class NBParameterStore(object):
+    """
+    Stores nonbonded parameters as dense atom type arrays.
+
+    Every registered atom type holds a position into the arrays. Each functional form (eg "LJ") holds a (ntypes, )
+    array of every parameter for the single atom type interactions and a symmetric (ntypes, ntypes) array of every
+    parameter for the pair interactions, together with boolean masks of the explicitly set entries. An interaction
+    belongs to at most a single form, setting it in one form removes it from every other form.
+
+    The arrays are grown by doubling so adding atom types one at a time is amortized constant time.
+    """
+
+    def __init__(self):
+
+        # Registered atom types and their positions into the arrays
+        self.types = []
+        self.type_index = {}
+        self.capacity = 0
+
+        # {nb_name: {"parameters": [...], "single": {name: array}, "single_mask": array, "pair": ..., "pair_mask": ...}}
+        self.forms = {}
+
+    def __repr__(self):
+        return "NBParameterStore(ntypes=%d, forms=%s)" % (len(self.types), str(sorted(self.forms)))
+
+    def _grow(self, ntypes):
+        """
+        Grows the arrays of every form to hold at least ntypes atom types.
+        """
+
+        if ntypes <= self.capacity:
+            return
+
+        capacity = max(ntypes, 2 * self.capacity, 8)
+        old = self.capacity
+        for form in self.forms.values():
+            form["single_mask"] = _grow_array(form["single_mask"], capacity, old)
+            form["pair_mask"] = _grow_array(form["pair_mask"], capacity, old)
+            for name in form["parameters"]:
+                form["single"][name] = _grow_array(form["single"][name], capacity, old)
+                form["pair"][name] = _grow_array(form["pair"][name], capacity, old)
+
+        self.capacity = capacity
+
+    def _form(self, nb_name, parameters):
+        """
+        Returns the arrays of a form, creating them if needed.
+        """
+
+        if nb_name not in self.forms:
+            self.forms[nb_name] = {
+                "parameters": list(parameters),
+                "single": {k: np.zeros(self.capacity) for k in parameters},
+                "single_mask": np.zeros(self.capacity, dtype=bool),
+                "pair": {k: np.zeros((self.capacity, self.capacity)) for k in parameters},
+                "pair_mask": np.zeros((self.capacity, self.capacity), dtype=bool),
+            }
+
+        return self.forms[nb_name]
+
+    def positions(self, atom_types, register=False):
+        """
+        Returns the positions of the atom types into the arrays, unknown types are registered or set to -1.
+        """
+
+        # Only the distinct types are looked up
+        unique, inverse = np.unique(np.asarray(atom_types), return_inverse=True)
+
+        ret = np.empty(unique.shape[0], dtype=int)
+        for num, atom_type in enumerate(unique.tolist()):
+            pos = self.type_index.get(atom_type, -1)
+            if (pos == -1) and register:
+                pos = len(self.types)
+                self.types.append(atom_type)
+                self.type_index[atom_type] = pos
+            ret[num] = pos
+
+        if register:
+            self._grow(len(self.types))
+
+        return ret[inverse]
+
+    def set_parameters(self, nb_name, parameters, atom_types, atom_types2=None):
+        """
+        Sets the parameters of many single (atom_types2 is None) or pair interactions of a form.
+
+        Parameters
+        ----------
+        nb_name : str
+            The name of the functional form
+        parameters : dict of np.ndarray
+            A {parameter_name: values} dictionary, one value per interaction
+        atom_types : array_like
+            The first atom type of each interaction
+        atom_types2 : {None, array_like}, optional
+            The second atom type of each pair interaction
+        """
+
+        pos1 = self.positions(atom_types, register=True)
+        if atom_types2 is not None:
+            pos2 = self.positions(atom_types2, register=True)
+            index = (np.concatenate((pos1, pos2)), np.concatenate((pos2, pos1)))
+            itype = "pair"
+        else:
+            index = pos1
+            itype = "single"
+
+        # An interaction belongs to a single form
+        for name, form in self.forms.items():
+            if name != nb_name:
+                form[itype + "_mask"][index] = False
+
+        form = self._form(nb_name, list(parameters))
+        for k in form["parameters"]:
+            values = np.asarray(parameters[k], dtype=float)
+            if itype == "pair":
+                values = np.concatenate((np.broadcast_to(values, pos1.shape), np.broadcast_to(values, pos1.shape)))
+            form[itype][k][index] = values
+        form[itype + "_mask"][index] = True
+
+    def get_parameters(self, atom_type, atom_type2=None):
+        """
+        Returns the form name and a {parameter_name: value} dictionary of a single interaction.
+        """
+
+        pos = self.positions([atom_type, atom_type2] if atom_type2 is not None else [atom_type])
+        if np.any(pos == -1):
+            raise KeyError("Nonbond interaction for atom types (%s, %s) not found" % (atom_type, atom_type2))
+
+        for nb_name, form in self.forms.items():
+            if atom_type2 is None:
+                index = pos[0]
+                itype = "single"
+            else:
+                index = (pos[0], pos[1])
+                itype = "pair"
+
+            if form[itype + "_mask"][index]:
+                return nb_name, {k: float(form[itype][k][index]) for k in form["parameters"]}
+
+        raise KeyError("Nonbond interaction for atom types (%s, %s) not found" % (atom_type, atom_type2))
+
+    def stored_forms(self):
+        """
+        Returns the sorted names of the forms with at least a single interaction set.
+        """
+
+        ntypes = len(self.types)
+        ret = []
+        for nb_name, form in self.forms.items():
+            if np.any(form["single_mask"][:ntypes]) or np.any(form["pair_mask"][:ntypes, :ntypes]):
+                ret.append(nb_name)
+        return sorted(ret)
+
+    def get_table(self, nb_name, itype="pair"):
+        """
+        Returns the dense arrays of a form over the registered atom types in sorted order.
+
+        Parameters
+        ----------
+        nb_name : str
+            The name of the functional form
+        itype : {"pair", "single"}, optional
+            Returns the (ntypes, ntypes) pair or the (ntypes, ) single interaction arrays
+
+        Returns
+        -------
+        types : np.ndarray
+            The sorted atom types
+        parameters : dict of np.ndarray
+            A {parameter_name: array} dictionary, entries which are not set are zero
+        mask : np.ndarray
+            A boolean array of the set entries
+        """
+
+        if itype not in ["pair", "single"]:
+            raise KeyError("NBParameterStore:get_table: itype '%s' not understood." % itype)
+
+        ntypes = len(self.types)
+        order = np.array(sorted(range(ntypes), key=self.types.__getitem__), dtype=int)
+        types = np.array([self.types[x] for x in order])
+
+        if itype == "pair":
+            index = np.ix_(order, order)
+            shape = (ntypes, ntypes)
+        else:
+            index = order
+            shape = (ntypes, )
+
+        if nb_name not in self.forms:
+            return types, {}, np.zeros(shape, dtype=bool)
+
+        form = self.forms[nb_name]
+        mask = form[itype + "_mask"][index]
+        parameters = {k: np.where(mask, form[itype][k][index], 0.0) for k in form["parameters"]}
+
+        return types, parameters, mask
+
+
+def _grow_array(array, capacity, old):
+    """
+    Copies the leading (old, ...) block of an array into a zeroed array of the new capacity along every dimension.
+    """
+
+    ret = np.zeros((capacity, ) * array.ndim, dtype=array.dtype)
+    ret[(slice(0, old), ) * array.ndim] = array[(slice(0, old), ) * array.ndim]
+    return ret
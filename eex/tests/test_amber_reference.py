@@ -25,7 +25,11 @@ for test_dir in _test_directories:
         _test_systems.append((path, file_name))
 
 # List current energy tests
-_energy_types = {"two-body" : "bond", "three-body": "angle", "four-body": "dihedral"}
+_energy_types = {"two-body" : "bond", "three-body": "angle", "four-body": "dihedral", "vdw": "vdwaals",
+                 "coul": "electrostatic"}
+
+# The reference nonbonded energies of these systems were not computed with their modified exclusion lists
+_nonbonded_skip = ["trappe_tetradecane_exclusions_single_molecule"]
 
 def test_references(amber_references):
 
@@ -33,7 +37,7 @@ def test_references(amber_references):
     molecule = str(system_name.split("/")[-1]).split(".")[0]
 
     data, dl = eex_build_dl.build_dl("amber", test_dir, molecule)
-    dl_energies = dl.evaluate(utype='kcal * mol ** -1')
+    dl_energies = dl.evaluate(utype='kcal * mol ** -1', nonbonded=True)
 
     reference_file = eex_find_files.get_example_filename("amber", test_dir, "energies.csv")
     reference_energies = pd.read_csv(reference_file, header=0)
@@ -41,6 +45,9 @@ def test_references(amber_references):
     reference = reference_energies.loc[reference_energies['molecule'] == molecule]
 
     for k in _energy_types:
+        if (k in ["vdw", "coul"]) and (molecule in _nonbonded_skip):
+            continue
+
         k_reference = reference[_energy_types[k]].get_values()[0]
 
         # Test against reference values in CSV -- absolute toloerance of 0.001 is used since amber only
@@ -106,6 +106,31 @@ def test_add_atom_parameter():
         dl.add_atom_parameter("mass", 6.0, uid=0)
 
 
+@pytest.mark.parametrize("backend", _backend_list)
+def test_atoms_by_value_interning(backend):
+    dl = eex.datalayer.DataLayer("test_atoms_by_value_interning", backend=backend)
+
+    # Existing parameters keep their uid, new values fill the lowest free uids in sorted order
+    assert 1 == dl.add_atom_parameter("charge", 0.4, uid=1)
+    assert 3 == dl.add_atom_parameter("charge", -0.8, uid=3)
+
+    df = pd.DataFrame({"atom_index": np.arange(8), "charge": [0.5, -0.8, 0.4, 0.1, 0.5 + 1.e-10, -0.8, 0.2, 0.1]})
+    df["residue_name"] = ["WAT", "ALA", "ALA", "WAT", "GLY", "WAT", "ALA", "GLY"]
+    dl.add_atoms(df, by_value=True)
+
+    uids = dl.get_atoms("charge").values.ravel()
+    assert uids.tolist() == [4, 3, 1, 0, 4, 3, 2, 0]
+    assert sorted(dl.list_atom_uids("charge")) == [0, 1, 2, 3, 4]
+    assert 4 == dl.add_atom_parameter("charge", 0.5)
+
+    assert dl.get_atoms("residue_name").values.ravel().tolist() == [2, 0, 0, 2, 1, 2, 0, 1]
+
+    # Expansion by value
+    values = dl.get_atoms(["charge", "residue_name"], by_value=True)
+    assert np.allclose(values["charge"].values, np.round(df["charge"].values, 8))
+    assert values["residue_name"].tolist() == df["residue_name"].tolist()
+
+
 def test_add_atom_parameter_units():
     dl = eex.datalayer.DataLayer("test_add_atom_parameters")
 
@@ -177,6 +202,100 @@ def test_add_term_parameter():
         dl.add_term_parameter(2, "harmonic_abc", [4.0, 5.0])
 
 
+def test_add_term_parameter_lookup():
+    """
+    Test duplicate parameter lookup against the registered parameters
+    """
+
+    dl = eex.datalayer.DataLayer("test_add_term_parameter_lookup")
+
+    # Forced dups are found in the order they were added
+    assert 15 == dl.add_term_parameter(2, "harmonic", [22.0, 22.0], uid=15)
+    assert 11 == dl.add_term_parameter(2, "harmonic", [22.0, 22.0], uid=11)
+    assert 15 == dl.add_term_parameter(2, "harmonic", [22.0, 22.0])
+
+    # np.allclose tolerances
+    assert 0 == dl.add_term_parameter(2, "harmonic", [1000.0, 0.0])
+    assert 0 == dl.add_term_parameter(2, "harmonic", [1000.0 + 9.e-3, 5.e-9])
+    assert 1 == dl.add_term_parameter(2, "harmonic", [1000.0 + 2.e-2, 0.0])
+
+    with pytest.raises(KeyError):
+        dl.add_term_parameter(2, "harmonic", [1000.0 + 2.e-2, 0.0], uid=0)
+
+
+def test_add_term_parameters_table():
+    """
+    Test adding a table of parameters matches adding them one at a time
+    """
+
+    df = pd.DataFrame({"K": [4.0, 4.0, 9.0, 4.0, 22.0, 5.0], "R0": [5.0, 5.0 + 1.e-10, 9.0, 6.0, 22.0, 1.0]})
+    df["uid"] = [0, 0, 10, 1, 11, 3]
+
+    for uid_col in [None, "uid"]:
+        dl_single = eex.datalayer.DataLayer("test_add_term_parameters_single")
+        dl_table = eex.datalayer.DataLayer("test_add_term_parameters_table")
+        for dl in [dl_single, dl_table]:
+            dl.add_term_parameter(2, "harmonic", [22.0, 22.0], uid=2)
+
+        utype = {"K": "kcal * mol ** -1 * angstrom ** -2", "R0": "nanometers"}
+        ref = []
+        for idx, row in df.iterrows():
+            uid = None if uid_col is None else int(row["uid"])
+            ref.append(dl_single.add_term_parameter(2, "harmonic", [row["K"], row["R0"]], uid=uid, utype=utype))
+
+        uids = dl_table.add_term_parameters(2, "harmonic", df, uid_col=uid_col, utype=utype)
+        assert ref == uids.tolist()
+        assert dl_single.list_term_parameters(2) == dl_table.list_term_parameters(2)
+
+    assert 0 == dl_table.add_term_parameters(2, "harmonic", df.iloc[:0]).shape[0]
+
+    # Float uids are fine if they are integers
+    assert [4] == dl_table.add_term_parameters(2, "harmonic", pd.DataFrame({"K": [1.0], "R0": [1.0], "uid": [4.0]}),
+                                               uid_col="uid").tolist()
+
+    # uid collisions
+    assert [0, 0] == dl_table.add_term_parameters(2, "harmonic", df.iloc[:2], uid_col="uid", utype=utype).tolist()
+    with pytest.raises(KeyError):
+        dl_table.add_term_parameters(2, "harmonic", df.iloc[:2], uid_col="uid")
+
+    with pytest.raises(KeyError):
+        dl_table.add_term_parameters(2, "harmonic", df[["K"]])
+
+    with pytest.raises(KeyError):
+        dl_table.add_term_parameters(2, "harmonic", df, uid_col="turtle")
+
+    with pytest.raises(TypeError):
+        dl_table.add_term_parameters(2, "harmonic", df.assign(uid=df["uid"] + 0.5), uid_col="uid")
+
+    with pytest.raises(TypeError):
+        dl_table.add_term_parameters(2, "harmonic", df.assign(K="duck"))
+
+
+def test_add_atom_parameters_table():
+    """
+    Test adding a table of atom parameters matches adding them one at a time
+    """
+
+    df = pd.DataFrame({"uid": [1, 2, 2, 5], "mass": [5.0, 6.0, 6.0, 5.0]})
+
+    dl_single = eex.datalayer.DataLayer("test_add_atom_parameters_single")
+    ref = [dl_single.add_atom_parameter("mass", 5.0)]
+    ref += [dl_single.add_atom_parameter("mass", v, uid=k, utype="kilogram / mol", allow_duplicates=True)
+            for k, v in zip(df["uid"].tolist(), df["mass"].tolist())]
+
+    dl_table = eex.datalayer.DataLayer("test_add_atom_parameters_table")
+    uids = dl_table.add_atom_parameters("mass", df.iloc[:1])
+    uids = np.concatenate((uids, dl_table.add_atom_parameters("mass", df, uid_col="uid", utype="kilogram / mol",
+                                                              allow_duplicates=True)))
+
+    assert ref == uids.tolist()
+    for uid in dl_single.list_atom_uids("mass"):
+        assert pytest.approx(dl_single.get_atom_parameter("mass", uid)) == dl_table.get_atom_parameter("mass", uid)
+
+    with pytest.raises(KeyError):
+        dl_table.add_atom_parameters("mass", df, uid_col="uid", utype="kilogram / mol")
+
+
 def test_add_term_parameters_units():
     """
     Test adding parameters to the DL object with units
@@ -415,12 +534,11 @@ def test_add_nb_parameter():
     # Add AB LJ parameters to data layer - add to two atoms
     dl.add_nb_parameter(atom_type=1, atom_type2=2, nb_name="LJ", nb_model="AB", nb_parameters=[2.0, 2.0])
 
-    # Grab stored test parameters - will need to replace dl._nb_parameters with dl.get_nb_parameter when implemented
-    test_parameters = dl._nb_parameters
-
-    assert test_parameters[(1, None)]["parameters"] == {'A': 1.0, 'B': 1.0}
-    assert test_parameters[(2, None)]["parameters"] == {'A': 4.0, 'B': 4.0}
-    assert test_parameters[(1, 2)]["parameters"] == {'A': 2.0, 'B': 2.0}
+    # Grab stored test parameters
+    assert dl.get_nb_parameter(atom_type=1) == {'A': 1.0, 'B': 1.0}
+    assert dl.get_nb_parameter(atom_type=2) == {'A': 4.0, 'B': 4.0}
+    assert dl.get_nb_parameter(atom_type=1, atom_type2=2) == {'A': 2.0, 'B': 2.0}
+    assert dl.get_nb_parameter(atom_type=2, atom_type2=1) == {'A': 2.0, 'B': 2.0}
 
     dl.add_nb_parameter(atom_type=1, nb_name="Buckingham", nb_model=None, nb_parameters=[1.0, 1.0, 1.0])
     with pytest.raises(KeyError):
@@ -624,6 +742,69 @@ def test_mixing_table():
 
     assert(dict_compare(pairIJ, ans))
 
+@pytest.mark.parametrize("mixing_rule", ["arithmetic", "geometric", "sixthpower"])
+def test_mixing_table_dense(mixing_rule):
+    dl = eex.datalayer.DataLayer("test_mixing_table_dense", backend="memory")
+    dl.set_mixing_rule(mixing_rule)
+
+    # Types are registered out of order, type 4 has no LJ interaction
+    single = {3: (0.5, 1.5), 1: (1.0, 2.0), 7: (2.0, 1.0), 4: (0.0, 0.0)}
+    for atom_type, (epsilon, sigma) in single.items():
+        dl.add_nb_parameter(atom_type=atom_type, nb_name="LJ", nb_model="epsilon/sigma",
+                            nb_parameters={'epsilon': epsilon, 'sigma': sigma})
+    dl.build_LJ_mixing_table()
+
+    types, params, mask = dl.get_nb_parameter_table("LJ", nb_model="AB", itype="pair")
+    assert list(types) == [1, 3, 4, 7]
+    assert mask.all()
+    assert np.allclose(params["A"], params["A"].T)
+
+    # Whole table mixing matches the pairwise mixing rule
+    for x, type1 in enumerate(types):
+        for y, type2 in enumerate(types):
+            if 4 in (type1, type2):
+                ref = {'A': 0.0, 'B': 0.0}
+            else:
+                ref = eex.nb_converter.mix_LJ(dl.get_nb_parameter(type1), dl.get_nb_parameter(type2), mixing_rule)
+            assert dict_compare({k: v[x, y] for k, v in params.items()}, ref)
+
+
+def test_get_nb_parameter_table():
+    dl = eex.datalayer.DataLayer("test_get_nb_parameter_table", backend="memory")
+
+    dl.add_nb_parameter(atom_type=2, nb_name="LJ", nb_model="epsilon/sigma", nb_parameters={'epsilon': 1.0, 'sigma': 2.0})
+    dl.add_nb_parameter(atom_type=1, nb_name="LJ", nb_model="epsilon/sigma", nb_parameters={'epsilon': 2.0, 'sigma': 1.0})
+    dl.add_nb_parameter(atom_type=1, atom_type2=2, nb_name="LJ", nb_model="AB", nb_parameters={'A': 3.0, 'B': 2.0})
+    dl.add_nb_parameter(atom_type=3, nb_name="Buckingham", nb_parameters={"A": 1.0, "C": 1.0, "rho": 1.0})
+
+    # Single arrays in any model and unit
+    types, params, mask = dl.get_nb_parameter_table(
+        "LJ", nb_model="epsilon/sigma", utype={'epsilon': 'kcal * mol ** -1', 'sigma': 'nanometers'}, itype="single")
+    assert list(types) == [1, 2, 3]
+    assert list(mask) == [True, True, False]
+
+    cf = eex.units.conversion_factor('kJ', 'kcal')
+    assert np.allclose(params["epsilon"], [2.0 * cf, 1.0 * cf, 0.0])
+    assert np.allclose(params["sigma"], [0.1, 0.2, 0.0])
+
+    # Pair arrays are symmetric and only hold the explicitly set pairs
+    types, params, mask = dl.get_nb_parameter_table("LJ", itype="pair")
+    assert mask.tolist() == [[False, True, False], [True, False, False], [False, False, False]]
+    assert params["A"][0, 1] == params["A"][1, 0] == 3.0
+
+    types, params, mask = dl.get_nb_parameter_table("Buckingham", itype="single")
+    assert list(mask) == [False, False, True]
+    assert set(params) == {"A", "C", "rho"}
+
+    # An interaction belongs to a single form
+    dl.add_nb_parameter(atom_type=1, nb_name="Buckingham", nb_parameters={"A": 2.0, "C": 1.0, "rho": 1.0})
+    assert list(dl.get_nb_parameter_table("LJ", itype="single")[2]) == [False, True, False]
+    assert dl.get_nb_parameter(atom_type=1) == {"A": 2.0, "C": 1.0, "rho": 1.0}
+
+    with pytest.raises(KeyError):
+        dl.get_nb_parameter_table("LJ", itype="test")
+
+
 def test_nb_scaling(): 
     dl = eex.datalayer.DataLayer("test_add_nb_parameters", backend="memory")
 
@@ -2,9 +2,14 @@
 Tests the energy expression evaluation
 """
 
+import itertools
+import math
+
 import eex
 import pytest
 import numpy as np
+import pandas as pd
+import numexpr as ne
 
 np.set_printoptions(precision=4)
 np.random.seed(0)
@@ -113,6 +118,41 @@ def test_lattice_sum():
     assert pytest.approx(-5.9111661281154744) == lat_data["total"]
 
 
+def test_lattice_sum_blocked():
+    lattice_sum = eex.energy_eval.nb_eval.lattice_sum
+
+    np.random.seed(2)
+    coords = np.random.rand(20, 3) * 4.0
+    charge = np.random.rand(20) - 0.5
+    box_length = np.array([4.0, 4.5, 5.0])
+
+    # Reference per image box, nboxes=4 spans the images -2 ... 2 along each direction
+    ref = {}
+    for n in itertools.product(range(-2, 3), repeat=3):
+        n = np.array(n)
+        shell = int(np.linalg.norm(n))
+        energy = 0.0
+        for i in range(coords.shape[0]):
+            for j in range(coords.shape[0]):
+                if (shell == 0) and (i == j):
+                    continue
+                energy += 0.5 * charge[i] * charge[j] / np.linalg.norm(coords[j] + n * box_length - coords[i])
+        ref[shell] = ref.get(shell, 0.0) + energy
+
+    lat_data = lattice_sum(coords, charge, box_length, 4, return_shells=True, tile_size=7, shifts_per_task=3)
+    assert pytest.approx(ref[0]) == lat_data["home"]
+    for shell in range(1, 4):
+        assert pytest.approx(ref[shell]) == lat_data[shell]
+    assert pytest.approx(sum(ref.values())) == lat_data["total"]
+
+    # Parallel evaluation reduces in the same order as the serial evaluation
+    parallel = lattice_sum(coords, charge, box_length, 4, return_shells=True, tile_size=7, shifts_per_task=3, nprocs=2)
+    assert parallel == lat_data
+
+    with pytest.raises(KeyError):
+        lattice_sum(coords, charge, box_length, 2, func="yukawa")
+
+
 def test_nb_eval_simple():
 
     nb_eval = eex.energy_eval.nb_eval.nonbonded_eval
@@ -161,4 +201,1267 @@ def test_evaluate():
     _test_evaluate(np.sum(local_dict["a"]**2), "sum(a ** 2)", local_dict)
 
 
+def _build_chain_dl(natoms, name="test_evaluate", atom_properties=None, xyz=None, backend="Memory"):
+    """
+    Builds a random chain molecule with two functional forms per order
+    """
+
+    dl = eex.datalayer.DataLayer(name, backend=backend)
+
+    if xyz is None:
+        xyz = np.random.rand(natoms, 3) * 2.0
+    atom_df = pd.DataFrame(xyz, columns=["X", "Y", "Z"])
+    atom_df["atom_index"] = np.arange(1, natoms + 1)
+    if atom_properties is not None:
+        for k, v in atom_properties.items():
+            atom_df[k] = v
+    dl.add_atoms(atom_df)
+
+    dl.add_term_parameter(2, "harmonic", [300.0, 1.2], uid=1)
+    dl.add_term_parameter(2, "class2", [1.1, 200.0, 10.0, 5.0], uid=2)
+    dl.add_term_parameter(3, "harmonic", [50.0, 1.9], uid=1)
+    dl.add_term_parameter(3, "cosine", [2.0], uid=2)
+    dl.add_term_parameter(4, "opls", [1.0, -0.5, 2.0, 0.1], uid=1)
+    dl.add_term_parameter(4, "charmmfsw", [1.5, 3.0, 0.0], uid=2)
+
+    index = np.arange(1, natoms + 1)
+    for order in [2, 3, 4]:
+        nterms = natoms - order + 1
+        df = pd.DataFrame({"atom" + str(x + 1): index[x:x + nterms] for x in range(order)})
+        df["term_index"] = np.random.randint(1, 3, nterms)
+        dl.add_terms(order, df)
+
+    return dl
+
+
+def _reference_energy(dl, xyz=None):
+    """
+    Evaluates every term one at a time
+    """
+
+    if xyz is None:
+        xyz = dl.get_atoms("xyz")
+    energy = {"two-body": 0.0, "three-body": 0.0, "four-body": 0.0}
+    funcs = {2: eex.energy_eval.geometry.compute_distance, 3: eex.energy_eval.geometry.compute_angle,
+             4: eex.energy_eval.geometry.compute_dihedral}
+    names = {2: ("two-body", "r"), 3: ("three-body", "theta"), 4: ("four-body", "phi")}
+    for order in [2, 3, 4]:
+        key, var = names[order]
+        for idx, row in dl.get_terms(order).iterrows():
+            points = [xyz.loc[row["atom" + str(x + 1)]].values for x in range(order)]
+            form_type, parameters = dl.get_term_parameter(order, row["term_index"])
+            parameters[var] = funcs[order](*points)
+            form = eex.metadata.get_term_metadata(order, "forms", form_type)["form"]
+            energy[key] += float(np.sum(eex.energy_eval.evaluate_form(form, parameters)))
+
+    energy["total"] = sum(energy.values())
+    return energy
+
+
+def test_evaluate_energy_expression():
+
+    dl = _build_chain_dl(25)
+    assert eex.testing.dict_compare(_reference_energy(dl), dl.evaluate())
+
+    # Units are applied to every component
+    energy = dl.evaluate(utype="kJ * mol ** -1")
+    scaled = dl.evaluate(utype="0.5 * kJ * mol ** -1")
+    for k, v in energy.items():
+        assert pytest.approx(2.0 * v) == scaled[k]
+
+
+def test_evaluate_missing_parameter():
+
+    dl = _build_chain_dl(5)
+    df = pd.DataFrame({"atom1": [1], "atom2": [3], "term_index": [7]})
+    dl.add_terms(2, df)
+
+    with pytest.raises(KeyError):
+        dl.evaluate()
+
+
+def test_form_compiler_cache():
+
+    cache = eex.energy_eval.form_compiler.KernelCache(maxsize=2)
+    get_term_kernel = eex.energy_eval.form_compiler.get_term_kernel
+
+    kernel = get_term_kernel(2, "harmonic", cache=cache)
+    assert kernel is get_term_kernel("bonds", "harmonic", cache=cache)
+    assert (cache.misses, cache.hits) == (1, 1)
+
+    r = np.random.rand(10) + 1.0
+    assert np.allclose(kernel({"r": r, "K": 2.0, "R0": 1.5}), 2.0 * (r - 1.5)**2)
+
+    # Least recently used kernels are evicted
+    get_term_kernel(3, "harmonic", cache=cache)
+    get_term_kernel(4, "opls", cache=cache)
+    assert len(cache) == 2
+    get_term_kernel(2, "harmonic", cache=cache)
+    assert cache.misses == 4
+
+    # Constants are substituted
+    kernel = get_term_kernel(4, "helix", cache=cache)
+    phi = np.random.rand(10)
+    ref = 1.0 * (1 - np.cos(phi)) + 2.0 * (1 + np.cos(3 * phi)) + 3.0 * (1 + np.cos(phi + np.pi / 4))
+    assert np.allclose(kernel({"phi": phi, "A": 1.0, "B": 2.0, "C": 3.0}), ref)
+
+    with pytest.raises(KeyError):
+        eex.energy_eval.form_compiler.compile_form("a * b", ["a"], cache=cache)
+
+
+def test_form_compiler_cse():
+
+    # (r-r0) is only subtracted once in the compiled class2 program
+    kernel = eex.energy_eval.form_compiler.get_term_kernel(2, "class2")
+    program = ne.necompiler.disassemble(kernel._program)
+    assert [x[0] for x in program].count(b"sub_ddd") == 1
+
+
+def test_evaluate_frames():
+
+    dl = _build_chain_dl(10, name="test_frames")
+    xyz = dl.get_atoms("xyz")
+    frames = xyz.values[None, :, :] + np.random.rand(7, 10, 3) * 0.2
+    frames[0] = xyz.values
+
+    # Small chunks split the frames
+    energy = eex.energy_eval.evaluate_energy_frames(dl, frames, max_elements=20)
+    assert energy["total"].shape == (7, )
+    for num, frame in enumerate(frames):
+        ref = _reference_energy(dl, pd.DataFrame(frame, index=xyz.index, columns=xyz.columns))
+        for k, v in ref.items():
+            assert pytest.approx(v) == energy[k][num]
+
+    # Iterators and unit conversion
+    kcal_energy = dl.evaluate_frames(iter(frames), utype="kcal * mol ** -1")
+    assert np.allclose(kcal_energy["total"] * 4.184, energy["total"])
+
+    with pytest.raises(ValueError):
+        dl.evaluate_frames(frames[:, :5])
+
+
+def test_evaluate_frames_stack(monkeypatch):
+
+    dl = _build_chain_dl(20, name="test_frames_stack")
+    xyz = dl.get_atoms("xyz")
+    frames = xyz.values[None, :, :] + np.random.rand(200, 20, 3) * 0.3
+
+    # The geometry of a whole chunk of frames is computed in one kernel call
+    calls = []
+    func, gradient_func, columns = eex.energy_eval.expression_eval._variable_definitions[4]["phi"]
+
+    def counted(*args, **kwargs):
+        calls.append(args[0].shape)
+        return func(*args, **kwargs)
+
+    monkeypatch.setitem(eex.energy_eval.expression_eval._variable_definitions[4], "phi",
+                        (counted, gradient_func, columns))
+
+    # Every frame of a large stack matches a single frame evaluation
+    energy = eex.energy_eval.evaluate_energy_frames(dl, frames)
+    assert energy["total"].shape == (200, )
+    assert calls == [(200 * 20, 3)]
+    for num, frame in enumerate(frames):
+        single = eex.energy_eval.evaluate_energy_frames(dl, frame[None])
+        for k, v in single.items():
+            assert pytest.approx(v[0]) == energy[k][num]
+
+    for num in [0, 77, 199]:
+        ref = _reference_energy(dl, pd.DataFrame(frames[num], index=xyz.index, columns=xyz.columns))
+        for k, v in ref.items():
+            assert pytest.approx(v) == energy[k][num]
+
+
+def test_evaluate_frames_nonbonded():
+
+    dl = _build_nb_dl(12, name="test_frames_nonbonded")
+    ref = dl.evaluate(nonbonded=True)
+
+    # Rigid rotations and translations leave the energy unchanged
+    xyz = dl.get_atoms("xyz").values
+    frames = []
+    for angle in np.linspace(0.0, np.pi, 4):
+        rotation = np.array([[np.cos(angle), -np.sin(angle), 0.0], [np.sin(angle), np.cos(angle), 0.0],
+                             [0.0, 0.0, 1.0]])
+        frames.append(np.dot(xyz, rotation.T) + angle)
+
+    energy = dl.evaluate_frames(np.array(frames), nonbonded=True)
+    for k in ["vdw", "coul", "total"]:
+        assert np.allclose(energy[k], ref[k])
+
+
+def test_parameter_sweep(monkeypatch):
+
+    dl = _build_chain_dl(15, name="test_parameter_sweep")
+    ncand = 6
+    dihedral_names = eex.metadata.get_term_metadata(4, "forms", "charmmfsw")["parameters"]
+    bond = {"K": np.linspace(100.0, 500.0, ncand), "R0": np.linspace(1.0, 1.5, ncand)}
+    dihedral = np.random.rand(ncand, len(dihedral_names))
+
+    # Small chunks split the candidate axis
+    candidates = {(2, 1): bond, (4, 2): dihedral}
+    energy = eex.energy_eval.evaluate_parameter_sweep(dl, candidates, max_elements=10)
+    assert np.allclose(energy["total"], dl.evaluate_parameter_sweep(candidates)["total"])
+
+    get_term_parameter = dl.get_term_parameter
+    for num in range(ncand):
+
+        def candidate_parameters(order, uid, utype=None):
+            form_type, parameters = get_term_parameter(order, uid)
+            if (order, uid) == (2, 1):
+                parameters = {k: v[num] for k, v in bond.items()}
+            elif (order, uid) == (4, 2):
+                parameters = dict(zip(dihedral_names, dihedral[num]))
+            return form_type, parameters
+
+        monkeypatch.setattr(dl, "get_term_parameter", candidate_parameters)
+        ref = _reference_energy(dl)
+        for k, v in ref.items():
+            assert pytest.approx(v) == energy[k][num]
+
+    monkeypatch.setattr(dl, "get_term_parameter", get_term_parameter)
+
+    # Unswept components are shared by every candidate
+    ref = dl.evaluate()
+    assert np.allclose(energy["three-body"], ref["three-body"])
+
+    with pytest.raises(ValueError):
+        dl.evaluate_parameter_sweep({(2, 1): bond, (4, 2): dihedral[:2]})
+
+    with pytest.raises(ValueError):
+        dl.evaluate_parameter_sweep({(4, 2): dihedral[:, :2]})
+
+    with pytest.raises(KeyError):
+        dl.evaluate_parameter_sweep({(2, 1): {"K": bond["K"]}})
+
+    with pytest.raises(KeyError):
+        dl.evaluate_parameter_sweep({(2, 5): dihedral})
+
+
+def test_parameter_jacobian():
+
+    dl = _build_chain_dl(15, name="test_parameter_jacobian")
+    dl.add_term_parameter(3, "harmonic", [10.0, 2.0], uid=5)
+    jacobian = dl.evaluate_parameter_jacobian()["terms"]
+
+    assert list(jacobian.index) == [(2, 1), (2, 2), (3, 1), (3, 2), (3, 5), (4, 1), (4, 2)]
+    assert np.all(jacobian.loc[(3, 5)].dropna() == 0.0)
+
+    # Central differences through the parameter sweep
+    step = 1.e-5
+    for (order, uid), row in jacobian.iterrows():
+        form_type, parameters = dl.get_term_parameter(order, uid)
+        names = eex.metadata.get_term_metadata(order, "forms", form_type)["parameters"]
+        assert set(row.dropna().index) == set(names)
+
+        candidates = np.repeat(np.array([[parameters[x] for x in names]]), 2 * len(names), axis=0)
+        for num in range(len(names)):
+            candidates[2 * num, num] += step
+            candidates[2 * num + 1, num] -= step
+
+        total = dl.evaluate_parameter_sweep({(order, uid): candidates})["total"]
+        fd = (total[::2] - total[1::2]) / (2.0 * step)
+        assert np.allclose(row[names].values, fd, rtol=1.e-5, atol=1.e-5)
+
+    scaled = dl.evaluate_parameter_jacobian(utype="0.5 * kJ * mol ** -1")["terms"]
+    assert np.allclose(scaled.fillna(0.0).values, 2.0 * jacobian.fillna(0.0).values)
+
+
+def test_evaluate_parallel():
+
+    dl = _build_chain_dl(200, name="test_evaluate_parallel")
+    ref = dl.evaluate()
+
+    # Chunks do not depend on the number of workers
+    serial = eex.energy_eval.evaluate_energy_parallel(dl, chunk_size=37)
+    parallel = eex.energy_eval.evaluate_energy_parallel(dl, nprocs=2, chunk_size=37)
+    assert serial == parallel
+    for k, v in ref.items():
+        assert pytest.approx(v) == parallel[k]
+
+    energy = dl.evaluate(nprocs=2, utype="kcal * mol ** -1")
+    assert pytest.approx(dl.evaluate(utype="kcal * mol ** -1")["total"]) == energy["total"]
+
+    with pytest.raises(ValueError):
+        dl.evaluate(nprocs=2, forces=True)
+
+    with pytest.raises(ValueError):
+        eex.energy_eval.evaluate_energy_parallel(dl, chunk_size=0)
+
+
+@pytest.mark.parametrize("backend", ["HDF5", "Memory"])
+def test_evaluate_streaming(backend):
+
+    dl = _build_chain_dl(150, name="test_evaluate_streaming_" + backend, backend=backend)
+    ref = eex.energy_eval.evaluate_energy_expression(dl, None)
+
+    # Chunks that do not divide the term counts
+    energy = eex.energy_eval.evaluate_energy_streaming(dl, chunk_size=17)
+    for k, v in ref.items():
+        assert pytest.approx(v) == energy[k]
+    assert pytest.approx(ref["total"]) == dl.evaluate()["total"]
+
+    # Partial reads by row position
+    rows = np.array([3, 10, 11, 140])
+    xyz = dl.get_atoms("xyz")
+    assert np.allclose(dl.get_atoms("xyz", rows=rows).values, xyz.values[rows])
+    assert np.all(dl.get_atom_index("xyz") == xyz.index)
+
+    chunks = list(dl.get_terms("bonds", chunksize=40))
+    assert [x.shape[0] for x in chunks] == [40, 40, 40, 29]
+    assert pd.concat(chunks).equals(dl.get_terms("bonds"))
+
+    # Terms straddling the boundary of a wrapped periodic system
+    box = 5.0
+    dl = _build_chain_dl(60, name="test_evaluate_streaming_periodic_" + backend, backend=backend,
+                         xyz=np.cumsum(np.random.rand(60, 3) * 0.5, axis=0) % box)
+    dl.set_box_size({"a": box, "b": box, "c": box, "alpha": np.pi / 2, "beta": np.pi / 2, "gamma": np.pi / 2})
+    ref = eex.energy_eval.evaluate_energy_expression(dl, None)
+    energy = eex.energy_eval.evaluate_energy_streaming(dl, utype="kcal * mol ** -1", chunk_size=9)
+    assert pytest.approx(ref["total"] / 4.184) == energy["total"]
+
+    with pytest.raises(ValueError):
+        eex.energy_eval.evaluate_energy_streaming(dl, chunk_size=0)
+
+
+def test_evaluate_batch():
+
+    dls = [_build_chain_dl(natoms, name="test_evaluate_batch%d" % natoms) for natoms in [3, 12, 7, 40]]
+
+    # A wrapped periodic molecule is made whole
+    box = 4.0
+    periodic = _build_chain_dl(30, name="test_evaluate_batch_periodic",
+                               xyz=np.cumsum(np.random.rand(30, 3) * 0.5, axis=0) % box)
+    periodic.set_box_size({"a": box, "b": box, "c": box, "alpha": np.pi / 2, "beta": np.pi / 2, "gamma": np.pi / 2})
+    dls.insert(1, periodic)
+
+    energies = eex.energy_eval.evaluate_energy_batch(dls, utype="kcal * mol ** -1")
+    assert len(energies) == len(dls)
+    for dl, energy in zip(dls, energies):
+        ref = eex.energy_eval.evaluate_energy_expression(dl, "kcal * mol ** -1")
+        assert set(ref) == set(energy)
+        for k, v in ref.items():
+            assert pytest.approx(v) == energy[k]
+
+    # Nonbonded energies stay within each DataLayer
+    dls = [_build_nb_dl(natoms, name="test_evaluate_batch_nb%d" % natoms) for natoms in [5, 20]]
+    energies = eex.energy_eval.evaluate_energy_batch(dls, nonbonded=True)
+    for dl, energy in zip(dls, energies):
+        ref = eex.energy_eval.evaluate_energy_expression(dl, None, nonbonded=True)
+        assert set(ref) == set(energy)
+        for k, v in ref.items():
+            assert pytest.approx(v) == energy[k]
+
+    assert eex.energy_eval.evaluate_energy_batch([]) == []
+
+
+@pytest.mark.parametrize("electrostatics", [False, True])
+def test_evaluate_parallel_nonbonded(electrostatics):
+
+    dl = _build_nb_dl(40, name="test_parallel_nonbonded")
+    dl.set_pair_scalings(pd.DataFrame({"atom_index1": [1, 3], "atom_index2": [2, 4], "vdw_scale": [0.0, 0.5],
+                                       "coul_scale": [0.0, 0.8333]}))
+    if electrostatics:
+        dl.set_box_size({"a": 6.0, "b": 6.0, "c": 6.0, "alpha": np.pi / 2, "beta": np.pi / 2, "gamma": np.pi / 2})
+        dl.set_electrostatics("cut", 2.5)
+
+    ref = dl.evaluate(nonbonded=True)
+    serial = eex.energy_eval.evaluate_energy_parallel(dl, nonbonded=True, tile_size=7)
+    parallel = eex.energy_eval.evaluate_energy_parallel(dl, nonbonded=True, nprocs=2, tile_size=7)
+
+    assert serial == parallel
+    assert set(ref) == set(parallel)
+    for k, v in ref.items():
+        assert pytest.approx(v) == parallel[k]
+
+
+def test_incremental_evaluator():
+
+    dl = _build_chain_dl(20, name="test_incremental")
+    evaluator = eex.energy_eval.IncrementalEvaluator(dl)
+
+    start = evaluator.energy()
+    ref = dl.evaluate()
+    for k, v in ref.items():
+        assert pytest.approx(v) == start[k]
+
+    # A rejected trial leaves the state alone
+    trial = evaluator.trial([3, 4], np.random.rand(2, 3) * 2.0)
+    assert trial["total"] != start["total"]
+    assert evaluator.energy() == start
+
+    for step in range(10):
+        atoms = np.random.choice(np.arange(1, 21), 2, replace=False)
+        evaluator.update(atoms, evaluator.coordinates[atoms - 1] + np.random.rand(2, 3) * 0.1)
+
+        ref = eex.energy_eval.evaluate_energy_frames(dl, evaluator.coordinates[None, :, :])
+        for k, v in evaluator.energy().items():
+            assert pytest.approx(ref[k][0]) == v
+
+    with pytest.raises(KeyError):
+        evaluator.trial([25], [0.0, 0.0, 0.0])
+
+    with pytest.raises(ValueError):
+        evaluator.trial([1, 2], [0.0, 0.0, 0.0])
+
+    with pytest.raises(ValueError):
+        evaluator.accept()
+
+
+def test_plane_geometry():
+    geometry = eex.energy_eval.geometry
+
+    p1 = [0, 0, 0]
+    p2 = [1, 0, 0]
+    p3 = [0, 1, 0]
+
+    assert pytest.approx(1.0) == geometry.compute_plane_distance([0, 0, 1], p1, p2, p3)
+    assert pytest.approx(-2.0) == geometry.compute_plane_distance([3, 2, -2], p1, p2, p3)
+
+    assert pytest.approx(45.0) == geometry.compute_plane_angle(p1, p2, p3, [1, 0, 1], degrees=True)
+    assert pytest.approx(-np.pi / 2) == geometry.compute_plane_angle(p1, p2, p3, [0, 0, -3])
+    assert pytest.approx(0.0) == geometry.compute_plane_angle(p1, p2, p3, [2, 5, 0])
+
+
+@pytest.mark.parametrize("kernel, func, npoints", [
+    ("indexed_distance", "compute_distance", 2),
+    ("indexed_angle", "compute_angle", 3),
+    ("indexed_dihedral", "compute_dihedral", 4),
+    ("indexed_plane_distance", "compute_plane_distance", 4),
+    ("indexed_plane_angle", "compute_plane_angle", 4),
+])
+def test_indexed_geometry(kernel, func, npoints):
+    kernel = getattr(eex.energy_eval.geometry, kernel)
+    func = getattr(eex.energy_eval.geometry, func)
+
+    # Distinct atoms within every term
+    coords = np.random.rand(50, 3) * 5.0
+    terms = np.array([np.random.permutation(50)[:npoints] for x in range(40)])
+    indices = [terms[:, x] for x in range(npoints)]
+    ref = func(*[coords[x] for x in indices])
+
+    # Blocks that do not divide the number of terms
+    assert np.allclose(ref, kernel(coords, *indices, block_size=7))
+
+    # Caller provided buffers are filled in place
+    out = np.zeros(40)
+    assert kernel(coords, *indices, out=out) is out
+    assert np.allclose(ref, out)
+
+    single = kernel(coords, *indices, dtype=np.float32)
+    assert single.dtype == np.float32
+    assert np.allclose(ref, single, atol=1.e-4)
+
+    assert kernel(coords, *[x[:0] for x in indices]).shape == (0, )
+
+    with pytest.raises(IndexError):
+        kernel(coords, *([np.array([50])] * npoints))
+
+    with pytest.raises(ValueError):
+        kernel(coords, *indices, out=np.zeros(10))
+
+    with pytest.raises(TypeError):
+        kernel(coords, *indices, dtype=np.int64)
+
+
+def test_evaluate_declared_variables():
+
+    dl = eex.datalayer.DataLayer("test_declared_variables")
+    xyz = np.random.rand(4, 3) * 2.0
+    atom_df = pd.DataFrame(xyz, columns=["X", "Y", "Z"])
+    atom_df["atom_index"] = np.arange(1, 5)
+    dl.add_atoms(atom_df)
+
+    # A Urey-Bradley angle and every improper variable
+    dl.add_term_parameter(3, "charmm", [40.0, 1.8, 20.0, 2.4], uid=1)
+    dl.add_term_parameter(4, "harmonic_improper", [10.0, 0.2], uid=1)
+    dl.add_term_parameter(4, "distance_improper", [5.0, 1.0], uid=2)
+    dl.add_term_parameter(4, "fourier_improper", [2.0, 0.5, 0.3, 0.1], uid=3)
+    dl.add_terms(3, pd.DataFrame([[1, 2, 3, 1]], columns=["atom1", "atom2", "atom3", "term_index"]))
+    dl.add_terms(4, pd.DataFrame([[1, 2, 3, 4, 1], [1, 2, 3, 4, 2], [1, 2, 3, 4, 3]],
+                                 columns=["atom1", "atom2", "atom3", "atom4", "term_index"]))
+
+    geometry = eex.energy_eval.geometry
+    theta = geometry.compute_angle(xyz[0], xyz[1], xyz[2])[0]
+    r13 = geometry.compute_distance(xyz[0], xyz[2])[0]
+    chi = geometry.compute_dihedral(*xyz)[0]
+    r = geometry.compute_plane_distance(*xyz)[0]
+    omega = geometry.compute_plane_angle(*xyz)[0]
+
+    energy = dl.evaluate()
+    assert pytest.approx(40.0 * (theta - 1.8)**2 + 20.0 * (r13 - 2.4)**2) == energy["three-body"]
+    ref = 10.0 * (chi - 0.2)**2 + 5.0 * r**2 + r**4 + 2.0 * (0.5 + 0.3 * np.cos(omega) + 0.1 * np.cos(2 * omega))
+    assert pytest.approx(ref) == energy["four-body"]
+
+    # The improper plane distance and angle have no analytic gradients
+    with pytest.raises(KeyError):
+        dl.evaluate(forces=True)
+
+
+def test_term_variables_lazy():
+
+    coords = np.random.rand(5, 3)
+    positions = [np.array([0, 1, 2]), np.array([1, 2, 3]), np.array([2, 3, 4])]
+    variables = eex.energy_eval.expression_eval._TermVariables(3, coords, positions)
+
+    local_dict = variables.select(["K", "r13"], np.array([0, 2]))
+    assert list(local_dict) == ["r13"]
+    assert list(variables._values) == ["r13"]
+    assert np.allclose(local_dict["r13"], eex.energy_eval.geometry.compute_distance(coords[[0, 2]], coords[[2, 4]]))
+
+    # Shared variables are computed once
+    first = variables["theta"]
+    assert variables["theta"] is first
+
+
+def test_evaluate_forces_declared_variables():
+
+    dl = eex.datalayer.DataLayer("test_forces_declared_variables")
+    atom_df = pd.DataFrame(np.random.rand(4, 3) * 2.0, columns=["X", "Y", "Z"])
+    atom_df["atom_index"] = np.arange(1, 5)
+    dl.add_atoms(atom_df)
+
+    dl.add_term_parameter(3, "charmm", [40.0, 1.8, 20.0, 2.4], uid=1)
+    dl.add_term_parameter(4, "harmonic_improper", [10.0, 0.2], uid=1)
+    dl.add_terms(3, pd.DataFrame([[1, 2, 3, 1], [2, 3, 4, 1]], columns=["atom1", "atom2", "atom3", "term_index"]))
+    dl.add_terms(4, pd.DataFrame([[1, 2, 3, 4, 1]], columns=["atom1", "atom2", "atom3", "atom4", "term_index"]))
+
+    energy, forces = dl.evaluate(forces=True)
+
+    xyz = dl.get_atoms("xyz").values
+    step = 1.e-6
+    for atom in range(4):
+        for dim in range(3):
+            upper = xyz.copy()
+            lower = xyz.copy()
+            upper[atom, dim] += step
+            lower[atom, dim] -= step
+            frames = eex.energy_eval.evaluate_energy_frames(dl, np.array([upper, lower]))["total"]
+            assert pytest.approx(-(frames[0] - frames[1]) / (2 * step), abs=1.e-4) == forces[atom, dim]
+
+
+def test_evaluate_decompose():
+
+    natoms = 12
+    properties = {"molecule_index": np.arange(natoms) // 6 + 1, "residue_index": np.arange(natoms) // 3 + 1}
+    dl = _build_chain_dl(natoms, name="test_decompose", atom_properties=properties)
+
+    energy, decomposition = dl.evaluate(decompose=True)
+    assert energy == dl.evaluate()
+
+    # Every reduction sums back to the totals
+    for k in ["two-body", "three-body", "four-body"]:
+        assert pytest.approx(energy[k]) == decomposition["uid"][k].sum()
+        assert pytest.approx(energy[k]) == decomposition["atom"][k].sum()
+        assert pytest.approx(energy[k]) == decomposition["molecule"][k].sum()
+        assert pytest.approx(energy[k]) == decomposition["residue"][k].sum()
+    assert pytest.approx(energy["total"]) == decomposition["atom"]["total"].sum()
+    assert list(decomposition["molecule"].index) == [1, 2]
+    assert list(decomposition["residue"].index) == [1, 2, 3, 4]
+
+    # Per uid energies match the terms evaluated one at a time
+    xyz = dl.get_atoms("xyz")
+    bonds = dl.get_terms(2)
+    ref = {}
+    for idx, row in bonds.iterrows():
+        r = eex.energy_eval.geometry.compute_distance(xyz.loc[row["atom1"]].values, xyz.loc[row["atom2"]].values)
+        form_type, parameters = dl.get_term_parameter(2, row["term_index"])
+        parameters["r"] = r
+        form = eex.metadata.get_term_metadata(2, "forms", form_type)["form"]
+        term_energy = float(eex.energy_eval.evaluate_form(form, parameters))
+        ref[row["term_index"]] = ref.get(row["term_index"], 0.0) + term_energy
+    for uid, value in ref.items():
+        assert pytest.approx(value) == decomposition["uid"]["two-body"][uid]
+
+    # Forces and decompositions together
+    energy, forces, decomposition = dl.evaluate(forces=True, decompose=True, utype="kcal * mol ** -1")
+    assert forces.shape == (natoms, 3)
+    assert pytest.approx(energy["total"]) == decomposition["atom"]["total"].sum()
+
+    with pytest.raises(ValueError):
+        dl.evaluate(nonbonded=True, decompose=True)
+
+
+@pytest.mark.parametrize("order, variable", [(2, "r"), (3, "theta"), (4, "phi")])
+def test_differentiate_form(order, variable):
+
+    # Values inside of the domain of every registered form
+    np.random.seed(1)
+    values = {"n": np.array([1.0, 2.0, 3.0, 2.0, 1.0]), "R0": np.random.rand(5) + 2.0, "delta": np.random.rand(5) + 2.0}
+
+    step = 1.e-6
+    for form_name, form_md in eex.metadata.get_term_metadata(order, "forms").items():
+        kernel = eex.energy_eval.form_compiler.get_term_kernel(order, form_name)
+        if variable not in kernel.input_names: continue
+
+        local_dict = {k: values.get(k, np.random.rand(5) + 0.5) for k in form_md["parameters"]}
+        for name in eex.metadata.get_term_metadata(order, "variables"):
+            local_dict[name] = np.random.rand(5) * 0.3 + 1.2
+
+        upper = dict(local_dict, **{variable: local_dict[variable] + step})
+        lower = dict(local_dict, **{variable: local_dict[variable] - step})
+        finite_difference = (kernel(upper) - kernel(lower)) / (2 * step)
+
+        dkernel = eex.energy_eval.form_compiler.get_term_derivative_kernel(order, form_name, variable)
+        assert np.allclose(finite_difference, dkernel(local_dict), rtol=1.e-5, atol=1.e-6), form_name
+
+    with pytest.raises(KeyError):
+        eex.energy_eval.form_compiler.differentiate_form("where(r > 1, r, 0)", "r")
+
+
+def test_geometry_gradients():
+
+    geometry = eex.energy_eval.geometry
+    points = [np.random.rand(6, 3) * 3.0 for x in range(4)]
+
+    step = 1.e-6
+    for func, gradient_func, npoints in [(geometry.compute_distance, geometry.distance_gradient, 2),
+                                         (geometry.compute_angle, geometry.angle_gradient, 3),
+                                         (geometry.compute_dihedral, geometry.dihedral_gradient, 4)]:
+        value, gradients = gradient_func(*points[:npoints])
+        assert np.allclose(value, func(*points[:npoints]))
+
+        # Translational invariance
+        assert np.allclose(sum(gradients), 0.0)
+
+        for atom in range(npoints):
+            for dim in range(3):
+                upper = [x.copy() for x in points[:npoints]]
+                lower = [x.copy() for x in points[:npoints]]
+                upper[atom][:, dim] += step
+                lower[atom][:, dim] -= step
+                finite_difference = (func(*upper) - func(*lower)) / (2 * step)
+                assert np.allclose(finite_difference, gradients[atom][:, dim], atol=1.e-6)
+
+
+def test_evaluate_forces():
+
+    dl = _build_chain_dl(8, name="test_forces")
+    energy, forces = dl.evaluate(forces=True)
+    assert pytest.approx(dl.evaluate()["total"]) == energy["total"]
+    assert forces.shape == (8, 3)
+
+    xyz = dl.get_atoms("xyz")
+    step = 1.e-6
+    for atom in range(xyz.shape[0]):
+        for dim in range(3):
+            upper = xyz.copy()
+            lower = xyz.copy()
+            upper.iloc[atom, dim] += step
+            lower.iloc[atom, dim] -= step
+            finite_difference = (_reference_energy(dl, upper)["total"] - _reference_energy(dl, lower)["total"]) / (
+                2 * step)
+            assert pytest.approx(-finite_difference, abs=1.e-4) == forces[atom, dim]
+
+    # Forces are converted with the energy
+    kcal_energy, kcal_forces = dl.evaluate(utype="kcal * mol ** -1", forces=True)
+    assert np.allclose(kcal_forces * 4.184, forces)
+
+    with pytest.raises(ValueError):
+        dl.evaluate(nonbonded=True, forces=True)
+
+
+def _build_nb_dl(natoms, name="test_nonbonded"):
+    """
+    Builds a random cloud of charged LJ atoms with two atom types
+    """
+
+    dl = eex.datalayer.DataLayer(name)
+
+    atom_df = pd.DataFrame(np.random.rand(natoms, 3) * 6.0, columns=["X", "Y", "Z"])
+    atom_df["atom_index"] = np.arange(1, natoms + 1)
+    atom_df["atom_type"] = np.arange(natoms) % 2 + 1
+    atom_df["charge"] = np.random.rand(natoms) - 0.5
+    dl.add_atoms(atom_df, by_value=True)
+
+    dl.set_mixing_rule("lorentz-berthelot")
+    dl.add_nb_parameter(atom_type=1, nb_name="LJ", nb_model="epsilon/sigma", nb_parameters=[0.5, 1.2])
+    dl.add_nb_parameter(atom_type=2, nb_name="LJ", nb_model="epsilon/sigma", nb_parameters=[0.2, 1.6])
+
+    return dl
+
+
+def _reference_nb_energy(dl, scalings=None):
+    """
+    Evaluates every pair one at a time
+    """
+
+    if scalings is None:
+        scalings = {}
+
+    xyz = dl.get_atoms("xyz")
+    data = dl.get_atoms(["atom_type", "charge"], by_value=True)
+    coul_constant = eex.energy_eval.nb_eval.coulomb_constant()
+
+    energy = {"vdw": 0.0, "coul": 0.0}
+    for i in xyz.index:
+        for j in xyz.index:
+            if j <= i: continue
+
+            r = eex.energy_eval.geometry.compute_distance(xyz.loc[i].values, xyz.loc[j].values)
+            params = eex.nb_converter.mix_LJ(
+                dl.get_nb_parameter(data.loc[i, "atom_type"]),
+                dl.get_nb_parameter(data.loc[j, "atom_type"]), "lorentz-berthelot")
+            vdw_scale, coul_scale = scalings.get((i, j), (1.0, 1.0))
+
+            energy["vdw"] += vdw_scale * (params["A"] / r**12 - params["B"] / r**6)
+            energy["coul"] += coul_scale * coul_constant * data.loc[i, "charge"] * data.loc[j, "charge"] / r
+
+    return energy
+
+
+def test_coulomb_constant():
+
+    assert pytest.approx(332.0637, abs=1.e-4) == eex.energy_eval.nb_eval.coulomb_constant(
+        "kcal * mol ** -1 * angstrom * elementary_charge ** -2")
+
+
+def test_pair_tiles():
+
+    pairs = [(i, j) for i, j in zip(*np.triu_indices(11, 1))]
+
+    tiled = []
+    for i, j in eex.energy_eval.nb_eval.pair_tiles(11, tile_size=4):
+        assert i.shape[0] <= 16
+        tiled.extend(zip(i, j))
+
+    assert sorted(tiled) == pairs
+
+
+def test_evaluate_nonbonded():
+
+    dl = _build_nb_dl(20)
+    reference = _reference_nb_energy(dl)
+
+    energy = dl.evaluate(nonbonded=True)
+    assert pytest.approx(reference["vdw"]) == energy["vdw"]
+    assert pytest.approx(reference["coul"]) == energy["coul"]
+    assert pytest.approx(energy["vdw"] + energy["coul"]) == energy["total"]
+
+    # Tiles do not change the energy
+    tiled = eex.energy_eval.evaluate_energy_expression(dl, None, nonbonded=True, tile_size=3)
+    assert eex.testing.dict_compare(energy, tiled)
+
+    # Nonbonded terms are opt-in
+    assert "vdw" not in dl.evaluate()
+
+
+def test_evaluate_nonbonded_scalings():
+
+    dl = _build_nb_dl(12)
+
+    # Repeated and reversed pairs only count once
+    scaling_df = pd.DataFrame({
+        "atom_index1": [1, 2, 4, 3],
+        "atom_index2": [2, 1, 3, 7],
+        "vdw_scale": [0.0, 0.0, 0.5, 1.0],
+        "coul_scale": [0.0, 0.0, 0.8333, 0.0]
+    })
+    dl.set_pair_scalings(scaling_df)
+
+    scalings = {(1, 2): (0.0, 0.0), (3, 4): (0.5, 0.8333), (3, 7): (1.0, 0.0)}
+    reference = _reference_nb_energy(dl, scalings)
+
+    energy = dl.evaluate(nonbonded=True)
+    assert pytest.approx(reference["vdw"]) == energy["vdw"]
+    assert pytest.approx(reference["coul"]) == energy["coul"]
+
+
+@pytest.mark.parametrize("electrostatics", [False, True])
+def test_parameter_jacobian_nonbonded(electrostatics):
+
+    dl = _build_nb_dl(20, name="test_jacobian_nonbonded")
+    dl.set_pair_scalings(pd.DataFrame({"atom_index1": [1, 3], "atom_index2": [2, 4], "vdw_scale": [0.0, 0.5]}))
+    if electrostatics:
+        dl.set_box_size({"a": 6.0, "b": 6.0, "c": 6.0, "alpha": np.pi / 2, "beta": np.pi / 2, "gamma": np.pi / 2})
+        dl.set_electrostatics("cut", 2.5)
+
+    jacobian = dl.evaluate_parameter_jacobian(nonbonded=True)["nonbonded"]
+    assert list(jacobian.columns) == ["A", "B"]
+    assert list(jacobian.index) == [(1, 1), (1, 2), (2, 2)]
+
+    # The LJ energy is linear in A and B
+    atom_types = dl.get_atoms("atom_type").values.ravel()
+    tables = eex.energy_eval.expression_eval._build_nb_tables(dl, atom_types)[2]
+    vdw = 0.0
+    for (type1, type2), row in jacobian.iterrows():
+        vdw += tables["A"][type1 - 1, type2 - 1] * row["A"] + tables["B"][type1 - 1, type2 - 1] * row["B"]
+
+    assert pytest.approx(dl.evaluate(nonbonded=True)["vdw"]) == vdw
+
+
+def test_evaluate_nonbonded_pair_parameters():
+
+    dl = _build_nb_dl(6)
+
+    # Explicit pair parameters take precedence over the mixing rule
+    dl.add_nb_parameter(atom_type=1, atom_type2=2, nb_name="LJ", nb_model="AB", nb_parameters=[0.0, 0.0])
+    mixed = eex.energy_eval.expression_eval._build_nb_tables(dl, np.array([1, 2, 2]))
+    assert mixed[0] == "LJ"
+    assert np.allclose(mixed[2]["A"][0, 1], 0.0)
+    assert mixed[2]["A"][0, 0] > 0.0
+
+    # Unknown types raise
+    with pytest.raises(KeyError):
+        eex.energy_eval.expression_eval._build_nb_tables(dl, np.array([1, 3]))
+
+
+def test_box_matrix():
+
+    # Round trip through the LAMMPS tilt factors
+    bsize = {"x": 10.0, "y": 11.0, "z": 12.0}
+    tilt = {"xy": 1.5, "xz": -2.0, "yz": 0.5}
+    lattice = eex.translators.lammps.lammps_utility.compute_lattice_constants(bsize, tilt)
+
+    H = eex.energy_eval.geometry.box_matrix(lattice)
+    ref = np.array([[10.0, 0.0, 0.0], [1.5, 11.0, 0.0], [-2.0, 0.5, 12.0]])
+    assert np.allclose(H, ref)
+
+    # Orthorhombic boxes are diagonal
+    H = eex.energy_eval.geometry.box_matrix({"a": 3.0, "b": 4.0, "c": 5.0, "alpha": np.pi / 2, "beta": np.pi / 2,
+                                             "gamma": np.pi / 2})
+    assert np.allclose(H, np.diag([3.0, 4.0, 5.0]))
+    assert np.all(H[np.triu_indices(3, 1)] == 0.0)
+
+
+def _brute_force_pairs(coords, cutoff, H=None):
+    """
+    Finds every pair within the cutoff using minimum image distances
+    """
+
+    i, j = np.triu_indices(coords.shape[0], 1)
+    dR = coords[j] - coords[i]
+    if H is not None:
+        frac = np.dot(dR, np.linalg.inv(H))
+        frac -= np.round(frac)
+        dR = np.dot(frac, H)
+
+    r = np.sqrt(np.einsum("ij,ij->i", dR, dR))
+    mask = r < cutoff
+    return i[mask], j[mask], r[mask]
+
+
+def _compare_pairs(pairs, ref_pairs):
+    """
+    Compares two (i, j, r) pair lists regardless of their order
+    """
+
+    sort = np.lexsort((pairs[1], pairs[0]))
+    ref_sort = np.lexsort((ref_pairs[1], ref_pairs[0]))
+    for x in range(2):
+        assert np.array_equal(pairs[x][sort], ref_pairs[x][ref_sort])
+    assert np.allclose(pairs[2][sort], ref_pairs[2][ref_sort])
+
+
+_triclinic = {"a": 10.0, "b": 11.0, "c": 12.0, "alpha": np.radians(80), "beta": np.radians(95),
+              "gamma": np.radians(70)}
+
+
+@pytest.mark.parametrize("box", [None, np.array([10.0, 11.0, 12.0]), _triclinic, np.array([6.0, 6.0, 6.0])])
+@pytest.mark.parametrize("cutoff", [1.5, 2.9])
+@pytest.mark.parametrize("subdivisions", [1, 2, 3])
+def test_find_pairs(box, cutoff, subdivisions):
+
+    coords = np.random.rand(250, 3) * 10.0
+    i, j, r = eex.energy_eval.neighbor_list.find_pairs(
+        coords, cutoff, box=box, max_candidates=500, cell_subdivisions=subdivisions)
+
+    H = None
+    if box is not None:
+        H = eex.energy_eval.neighbor_list._box_data(box, None)[0]
+    ref_i, ref_j, ref_r = _brute_force_pairs(coords, cutoff, H)
+
+    assert np.all(i < j)
+    _compare_pairs((i, j, r), (ref_i, ref_j, ref_r))
+
+
+def test_find_pairs_cutoff():
+
+    coords = np.random.rand(10, 3)
+    with pytest.raises(ValueError):
+        eex.energy_eval.neighbor_list.find_pairs(coords, 3.0, box=np.array([5.0, 5.0, 5.0]))
+
+    with pytest.raises(ValueError):
+        eex.energy_eval.neighbor_list.find_pairs(coords, 0.0)
+
+
+def test_neighbor_list_skin():
+
+    box = np.array([12.0, 12.0, 12.0])
+    coords = np.random.rand(200, 3) * 12.0
+
+    nlist = eex.energy_eval.neighbor_list.NeighborList(3.0, skin=1.0, box=box)
+    i, j, r = nlist.get_pairs(coords)
+    assert nlist.nbuilds == 1
+
+    # Small moves, including across the periodic boundary, reuse the list
+    moved = coords + (np.random.rand(200, 3) - 0.5) * 0.5
+    assert not nlist.needs_rebuild(moved)
+    i, j, r = nlist.get_pairs(moved)
+    assert nlist.nbuilds == 1
+
+    _compare_pairs((i, j, r), _brute_force_pairs(moved, 3.0, np.diag(box)))
+
+    # Large moves rebuild the list
+    moved[0] += 1.0
+    assert nlist.update(moved)
+    assert nlist.nbuilds == 2
+
+
+def test_neighbor_list_datalayer():
+
+    dl = eex.datalayer.DataLayer("test_neighbor_list")
+    assert eex.energy_eval.neighbor_list.NeighborList.from_datalayer(dl, 2.0).box is None
+
+    dl.set_box_size({"a": 10.0, "b": 10.0, "c": 10.0, "alpha": np.pi / 2, "beta": np.pi / 2, "gamma": np.pi / 2})
+    dl.set_box_center({"x": 0.0, "y": 0.0, "z": 0.0})
+    nlist = eex.energy_eval.neighbor_list.NeighborList.from_datalayer(dl, 2.0, skin=0.5)
+
+    assert np.allclose(nlist.box, np.diag([10.0, 10.0, 10.0]))
+    assert np.allclose(nlist.origin, [-5.0, -5.0, -5.0])
+
+
+def test_evaluate_cache(monkeypatch):
+
+    dl = _build_chain_dl(10, name="test_evaluate_cache")
+    ref = dl.evaluate()
+
+    calls = []
+    evaluate = eex.energy_eval.evaluate_energy_expression
+
+    def counted(*args, **kwargs):
+        calls.append(kwargs)
+        return evaluate(*args, **kwargs)
+
+    monkeypatch.setattr(eex.energy_eval, "evaluate_energy_expression", counted)
+
+    # Disabled by default
+    dl.evaluate()
+    assert len(calls) == 1
+
+    dl.set_evaluate_cache(maxsize=2)
+    energy = dl.evaluate()
+    assert dl.evaluate() == energy == ref
+    assert len(calls) == 2
+
+    # Returned results are copies
+    energy["total"] = 0.0
+    assert dl.evaluate()["total"] == ref["total"]
+    assert len(calls) == 2
+
+    # Arguments are part of the key and the cache is bounded
+    dl.evaluate(utype="kcal * mol ** -1")
+    energy, forces = dl.evaluate(forces=True)
+    assert len(calls) == 4
+    dl.evaluate()
+    assert len(calls) == 5
+
+    # Mutations drop the cache
+    dl.add_term_parameter(2, "harmonic", [100.0, 1.0], uid=3)
+    assert dl.evaluate() == ref
+    assert len(calls) == 6
+
+    with pytest.raises(KeyError):
+        dl.add_term_parameter(2, "harmonic", [100.0, 1.0], uid=1)
+    dl.evaluate()
+    assert len(calls) == 7
+
+    dl.set_evaluate_cache(0)
+    dl.evaluate()
+    assert len(calls) == 8
+
+    with pytest.raises(ValueError):
+        dl.set_evaluate_cache(-1)
+
+
+def _wrap(coords, H):
+    """
+    Wraps coordinates into the periodic box
+    """
+    return coords - np.dot(np.floor(np.dot(coords, np.linalg.inv(H))), H)
+
+
+_periodic_boxes = [np.diag([6.0, 7.0, 8.0]), eex.energy_eval.geometry.box_matrix(_triclinic)]
+
+
+@pytest.mark.parametrize("H", _periodic_boxes)
+@pytest.mark.parametrize("kernel, func, npoints", [
+    ("indexed_distance", "compute_distance", 2),
+    ("indexed_angle", "compute_angle", 3),
+    ("indexed_dihedral", "compute_dihedral", 4),
+    ("indexed_plane_distance", "compute_plane_distance", 4),
+    ("indexed_plane_angle", "compute_plane_angle", 4),
+])
+def test_minimum_image_geometry(H, kernel, func, npoints):
+    kernel = getattr(eex.energy_eval.geometry, kernel)
+    func = getattr(eex.energy_eval.geometry, func)
+
+    # A cluster around the box corner, most terms straddle the boundary once wrapped
+    coords = np.random.rand(50, 3) * 2.0 - 1.0
+    wrapped = _wrap(coords, H)
+    assert not np.allclose(coords, wrapped)
+
+    terms = np.array([np.random.permutation(50)[:npoints] for x in range(40)])
+    indices = [terms[:, x] for x in range(npoints)]
+    ref = func(*[coords[x] for x in indices])
+
+    assert np.allclose(ref, func(*[wrapped[x] for x in indices], box=H))
+    assert np.allclose(ref, kernel(wrapped, *indices, box=H, block_size=7))
+    assert np.allclose(ref, kernel(wrapped, *indices, box=H, dtype=np.float32), atol=1.e-4)
+
+    with pytest.raises(ValueError):
+        kernel(wrapped, *indices, box=np.ones(3))
+
+
+@pytest.mark.parametrize("H", _periodic_boxes)
+def test_make_whole(H):
+
+    # Random walk chains of different lengths and a few free atoms
+    lengths = [1, 2, 7, 15, 30, 3, 1]
+    chains = []
+    bonds = []
+    for length in lengths:
+        start = sum(x.shape[0] for x in chains)
+        steps = np.random.rand(length, 3) - 0.5
+        steps /= np.linalg.norm(steps, axis=1)[:, None]
+        chains.append(np.random.rand(3) * 6.0 + np.cumsum(steps, axis=0))
+        bonds.extend([(start + x, start + x + 1) for x in range(length - 1)])
+
+    coords = np.concatenate(chains)
+    bonds = np.array(bonds)[np.random.permutation(len(bonds))]
+    wrapped = _wrap(coords, H)
+
+    whole = eex.energy_eval.geometry.make_whole(wrapped, bonds, H)
+
+    # Each molecule is shifted by the lattice translation of its first atom
+    start = 0
+    for length in lengths:
+        shift = whole[start:start + length] - coords[start:start + length]
+        assert np.allclose(shift, shift[0])
+        assert np.allclose(whole[start], wrapped[start])
+        start += length
+
+    with pytest.raises(IndexError):
+        eex.energy_eval.geometry.make_whole(wrapped, [[0, coords.shape[0]]], H)
+
+
+def test_evaluate_periodic():
+
+    H = np.diag([10.0, 10.0, 10.0])
+    coords = np.random.rand(12, 3) * 2.0 - 1.0
+    wrapped = _wrap(coords, H)
+
+    dl = _build_chain_dl(12, name="test_evaluate_periodic", xyz=wrapped)
+    ref = _reference_energy(dl, pd.DataFrame(coords, index=np.arange(1, 13), columns=["X", "Y", "Z"]))
+
+    dl.set_box_size({"a": 10.0, "b": 10.0, "c": 10.0, "alpha": np.pi / 2, "beta": np.pi / 2, "gamma": np.pi / 2})
+    energy, forces = dl.evaluate(forces=True)
+    for k in ref:
+        assert np.isclose(ref[k], energy[k])
+
+    assert np.isclose(ref["total"], eex.energy_eval.IncrementalEvaluator(dl).energy()["total"])
+
+    # Central differences of the wrapped frames
+    step = 1.e-5
+    frames = np.repeat(wrapped[None, :, :], 72, axis=0)
+    frames[np.arange(36), np.arange(36) // 3, np.arange(36) % 3] += step
+    frames[36 + np.arange(36), np.arange(36) // 3, np.arange(36) % 3] -= step
+    frame_energy = dl.evaluate_frames(frames)["total"]
+    fd_forces = -(frame_energy[:36] - frame_energy[36:]) / (2.0 * step)
+    assert np.allclose(forces.ravel(), fd_forces, atol=1.e-4)
+
+    # The stored coordinates are wrapped, the whole molecule is a single translation of the original
+    whole = dl.get_whole_xyz()
+    assert np.allclose(whole.values - coords, whole.values[0] - coords[0])
+    assert np.allclose(whole.values[0], wrapped[0])
+
+
+def test_erfc():
+
+    x = np.linspace(0.0, 6.0, 50)
+    ref = np.array([math.erfc(v) for v in x])
+    assert np.allclose(eex.energy_eval.ewald.erfc(x), ref, rtol=2.e-7, atol=0.0)
+
+
+@pytest.mark.parametrize("order", [2, 4, 5, 6])
+def test_bspline_weights(order):
+
+    w = np.random.rand(20)
+    weights = eex.energy_eval.ewald.bspline_weights(w, order)
+    assert weights.shape == (20, order)
+    assert np.allclose(weights.sum(axis=1), 1.0)
+    assert np.all(weights >= 0.0)
+
+
+def test_pme_reciprocal():
+
+    H = eex.energy_eval.geometry.box_matrix(_triclinic)
+    coords = np.random.rand(100, 3) * 10.0
+    charges = np.random.rand(100) - 0.5
+    charges -= charges.mean()
+
+    ref = eex.energy_eval.ewald.ewald_reciprocal_energy(coords, charges, H, 0.35, kmax=8)
+
+    # Converges with grid size and order
+    coarse = eex.energy_eval.ewald.pme_reciprocal_energy(coords, charges, H, 0.35, grid_size=16, order=4)
+    fine = eex.energy_eval.ewald.pme_reciprocal_energy(coords, charges, H, 0.35, grid_size=48, order=6)
+    assert abs(fine - ref) < abs(coarse - ref)
+    assert pytest.approx(ref, rel=1.e-7) == fine
+
+    # Default grids meet the requested accuracy
+    default = eex.energy_eval.ewald.pme_reciprocal_energy(coords, charges, H, 0.35, accuracy=1.e-6)
+    assert pytest.approx(ref, rel=1.e-4) == default
+
+
+def _build_rocksalt_dl(ncells, name="test_rocksalt"):
+    """
+    Builds a periodic rock salt crystal of ncells ** 3 conventional cells
+    """
+
+    lattice = 5.64
+    grid = np.array(list(itertools.product(range(2 * ncells), repeat=3)))
+
+    dl = eex.datalayer.DataLayer(name)
+    atom_df = pd.DataFrame(grid * lattice / 2, columns=["X", "Y", "Z"])
+    atom_df["atom_index"] = np.arange(1, grid.shape[0] + 1)
+    atom_df["atom_type"] = grid.sum(axis=1) % 2 + 1
+    atom_df["charge"] = (-1.0)**grid.sum(axis=1)
+    dl.add_atoms(atom_df, by_value=True)
+
+    length = ncells * lattice
+    dl.set_box_size({"a": length, "b": length, "c": length, "alpha": np.pi / 2, "beta": np.pi / 2,
+                     "gamma": np.pi / 2})
+    return dl
+
+
+@pytest.mark.parametrize("method", ["pme", "ewald"])
+def test_rocksalt_madelung(method):
+
+    dl = _build_rocksalt_dl(2)
+    dl.set_electrostatics(method, 5.6, {"accuracy": 1.e-7})
+    energy = dl.evaluate(nonbonded=True)
+
+    # The Madelung energy per ion pair
+    madelung = -1.747564594633 * eex.energy_eval.nb_eval.coulomb_constant() / (5.64 / 2)
+    per_pair = (energy["coul"] + energy["coul_long"]) / (dl.get_atom_count() / 2)
+    assert pytest.approx(madelung, rel=1.e-6) == per_pair
+    assert energy["vdw"] == 0.0
+
+
+def test_pme_exclusions():
+
+    dl = _build_rocksalt_dl(1)
+    dl.set_electrostatics("pme", 2.8, {"g_ewald": 1.2, "grid_size_x": 24, "grid_size_y": 24, "grid_size_z": 24,
+                                       "order": 6})
+    full = dl.evaluate(nonbonded=True)
+
+    # Scaled pairs, including one across the boundary, are removed at their minimum image distance
+    scaling_df = pd.DataFrame({"atom_index1": [1, 1, 2], "atom_index2": [2, 5, 4], "coul_scale": [0.0, 0.5, 0.25]})
+    dl.set_pair_scalings(scaling_df)
+    scaled = dl.evaluate(nonbonded=True)
+
+    xyz = dl.get_atoms("xyz").values
+    charges = dl.get_atoms("charge", by_value=True)["charge"].values
+    H = np.diag([5.64] * 3)
+    correction = 0.0
+    for i, j, scale in [(0, 1, 0.0), (0, 4, 0.5), (1, 3, 0.25)]:
+        r = np.linalg.norm(eex.energy_eval.geometry.minimum_image(xyz[j] - xyz[i], H))
+        correction += (scale - 1.0) * charges[i] * charges[j] / r
+    correction *= eex.energy_eval.nb_eval.coulomb_constant()
+
+    total = scaled["coul"] + scaled["coul_long"]
+    assert pytest.approx(full["coul"] + full["coul_long"] + correction, rel=1.e-6) == total
+
+
+def test_cut_electrostatics():
+
+    dl = _build_nb_dl(15)
+    isolated = dl.evaluate(nonbonded=True)
+
+    # A cutoff past every pair matches the isolated sum
+    dl.set_electrostatics("cut", 20.0)
+    cut = dl.evaluate(nonbonded=True)
+    for k in ["vdw", "coul"]:
+        assert pytest.approx(isolated[k]) == cut[k]
+    assert cut["coul_long"] == 0.0
+
+    # Units are converted
+    dl.set_electrostatics("cut", 2.0, utype={"cutoff": "nanometer"})
+    assert pytest.approx(20.0) == dl.get_electrostatics()["cutoff"]
+
+    with pytest.raises(KeyError):
+        dl.set_electrostatics("not_a_method", 2.0)
+
+    # Described in the metadata but not evaluated
+    with pytest.raises(KeyError):
+        dl.set_electrostatics("reaction", 2.0)
+
+    with pytest.raises(KeyError):
+        dl.set_electrostatics("pme", 2.0, {"kmaxx": 5})
+
+    # Ewald methods require a box
+    dl.set_electrostatics("pme", 5.0)
+    with pytest.raises(ValueError):
+        dl.evaluate(nonbonded=True)
+
+
+def test_damped_kernels():
+    wolf = eex.energy_eval.wolf
+
+    # Both energies vanish at the cutoff and the DSF force does too
+    assert pytest.approx(0.0, abs=1.e-12) == wolf.wolf_damping(np.array([9.0]), 0.2, 9.0)[0]
+    assert pytest.approx(0.0, abs=1.e-12) == wolf.dsf_damping(np.array([9.0]), 0.2, 9.0)[0]
+
+    r = np.array([9.0 - 1.e-5, 9.0])
+    energy = wolf.dsf_damping(r, 0.2, 9.0) / r
+    assert pytest.approx(0.0, abs=1.e-8) == (energy[1] - energy[0]) / 1.e-5
+
+    # Without damping Wolf is a shifted Coulomb potential
+    assert pytest.approx(1.0 - 2.0 / 9.0) == wolf.wolf_damping(np.array([2.0]), 0.0, 9.0)[0]
+
+    with pytest.raises(KeyError):
+        wolf.damped_coulomb_energy(np.ones(2), [0], [1], [1.0], 9.0, 0.2, method="reaction")
+
+
+@pytest.mark.parametrize("method", ["wolf", "dsf"])
+def test_damped_madelung(method):
+
+    dl = _build_rocksalt_dl(3)
+    dl.set_electrostatics(method, 8.0, {"alpha": 0.3})
+    energy = dl.evaluate(nonbonded=True)
+
+    madelung = -1.747564594633 * eex.energy_eval.nb_eval.coulomb_constant() / (5.64 / 2)
+    per_pair = energy["coul"] / (dl.get_atom_count() / 2)
+    assert pytest.approx(madelung, rel=2.e-3) == per_pair
+    assert energy["coul_long"] == 0.0
+
+
+@pytest.mark.parametrize("method", ["wolf", "dsf"])
+def test_damped_exclusions(method):
+
+    dl = _build_nb_dl(15)
+    scaling_df = pd.DataFrame({"atom_index1": [1, 2, 3], "atom_index2": [2, 3, 4], "coul_scale": [0.0, 0.5, 0.5]})
+    dl.set_pair_scalings(scaling_df)
+    dl.set_electrostatics(method, 4.0, {"alpha": 0.25})
+    energy = dl.evaluate(nonbonded=True)
+
+    # Brute force pair list
+    xyz = dl.get_atoms("xyz").values
+    charges = dl.get_atoms("charge", by_value=True)["charge"].values
+    i, j = np.triu_indices(xyz.shape[0], 1)
+    r = np.linalg.norm(xyz[j] - xyz[i], axis=1)
+    inside = r < 4.0
+
+    si = np.array([0, 1, 2])
+    sj = np.array([1, 2, 3])
+    sr = np.linalg.norm(xyz[sj] - xyz[si], axis=1)
+    scaled = (si, sj, sr, np.array([0.0, 0.5, 0.5]))
+
+    ref = eex.energy_eval.wolf.damped_coulomb_energy(charges, i[inside], j[inside], r[inside], 4.0, 0.25,
+                                                     method=method,
+                                                     coul_constant=eex.energy_eval.nb_eval.coulomb_constant(),
+                                                     scaled_pairs=scaled)
+    assert pytest.approx(ref) == energy["coul"]
+
+
 test_nb_eval_simple()
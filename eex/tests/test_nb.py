@@ -48,3 +48,49 @@ def test_LJ_mixing(mixing_rule):
 
     assert(eex.testing.dict_compare(new_coeffs, mixed_coeffs[mixing_rule]))
 
+
+
+@pytest.mark.parametrize("form", ["epsilon/sigma", "epsilon/Rmin", "AB"])
+def test_convert_LJ_coeffs_array(form):
+
+    # The last entry has no LJ interaction
+    coeffs = {'A': np.array([[1.0, 2.0], [3.0, 0.0]]), 'B': np.array([[2.0, 1.0], [0.5, 0.0]])}
+    new_coeffs = eex.nb_converter.convert_LJ_coeffs(coeffs, "AB", form)
+
+    for x in range(2):
+        for y in range(2):
+            if (x, y) == (1, 1):
+                assert all(v[x, y] == 0.0 for v in new_coeffs.values())
+                continue
+
+            ref = eex.nb_converter.convert_LJ_coeffs({k: v[x, y] for k, v in coeffs.items()}, "AB", form)
+            assert eex.testing.dict_compare({k: v[x, y] for k, v in new_coeffs.items()}, ref)
+
+    # Round trip
+    back = eex.nb_converter.convert_LJ_coeffs(new_coeffs, form, "AB")
+    assert np.allclose(back["A"], coeffs["A"])
+    assert np.allclose(back["B"], coeffs["B"])
+
+
+@pytest.mark.parametrize("mixing_rule", ["lorentz-berthelot", "geometric", "sixthpower"])
+def test_LJ_mixing_array(mixing_rule):
+
+    # The last type has no LJ interaction
+    coeffs = {'epsilon': np.array([1.0, 2.0, 0.5, 0.0]), 'sigma': np.array([1.0, 2.0, 3.0, 0.0])}
+
+    mixed = eex.nb_converter.mix_LJ({k: v[:, None] for k, v in coeffs.items()},
+                                    {k: v[None, :] for k, v in coeffs.items()},
+                                    origin="epsilon/sigma", mixing_rule=mixing_rule, final="epsilon/sigma")
+    assert mixed["epsilon"].shape == (4, 4)
+    assert np.allclose(mixed["epsilon"][3], 0.0)
+    assert np.allclose(mixed["epsilon"][:, 3], 0.0)
+
+    for x in range(3):
+        for y in range(3):
+            ref = eex.nb_converter.mix_LJ({k: float(v[x]) for k, v in coeffs.items()},
+                                          {k: float(v[y]) for k, v in coeffs.items()},
+                                          origin="epsilon/sigma", mixing_rule=mixing_rule, final="epsilon/sigma")
+            assert eex.testing.dict_compare({k: v[x, y] for k, v in mixed.items()}, ref)
+
+    with pytest.raises(KeyError):
+        eex.nb_converter.mix_LJ(coeffs, coeffs, mixing_rule="test", origin="epsilon/sigma")
@@ -30,6 +30,23 @@ def test_find_lowest_hole():
     assert 2 == eex.utility.find_lowest_hole([0, 1, 3, 4])
 
 
+def test_allclose_keys():
+
+    np.random.seed(0)
+    for x in range(200):
+        a = np.random.choice([0.0, 1.e-9, 1.0, -3.0, 1.e5]) * (1 + np.random.rand(3))
+        b = a + np.random.choice([-1, 1], 3) * (1.e-8 + 1.e-5 * np.abs(a)) * np.random.rand(3)
+
+        # allclose vectors always meet in a bucket
+        assert np.allclose(a, b)
+        assert eex.utility.allclose_keys(a)[0] in eex.utility.allclose_keys(b)
+        assert eex.utility.allclose_keys(b)[0] in eex.utility.allclose_keys(a)
+
+    assert [(0, 0)] == eex.utility.allclose_keys([0.0, -1.e-9])
+    assert eex.utility.allclose_keys([1.0])[0] != eex.utility.allclose_keys([1.1])[0]
+    assert eex.utility.allclose_keys([1.0, np.nan]) is None
+
+
 def test_hash():
 
     # Quick hash
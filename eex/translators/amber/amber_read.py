@@ -374,14 +374,10 @@ def read_amber_file(dl, filename, inpcrd=None, blocksize=5000):
 
         # Bond parameters (bond, angle, dihedral) will have an "order", the order for nonbond parameters is None
         if param_data["order"] is not None:
-            cnt = 1  # Start counting from one
-            for ind, row in dl.get_other(param_col_names).iterrows():
-                params = {}
-                for k, v in param_data["column_names"].items():
-                    params[v] = row[k]
-                uid = dl.add_term_parameter(
-                    param_data["order"], param_data["form"], params, uid=cnt, utype=param_data["units"])
-                cnt += 1
+            params = dl.get_other(param_col_names).rename(columns=param_data["column_names"])
+            params["uid"] = np.arange(1, params.shape[0] + 1)  # Start counting from one
+            dl.add_term_parameters(
+                param_data["order"], param_data["form"], params, uid_col="uid", utype=param_data["units"])
         else:
             # Get info for grabbing LJ parameters
             nb_parm_index = dl.get_other("NONBONDED_PARM_INDEX")
@@ -450,7 +446,7 @@ def read_amber_file(dl, filename, inpcrd=None, blocksize=5000):
 
             all_excluded_df = pd.concat([all_excluded_df, excluded_df])
 
-        start_index += (row.values[0] + 1)
+        start_index += row.values[0]
     
     # Much faster to build large dataframe and add all at once
     if not all_excluded_df.empty:
@@ -232,18 +232,17 @@ def read_lammps_data_file(dl, filename, extra_simulation_data, blocksize=110):
             elif op["call_type"] == "add_atom_parameters":
                 atom_prop = op["atom_property"]
                 utype = op["kwargs"]["utype"][atom_prop]
-                for idx, row in data.iterrows():
-                    dl.add_atom_parameter(atom_prop, row.iloc[1], uid=row.iloc[0], utype=utype, allow_duplicates=True)
+                data = data.iloc[:, :2]
+                data.columns = ["uid"] + eex.metadata.atom_metadata[atom_prop]["required_columns"]
+                dl.add_atom_parameters(atom_prop, data, uid_col="uid", utype=utype, allow_duplicates=True)
             # Adding parameters
             elif op["call_type"] == "parameter":
                 order = op["args"]["order"]
                 fname = op["args"]["style_keyword"]
                 cols = term_table[order][fname]["parameters"]
                 data.columns = ["uid"] + cols
-                for idx, row in data.iterrows():
-                    params = list(row[cols])
-                    utype = term_table[order][fname]["utype"]
-                    dl.add_term_parameter(order, fname, params, uid=int(row["uid"]), utype=utype)
+                utype = term_table[order][fname]["utype"]
+                dl.add_term_parameters(order, fname, data, uid_col="uid", utype=utype)
 
             elif op["call_type"] == "nb_parameter":
                 fname = op["kwargs"]["nb_name"]
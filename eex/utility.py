@@ -4,6 +4,7 @@ A EEX utility folder
 
 import os
 import hashlib
+import itertools
 from . import units
 import numpy as np
 from subprocess import PIPE, Popen
@@ -145,6 +146,50 @@ def find_lowest_hole(data):
     return new_key
 
 
+def allclose_keys(values, rtol=1.e-5, atol=1.e-8, width=100.0):
+    """
+    Builds hashable keys of a parameter vector so that np.allclose matches can be found without a full scan.
+
+    Each value is mapped to z = sign(x) * log(1 + |x| * rtol / atol) / rtol, where the np.allclose tolerance
+    atol + rtol * |x| is a distance of one, and z is then binned with the given width. Vectors that are allclose
+    always share one of the returned keys, but vectors that share a key must still be compared.
+
+    Parameters
+    ----------
+    values : array_like
+        The parameter vector
+    rtol : float, optional
+        The relative tolerance of np.allclose
+    atol : float, optional
+        The absolute tolerance of np.allclose
+    width : float, optional
+        The bin width in units of the tolerance
+
+    Returns
+    -------
+    keys : {list of tuple, None}
+        The storage key of the vector followed by the keys of neighboring bins within the tolerance. None if any value is
+        not finite.
+
+    >>> allclose_keys([1.0, 2.0])
+    [(6909, 7601)]
+    """
+
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if not np.all(np.isfinite(values)):
+        return None
+
+    z = np.sign(values) * np.log1p(np.abs(values) * (rtol / atol)) / rtol
+
+    # Bins are centered on zero, a margin over the tolerance of one covers the curvature of z and round off
+    own = np.floor(z / width + 0.5).astype(int)
+    lower = np.floor((z - 1.5) / width + 0.5).astype(int)
+    upper = np.floor((z + 1.5) / width + 0.5).astype(int)
+
+    bins = [[o] + sorted({l, u} - {o}) for o, l, u in zip(own.tolist(), lower.tolist(), upper.tolist())]
+    return list(itertools.product(*bins))
+
+
 def _build_hash_string(data, float_fmt):
 
     ret = []